@@ -67,6 +67,10 @@ CUSTOM_DISPLAY_NAMES = {
     "ImageEditNode":"Luy-图片编辑节点",
     "llama_run_lite":"Luy-AI反推Lite",
     "llama_run_simple":"Luy-LlamaCpp反推(简化版)",
+    "llama_caption_batch":"Luy-LlamaCpp目录批量反推",
+    "llama_cpp_generation_stats":"Luy-LlamaCpp生成统计",
+    "llama_cpp_tiled_ocr":"Luy-LlamaCpp分块OCR",
+    "llama_cpp_asr":"Luy-LlamaCpp语音识别",
     "SDXLPromptPickerNode": "Luy-SDXL角色提示词",
     "LuySaveImage": "Luy-保存图片到本地",
     "LlamaCppAPINode": "Luy-LlamaCpp本地API",
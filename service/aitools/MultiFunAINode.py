@@ -9,7 +9,8 @@ from aitools_base import (
     PromptManager,
     clean_think_content,
     clean_prompt_keywords,
-    register_llm_folder
+    register_llm_folder,
+    RESPONSE_CACHE
 )
 
 
@@ -35,6 +36,7 @@ class MultiFunAINode(BaseModelManager):
                 "choice_type": (prompt_types, {"default": prompt_types[0]}),
                 "prompt": ("STRING", {"multiline": True, "default": ""}),
                 "seed": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff, "step": 1}),
+                "use_cache": ("BOOLEAN", {"default": False, "tooltip": "输入不变时直接返回缓存结果（重启后仍有效），跳过推理"}),
             },
             "optional": {}
         }
@@ -44,7 +46,7 @@ class MultiFunAINode(BaseModelManager):
     FUNCTION = "process_prompt"
     CATEGORY = "luy/AI"
 
-    def process_prompt(self, model, keep_model_loaded, max_tokens, choice_type, prompt, seed):
+    def process_prompt(self, model, keep_model_loaded, max_tokens, choice_type, prompt, seed, use_cache=False):
         mm.soft_empty_cache()
 
         # 模型配置
@@ -67,9 +69,6 @@ class MultiFunAINode(BaseModelManager):
             "stop": ["```"]
         }
 
-        # 加载模型
-        llm, _ = self.get_or_reload_model(model_config)
-
         # 构建提示词
         prompt_content = prompt_manager.get_prompt_content(choice_type)
         prompt_content = clean_prompt_keywords(prompt_content)
@@ -79,6 +78,17 @@ class MultiFunAINode(BaseModelManager):
 
         messages = [{"role": "user", "content": final_prompt}]
 
+        # 输入未变化时直接使用缓存结果
+        cache_key = None
+        if use_cache:
+            cache_key = RESPONSE_CACHE.make_key("MultiFunAINode", model_config, messages, seed, inference_params)
+            cached = RESPONSE_CACHE.get(cache_key)
+            if cached is not None:
+                return (cached,)
+
+        # 加载模型
+        llm, _ = self.get_or_reload_model(model_config)
+
         # 推理
         try:
             output = llm.create_chat_completion(
@@ -98,5 +108,7 @@ class MultiFunAINode(BaseModelManager):
         # 处理输出
         text = output['choices'][0]['message']['content']
         text = clean_think_content(text)
+        if cache_key is not None:
+            RESPONSE_CACHE.put(cache_key, text)
 
         return (text,)
\ No newline at end of file
@@ -8,10 +8,10 @@ import comfy.model_management as mm
 from aitools_base import (
     BaseModelManager,
     PromptManager,
-    scale_image,
-    image2base64,
     register_llm_folder,
-    clean_think_content
+    clean_think_content,
+    encode_frames,
+    RESPONSE_CACHE
 )
 
 
@@ -44,6 +44,7 @@ class ImageDeal(BaseModelManager):
                 "max_frames": ("INT", {"default": 24, "min": 2, "max": 1024, "step": 1}),
                 "video_size": ([128, 256, 512, 768, 1024], {"default": 256}),
                 "seed": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff, "step": 1}),
+                "use_cache": ("BOOLEAN", {"default": False, "tooltip": "输入不变时直接返回缓存结果（重启后仍有效），跳过推理"}),
             },
             "optional": {
                 "images": ("IMAGE",),
@@ -57,7 +58,7 @@ class ImageDeal(BaseModelManager):
 
     def process(self, model, mmproj_model, keep_model_loaded, max_tokens,
                 preset_prompt, custom_prompt, system_prompt, video_input,
-                max_frames, video_size, seed, images=None):
+                max_frames, video_size, seed, use_cache=False, images=None):
         mm.soft_empty_cache()
 
         # 模型配置
@@ -70,8 +71,13 @@ class ImageDeal(BaseModelManager):
             "n_gpu_layers": -1,
         }
 
-        # 加载模型
-        llm, chat_handler = self.get_or_reload_model(model_config)
+        # 推理参数
+        inference_params = {
+            "max_tokens": max_tokens,
+            "temperature": 0.7,
+            "top_k": 30,
+            "top_p": 0.9,
+        }
 
         # 构建消息
         messages = []
@@ -83,6 +89,20 @@ class ImageDeal(BaseModelManager):
         # 构建用户内容
         user_content = prompt_manager.build_final_prompt(preset_prompt, custom_prompt, video_input)
 
+        # 输入未变化时直接使用缓存结果（缓存键要对全部图片做哈希，只在启用缓存时计算）
+        cache_key = None
+        if use_cache:
+            cache_key = RESPONSE_CACHE.make_key(
+                "ImageDeal", model_config, system_prompts, user_content, video_input,
+                max_frames, video_size, seed, inference_params, images
+            )
+            cached = RESPONSE_CACHE.get(cache_key)
+            if cached is not None:
+                return (cached,)
+
+        # 加载模型
+        llm, chat_handler = self.get_or_reload_model(model_config)
+
         # 处理图像
         if images is not None:
             if not hasattr(chat_handler, "clip_model_path"):
@@ -93,30 +113,20 @@ class ImageDeal(BaseModelManager):
                 indices = np.linspace(0, len(images) - 1, max_frames, dtype=int)
                 frames = [images[i] for i in indices]
 
-            for image in frames:
-                try:
-                    if video_input:
-                        data = image2base64(scale_image(image, video_size))
-                    else:
-                        img_array = np.clip(255.0 * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8)
-                        data = image2base64(img_array)
-                    user_content.append({
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{data}"}
-                    })
-                except Exception as e:
-                    print(f"[警告] 图片转base64失败: {str(e)[:50]}")
-                    continue
+            # 整批转换 uint8 + 缩放，JPEG 编码并行
+            try:
+                encoded = encode_frames(frames, video_size if video_input else None)
+            except Exception as e:
+                print(f"[警告] 图片转base64失败: {str(e)[:50]}")
+                encoded = []
 
-        messages.append({"role": "user", "content": user_content})
+            for data in encoded:
+                user_content.append({
+                    "type": "image_url",
+                    "image_url": {"url": f"data:image/jpeg;base64,{data}"}
+                })
 
-        # 推理参数
-        inference_params = {
-            "max_tokens": max_tokens,
-            "temperature": 0.7,
-            "top_k": 30,
-            "top_p": 0.9,
-        }
+        messages.append({"role": "user", "content": user_content})
 
         # 推理
         try:
@@ -127,6 +137,8 @@ class ImageDeal(BaseModelManager):
             )
             text = output['choices'][0]['message']['content']
             text = clean_think_content(text)
+            if cache_key is not None:
+                RESPONSE_CACHE.put(cache_key, text)
         except Exception as e:
             text = f"推理失败，错误原因：{str(e)[:200]}"
             print(f"[错误] LLM推理失败：{str(e)}")
@@ -3,6 +3,7 @@ AITools 共享基础模块
 统一管理模型加载、配置读取、提示词处理等功能
 """
 import os
+import sys
 import json
 import gc
 import re
@@ -15,6 +16,17 @@ from PIL import Image
 from llama_cpp import Llama
 from llama_cpp.llama_chat_format import Qwen3VLChatHandler
 
+# 复用 llama-cpp/support 下的共享模块（响应缓存等）
+LLAMA_SUPPORT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "llama-cpp", "support")
+if LLAMA_SUPPORT_DIR not in sys.path:
+    sys.path.insert(0, LLAMA_SUPPORT_DIR)
+
+from response_cache import RESPONSE_CACHE
+from image_pipeline import encode_frames
+from llama_pool import LLAMA_POOL, PoolEntry, pool_spec
+from preset_index import PRESET_INDEX
+from embedding_cache import EMBEDDING_CACHE
+
 
 # ======================== 常量定义 ========================
 INVALID_CHARS = r'\/:*?"<>|'
@@ -55,29 +67,9 @@ def load_config():
     return {"prompts": {}, "models": {}}
 
 
-def load_prompt_files(prompt_dir):
-    """读取指定目录下的所有有效文件"""
-    prompts = {}
-    if not os.path.exists(prompt_dir) or not os.path.isdir(prompt_dir):
-        print(f"[警告] prompt目录不存在或非法：{prompt_dir}")
-        return prompts
-
-    for file_item in os.listdir(prompt_dir):
-        file_abspath = os.path.join(prompt_dir, file_item)
-        if os.path.isfile(file_abspath) and is_valid_file(file_item):
-            try:
-                with open(file_abspath, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read().strip()
-                prompts[file_item] = content
-                print(f"[成功] 加载prompt文件：{file_item}")
-            except Exception as e:
-                print(f"[警告] 读取prompt文件失败 {file_abspath} : {str(e)[:80]}")
-    return prompts
-
-
 def get_chat_handler(model_type):
     """获取聊天处理器"""
-    if model_type == "Qwen3-VL":
+    if model_type in ("Qwen3-VL", "Qwen3-VL-Thinking"):
         return Qwen3VLChatHandler
     elif model_type in ("None", "llama"):
         return None
@@ -128,55 +120,67 @@ def image2base64(image_array):
 
 # ======================== 模型管理类 ========================
 class BaseModelManager:
-    """统一的模型管理基类"""
+    """统一的模型管理基类（模型实例来自与 llama-cpp 节点共享的进程级模型池）"""
 
     def __init__(self):
         self.llm = None
         self.chat_handler = None
         self.current_config = None
+        self.entry = None
 
     def cleanup(self):
-        """清理模型资源"""
-        if self.llm is not None:
-            try:
-                self.llm.close()
-            except Exception as e:
-                print(f"[警告] 关闭LLM时出错: {str(e)[:100]}")
-            self.llm = None
-
-        if self.chat_handler is not None:
-            try:
-                self.chat_handler._exit_stack.close()
-            except Exception as e:
-                print(f"[警告] 关闭chat_handler时出错: {str(e)[:100]}")
-            self.chat_handler = None
+        """释放模型引用；没有其他节点在使用时卸载模型"""
+        entry = self.entry
+        self.entry = None
+        self.llm = None
+        self.chat_handler = None
+        self.current_config = None
+
+        if entry is not None:
+            LLAMA_POOL.release(entry)
+            LLAMA_POOL.evict(entry.key)
 
         gc.collect()
         mm.soft_empty_cache()
 
-    def load_model(self, config):
-        """加载模型"""
+    def make_spec(self, config):
+        """节点配置 -> (模型池 spec, 预估大小)，与 llama-cpp 节点相同的模型和参数会共享同一个实例"""
         model = config["model"]
         mmproj_model = config.get("mmproj_model")
         model_type = config.get("model_type", "Qwen3-VL")
         think_mode = config.get("think_mode", False)
         n_ctx = config.get("n_ctx", 8192)
-        n_gpu_layers = config.get("n_gpu_layers", -1)
 
         model_path = os.path.join(folder_paths.models_dir, 'LLM', model)
+        mmproj_path = None
         chat_handler = None
 
-        # 加载mmproj（如果需要）
         if mmproj_model and mmproj_model != "None":
-            mmproj_path = os.path.join(folder_paths.models_dir, 'LLM', mmproj_model)
             if model_type == "None":
                 raise ValueError('"model_type" cannot be None when mmproj is specified!')
+            mmproj_path = os.path.join(folder_paths.models_dir, 'LLM', mmproj_model)
+            if get_chat_handler(model_type):
+                # 与 llama-cpp 节点的 chat_handler 命名一致，思考模式用 -Thinking 后缀
+                chat_handler = f"{model_type}-Thinking" if think_mode and model_type == "Qwen3-VL" else model_type
+            else:
+                mmproj_path = None
+
+        # 与 llama-cpp 节点走同一套 spec 构建和显存估算
+        return pool_spec(model_path, mmproj_path, chat_handler, n_ctx=n_ctx)
+
+    def load_model(self, spec):
+        """加载模型"""
+        model_path = spec["model_path"]
+        mmproj_path = spec["mmproj_path"]
+        chat_handler = None
+
+        # 加载mmproj（如果需要）
+        if mmproj_path and spec["chat_handler"]:
             print(f"[加载] mmproj from {mmproj_path}")
-            handler = get_chat_handler(model_type)
-            if handler and model_type == "Qwen3-VL":
-                chat_handler = handler(clip_model_path=mmproj_path, use_think_prompt=think_mode, verbose=False)
-            elif handler:
-                chat_handler = handler(clip_model_path=mmproj_path, verbose=False)
+            handler = get_chat_handler(spec["chat_handler"])
+            chat_handler = handler(clip_model_path=mmproj_path, verbose=False, **spec["handler_kwargs"])
+            hk = spec["handler_kwargs"]
+            EMBEDDING_CACHE.install(chat_handler, mmproj_path, hk.get("image_min_tokens", 0), hk.get("image_max_tokens", 0))
 
         print(f"[加载] model from {model_path}")
 
@@ -184,8 +188,8 @@ class BaseModelManager:
         llm = Llama(
             model_path,
             chat_handler=chat_handler,
-            n_gpu_layers=n_gpu_layers,
-            n_ctx=n_ctx,
+            n_gpu_layers=spec["n_gpu_layers"],
+            n_ctx=spec["n_ctx"],
             verbose=False
         )
 
@@ -195,44 +199,63 @@ class BaseModelManager:
         """获取或重新加载模型"""
         mm.soft_empty_cache()
 
-        if self.llm is None or self.current_config != config:
+        # entry.llm 为 None 说明模型已被全局卸载（如 unload_all_models）
+        if self.entry is None or self.entry.llm is None or self.current_config != config:
             self.cleanup()
+            spec, size_bytes = self.make_spec(config)
+            key = LLAMA_POOL.make_key(spec)
+
+            def loader():
+                chat_handler, llm = self.load_model(spec)
+                return PoolEntry(key, spec, llm, chat_handler, size_bytes)
+
+            # 后台预加载中的模型等它加载完，不重复加载
+            LLAMA_POOL.wait(key)
+            self.entry = LLAMA_POOL.acquire(key, loader, size_bytes)
             self.current_config = config
-            self.chat_handler, self.llm = self.load_model(config)
+            self.llm = self.entry.llm
+            self.chat_handler = self.entry.chat_handler
 
         return self.llm, self.chat_handler
 
 
 # ======================== 提示词管理类 ========================
 class PromptManager:
-    """统一的提示词管理"""
+    """统一的提示词管理（数据来自 llama-cpp 节点共用的预设索引，prompt_dir 为 aitools 下的 T 或 V）"""
 
     def __init__(self, prompt_dir):
         self.prompts = {}
         self.prompt_dir = prompt_dir
+        self._version = None
         self._load_prompts()
 
     def _load_prompts(self):
-        """加载提示词文件"""
-        self.prompts = load_prompt_files(self.prompt_dir)
+        """从预设索引同步提示词，索引未变化时不做任何处理"""
+        files = PRESET_INDEX.files(self.prompt_dir)
+        if self._version != PRESET_INDEX.version:
+            self.prompts = {name: content.strip() for name, content in files.items() if is_valid_file(name)}
+            self._version = PRESET_INDEX.version
 
     def refresh(self):
         """刷新提示词文件"""
-        self.prompts.clear()
+        PRESET_INDEX.refresh(force=True)
         self._load_prompts()
 
     def get_prompt_types(self):
         """获取提示词类型列表"""
+        self._load_prompts()
         if self.prompts:
             return list(self.prompts.keys())
         return ["请放入提示词文件"]
 
     def get_prompt_content(self, choice_type):
         """获取指定类型的提示词内容"""
+        self._load_prompts()
         return self.prompts.get(choice_type, "")
 
     def build_final_prompt(self, preset_prompt, custom_prompt, video_input=False):
         """构建最终提示词"""
+        self._load_prompts()
         user_content = []
 
         if custom_prompt.strip():
@@ -11,7 +11,6 @@ import torch
 import numpy as np
 from numpy.typing import NDArray
 from PIL import Image, ImageDraw
-from scipy.ndimage import gaussian_filter
 
 # 动态设置 support 目录到路径
 SUPPORT_DIR = os.path.join(os.path.dirname(__file__), "support")
@@ -19,7 +18,23 @@ if SUPPORT_DIR not in sys.path:
     sys.path.insert(0, SUPPORT_DIR)
 
 from cqdm import cqdm
-from gguf_layers import get_layer_count
+from llama_pool import LLAMA_POOL, PoolEntry, pool_spec, close_chat_handler, _MTMD
+from kv_state import PrefixStateCache
+from model_settings import load_model_config
+from response_cache import RESPONSE_CACHE
+from conversation_store import CONVERSATIONS
+from embedding_cache import EMBEDDING_CACHE
+from image_pipeline import JpegFrames, encode_frames, encode_jpeg
+from preset_index import PRESET_INDEX
+from stream_progress import StreamProgress, chat_completion_deltas, consume_stream
+from draft_tuner import DRAFT_TOOLTIP, GENERATION_STATS, AdaptiveDraft, TrackedDraft, PreviousOutputDrafting, make_draft
+from frame_dedup import DEDUP_TOOLTIP, dedup_frames, unique_frames
+from frame_sampling import SAMPLING_MODES, SAMPLING_TOOLTIP, sample_frames
+from video_windows import (
+    WINDOW_TOOLTIP, WINDOW_PROMPT, split_windows, reduce_prompt, merge_prompt, reduce_in_stages, caption_budget
+)
+from mask_ops import box_tensor, box_profiles, is_per_frame, rasterize_boxes, gaussian_blur
+from structured_output import STRUCTURED_MODES, STRUCTURED_TOOLTIP, response_format_for
 from prompt_enhancer_preset import *
 
 import folder_paths
@@ -27,18 +42,11 @@ import comfy.model_management as mm
 import comfy.utils
 
 from llama_cpp import Llama
-from llama_cpp.llama_speculative import LlamaNGramMapDecoding, LlamaPromptLookupDecoding
 from llama_cpp.llama_chat_format import (
     Llava15ChatHandler, Llava16ChatHandler, MoondreamChatHandler,
     NanoLlavaChatHandler, Llama3VisionAlphaChatHandler, MiniCPMv26ChatHandler
 )
-draft_model_types = ["None", "ngram-map", "prompt-lookup"]
-
-try:
-    from llama_cpp.llama_chat_format import MTMDChatHandler
-    _MTMD = True
-except ImportError:
-    _MTMD = False
+draft_model_types = ["None", "auto", "ngram-map", "prompt-lookup"]
 
 chat_handlers: List[str] = ["None", "LLaVA-1.5", "LLaVA-1.6", "Moondream2", "nanoLLaVA", "llama3-Vision-Alpha", "MiniCPM-v2.6"]
 
@@ -144,12 +152,7 @@ def image_to_base64_jpeg(image: Union[torch.Tensor, NDArray], quality: int = 85)
         img_np = tensor_to_numpy(image)
     else:
         img_np = image
-    if img_np.ndim == 3 and img_np.shape[2] == 1:
-        img_np = np.repeat(img_np, 3, axis=2)
-    img_pil = Image.fromarray(img_np)
-    buffered = io.BytesIO()
-    img_pil.save(buffered, format="JPEG", quality=quality)
-    return base64.b64encode(buffered.getvalue()).decode('utf-8')
+    return encode_jpeg(img_np, quality)
 
 
 def scale_image_tensor(image: torch.Tensor, max_size: int = 128) -> NDArray[np.uint8]:
@@ -165,11 +168,15 @@ def scale_image_tensor(image: torch.Tensor, max_size: int = 128) -> NDArray[np.u
 
 
 class LLAMA_CPP_STORAGE:
+    """Active llama model slot, holding one reference into the process-wide model pool"""
     llm = None
     chat_handler = None
     current_config = None
-    messages = {}
+    entry = None
+    messages = CONVERSATIONS
     sys_prompts = {}
+    pool = LLAMA_POOL
+    stats = GENERATION_STATS
 
     @classmethod
     def clean_state(cls, id=-1):
@@ -181,79 +188,120 @@ class LLAMA_CPP_STORAGE:
             cls.sys_prompts.pop(f"{id}", None)
 
     @classmethod
-    def clean(cls, all=False):
-        try:
-            cls.llm.close()
-        except Exception:
-            pass
-
-        try:
-            cls.chat_handler._exit_stack.close()
-        except Exception:
-            pass
-
+    def _release_active(cls):
+        entry = cls.entry
+        cls.pool.release(entry)
+        cls.entry = None
         cls.llm = None
         cls.chat_handler = None
         cls.current_config = None
+        return entry
+
+    @classmethod
+    def clean(cls, all=False):
+        """Unload every pooled model"""
+        cls._release_active()
+        cls.pool.clear()
         if all:
             cls.clean_state()
 
         gc.collect()
         mm.soft_empty_cache()
 
+    @classmethod
+    def unload_current(cls):
+        """Unload only the active model, keeping other pooled models warm (and models other nodes still use)"""
+        entry = cls._release_active()
+        if entry is not None:
+            cls.pool.evict(entry.key)
+
+    @classmethod
+    def is_loaded(cls, config: Dict[str, Any]) -> bool:
+        """
+        True when config is the active model and it is still open. The pool may close the entry
+        behind this slot (clear() from the unload hook of another copy of this module), which
+        leaves entry.llm as None while cls.llm still points at the freed model.
+        """
+        return cls.entry is not None and cls.entry.llm is not None and cls.current_config == config
+
     @classmethod
     def load_model(cls, config: Dict[str, Any]) -> None:
-        def get_chat_handler(chat_handler: str):
-            match chat_handler:
-                case "Qwen3.5"|"Qwen3.5-Thinking"|"Qwen3.6":
-                    return Qwen35ChatHandler
-                case "Qwen3-VL"|"Qwen3-VL-Thinking":
-                    return Qwen3VLChatHandler
-                case "Qwen2.5-VL":
-                    return Qwen25VLChatHandler
-                case "LLaVA-1.5":
-                    return Llava15ChatHandler
-                case "LLaVA-1.6":
-                    return Llava16ChatHandler
-                case "Moondream2":
-                    return MoondreamChatHandler
-                case "nanoLLaVA":
-                    return NanoLlavaChatHandler
-                case "llama3-Vision-Alpha":
-                    return Llama3VisionAlphaChatHandler
-                case "MiniCPM-v2.6":
-                    return MiniCPMv26ChatHandler
-                case "MiniCPM-v4.5"|"MiniCPM-v4.5-Thinking":
-                    return MiniCPMv45ChatHandler
-                case "MiniCPM-v4.6"|"MiniCPM-v4.6-Thinking":
-                    return MiniCPMV46ChatHandler
-                case "Gemma3":
-                    return Gemma3ChatHandler
-                case "Gemma4":
-                    return Gemma4ChatHandler
-                case "GLM-4.6V"|"GLM-4.6V-Thinking":
-                    return GLM46VChatHandler
-                case "GLM-4.1V-Thinking":
-                    return GLM41VChatHandler
-                case "LFM2-VL":
-                    return LFM2VLChatHandler
-                case "LFM2.5-VL":
-                    return LFM25VLChatHandler
-                case "Granite-Docling":
-                    return GraniteDoclingChatHandler
-                case "PaddleOCR-VL":
-                    return PaddleOCRChatHandler
-                case "Qwen3-ASR":
-                    return Qwen3ASRChatHandler
-                case "Step3-VL":
-                    return Step3VLChatHandler
-                case "None":
-                    return None
-                case _:
-                    raise ValueError(f'Unknow model type: "{chat_handler}"')
-
-        cls.clean(all=True)
-        cls.current_config = config.copy()
+        """Resolve config to a shared pool entry (loading it if needed) and make it the active model"""
+        spec, size_bytes = cls._resolve(config)
+        key = cls.pool.make_key(spec)
+        # 后台正在加载同一模型时先等它完成（不能持有 pool.lock 等待）
+        cls.pool.wait(key)
+        with cls.pool.lock:
+            cls._release_active()
+            if cls.pool.get(key) is None:
+                # 只有投影器 / 草稿模型不同时，复用已加载的文本模型权重和上下文
+                cls._rebuild_from_pool(key, spec, size_bytes)
+            entry = cls.pool.acquire(key, lambda: cls._load_entry(key, spec, size_bytes), size_bytes)
+        cls.entry = entry
+        cls.llm = entry.llm
+        cls.chat_handler = entry.chat_handler
+        cls.current_config = config
+
+    @classmethod
+    def preload(cls, config: Dict[str, Any]):
+        """Start loading config into the pool on a background thread; load_model(config) later waits for it"""
+        spec, size_bytes = cls._resolve(config)
+        key = cls.pool.make_key(spec)
+        return cls.pool.preload(key, lambda: cls._load_entry(key, spec, size_bytes), size_bytes)
+
+    @staticmethod
+    def _handler_class(chat_handler: str):
+        match chat_handler:
+            case "Qwen3.5"|"Qwen3.5-Thinking"|"Qwen3.6":
+                return Qwen35ChatHandler
+            case "Qwen3-VL"|"Qwen3-VL-Thinking":
+                return Qwen3VLChatHandler
+            case "Qwen2.5-VL":
+                return Qwen25VLChatHandler
+            case "LLaVA-1.5":
+                return Llava15ChatHandler
+            case "LLaVA-1.6":
+                return Llava16ChatHandler
+            case "Moondream2":
+                return MoondreamChatHandler
+            case "nanoLLaVA":
+                return NanoLlavaChatHandler
+            case "llama3-Vision-Alpha":
+                return Llama3VisionAlphaChatHandler
+            case "MiniCPM-v2.6":
+                return MiniCPMv26ChatHandler
+            case "MiniCPM-v4.5"|"MiniCPM-v4.5-Thinking":
+                return MiniCPMv45ChatHandler
+            case "MiniCPM-v4.6"|"MiniCPM-v4.6-Thinking":
+                return MiniCPMV46ChatHandler
+            case "Gemma3":
+                return Gemma3ChatHandler
+            case "Gemma4":
+                return Gemma4ChatHandler
+            case "GLM-4.6V"|"GLM-4.6V-Thinking":
+                return GLM46VChatHandler
+            case "GLM-4.1V-Thinking":
+                return GLM41VChatHandler
+            case "LFM2-VL":
+                return LFM2VLChatHandler
+            case "LFM2.5-VL":
+                return LFM25VLChatHandler
+            case "Granite-Docling":
+                return GraniteDoclingChatHandler
+            case "PaddleOCR-VL":
+                return PaddleOCRChatHandler
+            case "Qwen3-ASR":
+                return Qwen3ASRChatHandler
+            case "Step3-VL":
+                return Step3VLChatHandler
+            case "None":
+                return None
+            case _:
+                raise ValueError(f'Unknow model type: "{chat_handler}"')
+
+    @classmethod
+    def _resolve(cls, config: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+        """Node config -> (pool spec, estimated size in bytes)"""
         model = config["model"]
         mmproj = config["mmproj"]
         chat_handler = config["chat_handler"]
@@ -266,69 +314,106 @@ class LLAMA_CPP_STORAGE:
         draft_num_pred_tokens = config.get("draft_num_pred_tokens", 10)
         enable_mtp = config.get("enable_mtp", False)
         ctx_type = 1 if enable_mtp else 0
-        n_gpu_layers = -1
 
         model_path = os.path.join(folder_paths.models_dir, 'LLM', model)
-        handler = get_chat_handler(chat_handler)
-
-        if vram_limit != -1:
-            gguf_layers = get_layer_count(model_path) or 32
-            gguf_size = os.path.getsize(model_path) * 1.55 / (1024 ** 3)
-            gguf_layer_size = gguf_size / gguf_layers
-
-        if mmproj and mmproj != "None":
-            mmproj_path = os.path.join(folder_paths.models_dir, 'LLM', mmproj)
-            if chat_handler == "None":
-                raise ValueError('"chat_handler" cannot be None!')
-
-            if vram_limit != -1:
-                mmproj_size = os.path.getsize(mmproj_path) * 1.55 / (1024 ** 3)
-                n_gpu_layers = max(1, int((vram_limit - mmproj_size) / gguf_layer_size))
-
-            #print(f"[llama-cpp_vlm] Loading clip:  {mmproj}")
+        mmproj_path = os.path.join(folder_paths.models_dir, 'LLM', mmproj) if mmproj and mmproj != "None" else None
+        cls._handler_class(chat_handler)
+
+        draft = None
+        if draft_model_type == "auto":
+            draft = {"type": "auto"}
+        elif draft_model_type in ("ngram-map", "prompt-lookup"):
+            draft = {"type": draft_model_type, "ngram_size": draft_ngram_size, "num_pred_tokens": draft_num_pred_tokens}
+
+        return pool_spec(model_path, mmproj_path, chat_handler, n_ctx=n_ctx, vram_limit=vram_limit,
+                         image_max_tokens=image_max_tokens, image_min_tokens=image_min_tokens,
+                         draft=draft, ctx_type=ctx_type)
+
+    @staticmethod
+    def _components(spec: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Split a pool spec into the parts that can be rebuilt independently.
+        "weights" is bound into the Llama object at construction: the text weights and GPU
+        layers, the context (n_ctx, MTP ctx_type), whether logits are kept for drafting and
+        whether a chat handler is used instead of the GGUF chat template.
+        """
+        return {
+            "weights": (spec["model_path"], spec["n_gpu_layers"], spec["n_ctx"], spec["ctx_type"],
+                        spec["draft"] is not None, spec["chat_handler"] is not None),
+            "projector": (spec["mmproj_path"], spec["chat_handler"], json.dumps(spec["handler_kwargs"], sort_keys=True)),
+            "draft": json.dumps(spec["draft"], sort_keys=True),
+        }
 
-            think_mode = "Thinking" in chat_handler
-            kwargs = {"clip_model_path": mmproj_path, "verbose": False}
-            if chat_handler in ["Qwen3-VL", "Qwen3-VL-Thinking"]:
-                kwargs["force_reasoning"] = think_mode
-                kwargs["image_max_tokens"] = image_max_tokens
-                kwargs["image_min_tokens"] = image_min_tokens
-            elif chat_handler in ["MiniCPM-v4.5", "MiniCPM-v4.6", "GLM-4.6V", "Qwen3.5", "Qwen3.6", "Gemma4", "LFM2.5-VL"]:
-                kwargs["enable_thinking"] = think_mode
+    @classmethod
+    def _rebuild_from_pool(cls, key: str, spec: Dict[str, Any], size_bytes: int) -> Optional[PoolEntry]:
+        """
+        Turn an idle pooled model with the same weights into the entry for spec, rebuilding only
+        the projector and/or draft model. Returns the entry, or None when nothing can be reused.
+        """
+        wanted = cls._components(spec)
+        entry = cls.pool.find(lambda e: cls._components(e.config)["weights"] == wanted["weights"])
+        if entry is None:
+            return None
+        current = cls._components(entry.config)
+        if current["projector"] != wanted["projector"]:
+            # 投影器上下文在首次推理时才按当前 Llama 初始化，新处理器直接挂到已加载的模型上
+            chat_handler_obj = cls._make_chat_handler(spec)
+            close_chat_handler(entry.chat_handler)
+            entry.chat_handler = chat_handler_obj
+            entry.llm.chat_handler = chat_handler_obj
+            print(f"[llama-cpp_vlm] Reusing loaded model weights, rebuilt chat handler: {spec['chat_handler']}")
+        if current["draft"] != wanted["draft"]:
+            draft_model = cls._make_draft(spec)
+            entry.llm.draft_model = draft_model
+            GENERATION_STATS.instrument(entry.llm, spec["model_path"], draft_model)
+            print(f"[llama-cpp_vlm] Reusing loaded model weights, switched draft model: {spec['draft']['type']}")
+        cls.pool.rekey(entry, key, spec, size_bytes)
+        return entry
 
-            if _MTMD:
-                kwargs["image_max_tokens"] = image_max_tokens
-                kwargs["image_min_tokens"] = image_min_tokens
+    @classmethod
+    def _make_chat_handler(cls, spec: Dict[str, Any]):
+        chat_handler_obj = None
+        handler = cls._handler_class(spec["chat_handler"] or "None")
 
+        if spec["mmproj_path"]:
+            #print(f"[llama-cpp_vlm] Loading clip:  {spec['mmproj_path']}")
+            kwargs = {"clip_model_path": spec["mmproj_path"], "verbose": False, **spec["handler_kwargs"]}
             try:
-                cls.chat_handler = handler(**kwargs)
+                chat_handler_obj = handler(**kwargs)
             except Exception as e:
                 raise RuntimeError(f"{e}\nPlease update llama-cpp-python from 'https://github.com/JamePeng/llama-cpp-python/releases'")
+            # 相同图片再次输入时复用 mmproj 输出的图像嵌入
+            hk = spec["handler_kwargs"]
+            EMBEDDING_CACHE.install(chat_handler_obj, spec["mmproj_path"],
+                                    hk.get("image_min_tokens", 0), hk.get("image_max_tokens", 0))
 
         else:
-            if vram_limit != -1:
-                n_gpu_layers = max(1, int(vram_limit / gguf_layer_size))
             if handler is not None:
-                cls.chat_handler = handler(verbose=False)
-            else:
-                cls.chat_handler = None
-
-        # Speculative decoding draft model
-        draft_model = None
-        if draft_model_type == "ngram-map":
-            draft_model = LlamaNGramMapDecoding(
-                ngram_size=draft_ngram_size,
-                num_pred_tokens=draft_num_pred_tokens
-            )
-        elif draft_model_type == "prompt-lookup":
-            draft_model = LlamaPromptLookupDecoding(
-                max_ngram_size=draft_ngram_size,
-                num_pred_tokens=draft_num_pred_tokens
-            )
+                chat_handler_obj = handler(verbose=False)
+        return chat_handler_obj
+
+    @staticmethod
+    def _make_draft(spec: Dict[str, Any]):
+        """Speculative decoding draft model（包装后记录每次生成的草稿接受率）"""
+        draft = spec["draft"]
+        if draft and draft["type"] == "auto":
+            return AdaptiveDraft()
+        if draft:
+            inner = make_draft(draft["type"], draft["ngram_size"], draft["num_pred_tokens"])
+            return TrackedDraft(inner, f"{draft['type']}:{draft['ngram_size']}/{draft['num_pred_tokens']}")
+        return None
+
+    @classmethod
+    def _load_entry(cls, key: str, spec: Dict[str, Any], size_bytes: int) -> PoolEntry:
+        chat_handler_obj = cls._make_chat_handler(spec)
+        draft_model = cls._make_draft(spec)
 
-        #print(f"[llama-cpp_vlm] Loading model: {model}")
-        #print(f"[llama-cpp_vlm] n_gpu_layers = {n_gpu_layers}")
-        cls.llm = Llama(model_path, chat_handler=cls.chat_handler, n_gpu_layers=n_gpu_layers, n_ctx=n_ctx, draft_model=draft_model, ctx_type=ctx_type, verbose=False)
+        #print(f"[llama-cpp_vlm] Loading model: {spec['model_path']}")
+        #print(f"[llama-cpp_vlm] n_gpu_layers = {spec['n_gpu_layers']}")
+        llm = Llama(spec["model_path"], chat_handler=chat_handler_obj, n_gpu_layers=spec["n_gpu_layers"], n_ctx=spec["n_ctx"],
+                    draft_model=draft_model, ctx_type=spec["ctx_type"], verbose=False)
+        GENERATION_STATS.instrument(llm, spec["model_path"], draft_model)
+        return PoolEntry(key, spec, llm, chat_handler_obj, size_bytes)
 
 
 # Model cleanup hook
@@ -341,10 +426,53 @@ if not hasattr(mm, "unload_all_models_backup"):
     mm.unload_all_models = patched_unload_all_models
     print("[llama-cpp_vlm] Model cleanup hook applied!")
 
+def lite_model_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """lite_models entry (aitools/model_config.json) -> model loader config"""
+    return {
+        "model": cfg["model"],
+        "mmproj": cfg.get("mmproj", ""),
+        "chat_handler": cfg.get("chat_handler", "None"),
+        "n_ctx": cfg.get("n_ctx", 8192),
+        "vram_limit": -1,
+        "image_min_tokens": 0,
+        "image_max_tokens": 0,
+        "draft_model_type": "None",
+        "draft_ngram_size": 3,
+        "draft_num_pred_tokens": 10,
+        "enable_mtp": False,
+    }
+
+
+def warmup_models(settings: Dict[str, Any]) -> None:
+    """Start background loads for the lite_models named in the warmup_models list"""
+    lite_models = settings.get("lite_models", {})
+    for name in settings.get("warmup_models", []):
+        cfg = lite_models.get(name)
+        if cfg is None:
+            print(f"[llama-cpp_vlm] Warm-up model '{name}' not found in lite_models")
+            continue
+        try:
+            LLAMA_CPP_STORAGE.preload(lite_model_config(cfg))
+            print(f"[llama-cpp_vlm] Warming up {name} in the background")
+        except Exception as e:
+            print(f"[llama-cpp_vlm] Warm-up of {name} failed: {e}")
+
+
+# Shared model settings (aitools/model_config.json)
+_model_settings = load_model_config()
+_pool_settings = _model_settings.get("llama_pool", {})
+LLAMA_POOL.configure(
+    max_models=_pool_settings.get("max_models"),
+    budget_gb=_pool_settings.get("budget_gb"),
+)
+
 # LLM folder paths
 llm_extensions = ['.ckpt', '.pt', '.bin', '.pth', '.safetensors', '.gguf']
 folder_paths.folder_names_and_paths["LLM"] = ([os.path.join(folder_paths.models_dir, "LLM")], llm_extensions)
 
+# 插件加载时即在后台预热常用模型，首次运行不必等待模型加载
+warmup_models(_model_settings)
+
 # Preset prompts for vision
 preset_prompts = {
     "None": "",
@@ -354,44 +482,36 @@ preset_tags = list(preset_prompts.keys())
 
 # 记录每个目录加载的 keys，用于清理已删除的文件
 _loaded_presets_by_dir = {}
+# 每个目录同步到的预设索引版本
+_preset_versions = {}
 
 
 def load_text_presets(pathvt: str) -> None:
     global preset_prompts, preset_tags, _loaded_presets_by_dir
-    AITOOLS_T_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "aitools", pathvt)
     prefix = f"{pathvt}_"  # 添加前缀：T_ 或 V_
-    #print(f"[llama-cpp_vlm] Trying to load presets from: {AITOOLS_T_DIR}")
     try:
+        # 共享的预设索引只重新读取变化的文件；索引没有变化时直接返回
+        files = PRESET_INDEX.files(pathvt)
+        if _preset_versions.get(pathvt) == PRESET_INDEX.version:
+            return
+
         # 先清理该目录之前加载的所有 keys
-        if pathvt in _loaded_presets_by_dir:
-            for key in _loaded_presets_by_dir[pathvt]:
-                preset_prompts.pop(key, None)
+        for key in _loaded_presets_by_dir.get(pathvt, []):
+            preset_prompts.pop(key, None)
 
-        # 重新加载当前目录的文件
         loaded_keys = []
-        if os.path.exists(AITOOLS_T_DIR):
-            for filename in os.listdir(AITOOLS_T_DIR):
-                if filename.endswith(".txt"):
-                    original_key = filename[:-4]
-                    key = f"{prefix}{original_key}"  # 添加前缀
-                    filepath = os.path.join(AITOOLS_T_DIR, filename)
-                    with open(filepath, "r", encoding="utf-8") as f:
-                        content = f.read()
-                    preset_prompts[key] = content
-                    loaded_keys.append(key)
-        else:
-            pass
-            #print(f"[llama-cpp_vlm] Directory not found: {AITOOLS_T_DIR}")
+        for filename, content in files.items():
+            if filename.endswith(".txt"):
+                key = f"{prefix}{filename[:-4]}"  # 添加前缀
+                preset_prompts[key] = content
+                loaded_keys.append(key)
 
         # 记录本次加载的 keys
         _loaded_presets_by_dir[pathvt] = loaded_keys
+        _preset_versions[pathvt] = PRESET_INDEX.version
         preset_tags[:] = list(preset_prompts.keys())  # 使用切片更新，确保引用有效
-        #print(f"[llama-cpp_vlm] Loaded {len(loaded_keys)} presets from {pathvt}, total tags: {len(preset_tags)}")
-        if loaded_keys:
-            pass
-            #print(f"[llama-cpp_vlm] Sample keys from {pathvt}: {loaded_keys[:3]}")
     except Exception as e:
-        #print(f"[llama-cpp_vlm] Failed to load text presets from {AITOOLS_T_DIR}: {e}")
+        #print(f"[llama-cpp_vlm] Failed to load text presets from {pathvt}: {e}")
         import traceback
         traceback.print_exc()
 
@@ -655,37 +775,25 @@ class bbox_to_segs:
         seg_list = []
         image_for_cropping = image[0]
 
-        for bbox in bboxes:
-            if not isinstance(bbox, (list, tuple)) or len(bbox) < 4:
-                print(f"Warning: Skipping invalid bbox item: {bbox}")
-                continue
-
-            x1, y1, x2, y2 = map(int, bbox)
-            x1_exp = x1 - dilation
-            y1_exp = y1 - dilation
-            x2_exp = x2 + dilation
-            y2_exp = y2 + dilation
+        # 所有框的局部 mask 一次算出：模糊后的矩形 = 行方向与列方向模糊曲线的外积
+        boxes, items = box_tensor(bboxes, dilation)
+        crop_w = boxes[:, 2] - boxes[:, 0]
+        crop_h = boxes[:, 3] - boxes[:, 1]
+        if boxes.numel():
+            profile_x = box_profiles(torch.full_like(crop_w, dilation), crop_w - dilation, crop_w, feather).numpy()
+            profile_y = box_profiles(torch.full_like(crop_h, dilation), crop_h - dilation, crop_h, feather).numpy()
 
+        for i, bbox in enumerate(items):
+            x1_exp, y1_exp, x2_exp, y2_exp = boxes[i].tolist()
             crop_region = [x1_exp, y1_exp, x2_exp, y2_exp]
-            crop_w = x2_exp - x1_exp
-            crop_h = y2_exp - y1_exp
+            w, h = int(crop_w[i]), int(crop_h[i])
 
-            if crop_h <= 0 or crop_w <= 0:
+            if h <= 0 or w <= 0:
                 print(f"Warning: Skipping bbox with invalid expanded size: {crop_region}")
                 continue
 
-            local_mask_np = np.zeros((crop_h, crop_w), dtype=np.float32)
-            local_x1 = dilation
-            local_y1 = dilation
-            local_x2 = local_x1 + (x2 - x1)
-            local_y2 = local_y1 + (y2 - y1)
-            local_mask_np[local_y1:local_y2, local_x1:local_x2] = 1.0
-
-            if feather > 0:
-                local_mask_np = gaussian_filter(local_mask_np, sigma=feather)
-
-            cropped_mask_np = local_mask_np
-            cropped_img_padded = torch.zeros((crop_h, crop_w, 3), dtype=image.dtype, device=image.device)
+            cropped_mask_np = np.outer(profile_y[i, :h], profile_x[i, :w]).astype(np.float32)
+            cropped_img_padded = torch.zeros((h, w, 3), dtype=image.dtype, device=image.device)
 
             src_x_start = max(0, x1_exp)
             src_y_start = max(0, y1_exp)
@@ -736,52 +844,26 @@ class bbox_to_mask:
     CATEGORY = "llama-cpp-vlm"
 
     def process(self, bboxes, image, dilation, feather):
-        masks = []
-        _batch_size, height, width, _channels = image.shape
-        mask_shape = (height, width)
-        combined_full_mask = torch.zeros(mask_shape, dtype=torch.float32, device=image.device)
-
-        for i, bbox in enumerate(bboxes):
-            if not isinstance(bbox, (list, tuple)) or len(bbox) < 4:
-                print(f"Warning: Skipping invalid bbox item: {bbox}")
-                continue
-
-            x1, y1, x2, y2 = map(int, bbox)
-            x1_exp = x1 - dilation
-            y1_exp = y1 - dilation
-            x2_exp = x2 + dilation
-            y2_exp = y2 + dilation
-            crop_w = x2_exp - x1_exp
-            crop_h = y2_exp - y1_exp
-
-            if crop_h <= 0 or crop_w <= 0:
-                continue
+        batch_size, height, width, _channels = image.shape
+        device = image.device
 
-            local_mask_np = np.zeros((crop_h, crop_w), dtype=np.float32)
-            local_x1 = dilation
-            local_y1 = dilation
-            local_x2 = local_x1 + (x2 - x1)
-            local_y2 = local_y1 + (y2 - y1)
-            local_mask_np[local_y1:local_y2, local_x1:local_x2] = 1.0
-
-            if feather > 0:
-                local_mask_np = gaussian_filter(local_mask_np, sigma=feather)
-
-            current_full_mask_np = np.zeros(mask_shape, dtype=np.float32)
-            x1_c, y1_c = max(0, x1_exp), max(0, y1_exp)
-            x2_c, y2_c = min(width, x2_exp), min(height, y2_exp)
-
-            if x2_c > x1_c and y2_c > y1_c:
-                current_full_mask_np[y1_c:y2_c, x1_c:x2_c] = 1.0
-
-            if feather > 0:
-                current_full_mask_np = gaussian_filter(current_full_mask_np, sigma=feather)
-
-            current_full_mask_tensor = torch.from_numpy(current_full_mask_np).to(image.device)
-            combined_full_mask = torch.maximum(combined_full_mask, current_full_mask_tensor)
+        # BBOX 可以是所有帧共用的一组框，也可以是每帧一组（按帧序号对应，不足时沿用最后一组）
+        if is_per_frame(bboxes):
+            frame_boxes = [bboxes[min(i, len(bboxes) - 1)] for i in range(batch_size)]
+        else:
+            frame_boxes = [bboxes] * batch_size
 
-        masks.append(combined_full_mask.unsqueeze(0))
-        return (torch.cat(masks, dim=0),)
+        masks = []
+        cache = {}
+        for boxes_of_frame in frame_boxes:
+            key = id(boxes_of_frame)
+            if key not in cache:
+                boxes, _items = box_tensor(boxes_of_frame, dilation, device)
+                cache[key] = rasterize_boxes(boxes, height, width, device)
+            masks.append(cache[key])
+
+        # 合并后的 mask 整批做一次可分离高斯羽化
+        return (gaussian_blur(torch.stack(masks), feather),)
 
 
 class bboxes_to_bbox:
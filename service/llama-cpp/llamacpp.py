@@ -15,7 +15,8 @@ import numpy as np
 from base import (
     LLAMA_CPP_STORAGE, any_type, chat_handlers, preset_prompts, preset_tags,
     load_text_presets, scale_image_tensor, tensor_to_numpy,
-    image_to_base64_jpeg, cqdm, draft_model_types, _MTMD,
+    image_to_base64_jpeg, JpegFrames, encode_frames, cqdm, draft_model_types, DRAFT_TOOLTIP, _MTMD,
+    STRUCTURED_MODES, STRUCTURED_TOOLTIP, response_format_for, PreviousOutputDrafting,
     BASE_NODE_CLASS_MAPPINGS, BASE_NODE_DISPLAY_NAME_MAPPINGS
 )
 
@@ -96,7 +97,7 @@ class llama_run:
                 }),
                 "draft_model_type": (draft_model_types, {
                     "default": "None",
-                    "tooltip": "Speculative decoding draft model.\nngram-map: Fast hash-based ngram matching (recommended)\nprompt-lookup: Legacy sliding window search\nNone: No speculative decoding"
+                    "tooltip": DRAFT_TOOLTIP
                 }),
                 "draft_ngram_size": ("INT", {
                     "default": 3, "min": 1, "max": 10, "step": 1,
@@ -117,6 +118,11 @@ class llama_run:
             "optional": {
                 "images": ("IMAGE",),
                 "queue_handler": (any_type, {"tooltip": "Used to control the execution order of instruct nodes."}),
+                "structured_output": (STRUCTURED_MODES, {"default": "off", "tooltip": STRUCTURED_TOOLTIP}),
+                "reuse_previous_output": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": 'One by one mode: draft each image\'s output from the previous image\'s output (speculative decoding, same result).\nFast on near-duplicate video frames. Requires draft_model_type other than None.'
+                }),
             },
         }
 
@@ -142,7 +148,7 @@ class llama_run:
             preset_prompt, ChineseReply, custom_prompt, system_prompt, inference_mode, max_frames,
             max_size, seed, force_offload, save_states, state_uid,
             draft_model_type, draft_ngram_size, draft_num_pred_tokens, enable_mtp,
-            unique_id, images=None, queue_handler=None):
+            unique_id, images=None, queue_handler=None, structured_output="off", reuse_previous_output=False):
         custom_config = {
             "model": model,
             "mmproj": mmproj,
@@ -157,7 +163,7 @@ class llama_run:
             "enable_mtp": enable_mtp
         }
 
-        if not LLAMA_CPP_STORAGE.llm or LLAMA_CPP_STORAGE.current_config != custom_config:
+        if not LLAMA_CPP_STORAGE.is_loaded(custom_config):
             #print("[llama-cpp_vlm] Loading model...")
             LLAMA_CPP_STORAGE.load_model(custom_config)
 
@@ -219,6 +225,15 @@ class llama_run:
             p = preset_prompts[preset_prompt].replace("#", custom_prompt.strip()).replace("@", "video" if video_input else "image")
             user_content.append({"type": "text", "text": p})
 
+        # 结构化输出：按 JSON schema 约束解码，结果一定可被 parse_json 解析
+        response_format = response_format_for(structured_output, user_content[0]["text"])
+        if response_format is not None:
+            _parameters["response_format"] = response_format
+
+        if save_states and messages:
+            # 恢复上一轮的 KV state，本轮只需计算新消息
+            llama_model.messages.restore_state(f"{uid}", llama_model.llm)
+
         if images is not None:
             if not hasattr(llama_model.chat_handler, "clip_model_path") or llama_model.chat_handler.clip_model_path is None:
                 raise ValueError("Image input detected, but the loaded model is not configured with a mmproj module.")
@@ -238,30 +253,27 @@ class llama_run:
                 messages.append({"role": "user", "content": user_content})
                 #print(f"[llama-cpp_vlm] Start processing {len(frames)} images")
 
-                for i, image in enumerate(cqdm(frames)):
-                    if mm.processing_interrupted():
-                        raise mm.InterruptProcessingException()
-                    data = image_to_base64_jpeg(image)
-                    for item in user_content:
-                        if item.get("type") == "image_url":
-                            item["image_url"]["url"] = f"data:image/jpeg;base64,{data}"
-                            break
-                    output = llama_model.llm.create_chat_completion(messages=messages, seed=seed, **_parameters)
-                    text = output['choices'][0]['message']['content'].removeprefix(": ").lstrip()
-                    out2.append(text)
-                    if len(frames) > 1:
-                        tmp_list.append(f"====== Image {i+1} ======")
-                    tmp_list.append(text)
-                    data = None
+                # reuse_previous_output: 上一帧的输出作为下一帧推测解码的草稿来源
+                with PreviousOutputDrafting(llama_model.llm, reuse_previous_output) as drafting:
+                    for i, data in enumerate(cqdm(JpegFrames(frames))):
+                        if mm.processing_interrupted():
+                            raise mm.InterruptProcessingException()
+                        for item in user_content:
+                            if item.get("type") == "image_url":
+                                item["image_url"]["url"] = f"data:image/jpeg;base64,{data}"
+                                break
+                        output = llama_model.llm.create_chat_completion(messages=messages, seed=seed, **_parameters)
+                        text = output['choices'][0]['message']['content'].removeprefix(": ").lstrip()
+                        drafting.feed(text)
+                        out2.append(text)
+                        if len(frames) > 1:
+                            tmp_list.append(f"====== Image {i+1} ======")
+                        tmp_list.append(text)
+                        data = None
 
                 out1 = "\n\n".join(tmp_list)
             else:
-                for image in frames:
-                    if len(frames) > 1:
-                        img_np = scale_image_tensor(image, max_size)
-                    else:
-                        img_np = tensor_to_numpy(image)
-                    data = image_to_base64_jpeg(img_np)
+                for data in encode_frames(frames, max_size if len(frames) > 1 else None):
                     image_content = {
                         "type": "image_url",
                         "image_url": {"url": f"data:image/jpeg;base64,{data}"}
@@ -282,13 +294,13 @@ class llama_run:
             #print(f"[llama-cpp_vlm] Saving state id={uid}...")
             messages.append({"role": "assistant", "content": out1})
             clear_message = self.sanitize_messages(messages)
-            llama_model.messages[f"{uid}"] = clear_message
+            llama_model.messages.save(f"{uid}", clear_message, llama_model.llm)
         else:
             if not llama_model.messages.get(f"{uid}"):
                 llama_model.sys_prompts.pop(f"{uid}", None)
 
         if force_offload:
-            llama_model.clean()
+            llama_model.unload_current()
 
         del messages
         gc.collect()
@@ -0,0 +1,116 @@
+# llamacpp_asr.py - 长音频分段语音识别
+# 按静音位置（或固定窗口 + 重叠）切分音频，逐段送入 Qwen3-ASR 等音频模型，再拼接成完整转写
+
+import os
+import sys
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+if CURRENT_DIR not in sys.path:
+    sys.path.insert(0, CURRENT_DIR)
+
+from base import LLAMA_CPP_STORAGE, cqdm, _MTMD, RESPONSE_CACHE
+from audio_chunks import plan_chunks, wav_base64, stitch, join, timestamp
+
+import comfy.model_management as mm
+
+
+class llama_cpp_asr:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "llama_model": ("LLAMACPPMODEL",),
+                "audio": ("AUDIO",),
+                "prompt": ("STRING", {
+                    "default": "",
+                    "multiline": True,
+                    "tooltip": "Optional text sent with every chunk (e.g. language or context hints)."
+                }),
+                "window_seconds": ("FLOAT", {
+                    "default": 30.0, "min": 5.0, "max": 300.0, "step": 1.0,
+                    "tooltip": "Maximum length of one chunk. Memory and latency per request depend on this, not on the clip length."
+                }),
+                "overlap_seconds": ("FLOAT", {
+                    "default": 2.0, "min": 0.0, "max": 30.0, "step": 0.5,
+                    "tooltip": "Audio shared by two chunks when no silence is found to cut at; the repeated words are removed when stitching."
+                }),
+                "vad_split": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "Cut chunks at the quietest silent point in the second half of each window instead of at fixed positions."
+                }),
+                "seed": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff, "step": 1}),
+                "use_cache": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "Reuse the cached result when model, audio and settings are unchanged."
+                }),
+            },
+            "optional": {
+                "parameters": ("LLAMACPPARAMS",),
+            },
+        }
+
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("text", "segments")
+    OUTPUT_IS_LIST = (False, True)
+    FUNCTION = "process"
+    CATEGORY = "llama-cpp-vlm"
+
+    def process(self, llama_model, audio, prompt, window_seconds, overlap_seconds, vad_split, seed, use_cache, parameters=None):
+        if parameters is None:
+            parameters = {
+                "max_tokens": 1024,
+                "top_k": 1,
+                "top_p": 1.0,
+                "min_p": 0.0,
+                "temperature": 0.0,
+                "repeat_penalty": 1.0,
+            }
+        _parameters = parameters.copy()
+        _parameters.pop("state_uid", None)
+        if _MTMD:
+            _parameters.pop("presence_penalty", None)
+
+        cache_key = None
+        if use_cache:
+            cache_key = RESPONSE_CACHE.make_key("llama_cpp_asr", llama_model, audio, prompt, window_seconds,
+                                                overlap_seconds, vad_split, seed, _parameters)
+            cached = RESPONSE_CACHE.get(cache_key)
+            if cached is not None:
+                return (cached[0], cached[1])
+
+        if not LLAMA_CPP_STORAGE.is_loaded(llama_model):
+            LLAMA_CPP_STORAGE.load_model(llama_model)
+        if not hasattr(LLAMA_CPP_STORAGE.chat_handler, "clip_model_path") or LLAMA_CPP_STORAGE.chat_handler.clip_model_path is None:
+            raise ValueError("Speech recognition needs a model configured with an audio mmproj module (e.g. Qwen3-ASR).")
+
+        # AUDIO: {"waveform": (B, C, T), "sample_rate": int}，只取第一条
+        waveform = audio["waveform"][0]
+        sample_rate = audio["sample_rate"]
+        chunks = plan_chunks(waveform, sample_rate, window_seconds, overlap_seconds, vad_split)
+        print(f"[llama-cpp_asr] {waveform.shape[-1] / sample_rate:.1f}s of audio in {len(chunks)} chunk(s)")
+
+        content = [{"type": "input_audio", "input_audio": {"data": "", "format": "wav"}}]
+        if prompt.strip():
+            content.append({"type": "text", "text": prompt.strip()})
+        messages = [{"role": "user", "content": content}]
+
+        text = ""
+        segments = []
+        for start, end, overlapped in cqdm(chunks, desc="Transcribing"):
+            if mm.processing_interrupted():
+                raise mm.InterruptProcessingException()
+            # 每次只转换当前分段，内存占用与音频总长度无关
+            content[0]["input_audio"]["data"] = wav_base64(waveform, sample_rate, start, end)
+            output = LLAMA_CPP_STORAGE.llm.create_chat_completion(messages=messages, seed=seed, **_parameters)
+            chunk_text = output['choices'][0]['message']['content'].strip()
+            segments.append(f"[{timestamp(start / sample_rate)} - {timestamp(end / sample_rate)}] {chunk_text}")
+            text = stitch(text, chunk_text) if overlapped else join(text, chunk_text)
+        content[0]["input_audio"]["data"] = ""
+
+        if cache_key is not None:
+            RESPONSE_CACHE.put(cache_key, [text, segments])
+        return (text, segments)
+
+
+NODE_CLASS_MAPPINGS = {"llama_cpp_asr": llama_cpp_asr}
+NODE_DISPLAY_NAME_MAPPINGS = {"llama_cpp_asr": "Llama-cpp Speech Recognition"}
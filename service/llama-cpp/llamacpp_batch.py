@@ -0,0 +1,245 @@
+# llamacpp_batch.py - 目录批量反推
+# 从 input/batch/<name> 逐张读取图片推理，结果增量写入 captions.jsonl 和同名 .txt，中断后可续跑
+
+import os
+import sys
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+if CURRENT_DIR not in sys.path:
+    sys.path.insert(0, CURRENT_DIR)
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from base import (
+    LLAMA_CPP_STORAGE, preset_prompts, preset_tags, load_text_presets, encode_jpeg, cqdm, _MTMD, RESPONSE_CACHE
+)
+
+import folder_paths
+import comfy.model_management as mm
+
+VALID_EXT = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+# 进度/结果文件：每处理完一张追加一行，续跑时据此跳过已完成的图片
+RESULTS_FILE = "captions.jsonl"
+
+
+def batch_root():
+    batch_dir = os.path.join(folder_paths.get_input_directory(), "batch")
+    os.makedirs(batch_dir, exist_ok=True)
+    return batch_dir
+
+
+def list_images(target_dir):
+    return sorted(f for f in os.listdir(target_dir)
+                  if f.lower().endswith(VALID_EXT) and not f.startswith("__preview__"))
+
+
+def load_jpeg(path, max_size, quality=95):
+    """Image file -> base64 JPEG with the long side capped at max_size"""
+    with Image.open(path) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        if max(img.size) > max_size:
+            img.thumbnail((max_size, max_size), Image.BICUBIC)
+        return encode_jpeg(np.asarray(img), quality)
+
+
+def prefetch_jpegs(paths, max_size, prefetch=4):
+    """
+    Yield (path, base64 JPEG or exception) in order, decoding and encoding at most
+    `prefetch` files ahead on worker threads so only a few images are in memory at once.
+    """
+    def load(path):
+        try:
+            return load_jpeg(path, max_size)
+        except Exception as e:
+            return e
+
+    pending = deque()
+    it = iter(paths)
+    with ThreadPoolExecutor(max_workers=max(1, prefetch), thread_name_prefix="cj_batch_load") as executor:
+        try:
+            for path in it:
+                pending.append((path, executor.submit(load, path)))
+                if len(pending) > prefetch:
+                    path, future = pending.popleft()
+                    yield path, future.result()
+            while pending:
+                path, future = pending.popleft()
+                yield path, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def read_done(results_path, job):
+    """Filenames already captioned by this job (same model, prompts and parameters)"""
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 中断时可能留下半行
+                continue
+            if record.get("job") == job and "caption" in record:
+                done.add(record["file"])
+    return done
+
+
+class llama_caption_batch:
+    @classmethod
+    def INPUT_TYPES(s):
+        load_text_presets("V")
+        batch_dir = batch_root()
+        subdirs = [d for d in os.listdir(batch_dir) if os.path.isdir(os.path.join(batch_dir, d))]
+        subdirs.sort(key=lambda x: os.path.getmtime(os.path.join(batch_dir, x)), reverse=True)
+        if not subdirs:
+            subdirs = ["None"]
+
+        return {
+            "required": {
+                "llama_model": ("LLAMACPPMODEL",),
+                "batch": (subdirs,),
+                "preset_prompt": (preset_tags, {"default": preset_tags[1]}),
+                "custom_prompt": ("STRING", {"default": "", "multiline": True, "placeholder": "user_prompt"}),
+                "system_prompt": ("STRING", {"multiline": True, "default": ""}),
+                "max_size": ("INT", {"default": 1024, "min": 128, "max": 16384, "step": 64,
+                                     "tooltip": "Max size of the long side of each image."}),
+                "seed": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff, "step": 1}),
+                "write_txt": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "Write each caption to a .txt file next to its image (in addition to captions.jsonl)."
+                }),
+                "restart": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Caption every image again instead of resuming from captions.jsonl."
+                }),
+                "prefetch": ("INT", {"default": 4, "min": 1, "max": 32, "step": 1,
+                                     "tooltip": "Number of images decoded ahead of inference."}),
+            },
+            "optional": {
+                "parameters": ("LLAMACPPARAMS",),
+            },
+        }
+
+    RETURN_TYPES = ("STRING", "INT")
+    RETURN_NAMES = ("summary", "count")
+    FUNCTION = "process"
+    CATEGORY = "llama-cpp-vlm"
+
+    @classmethod
+    def IS_CHANGED(s, **kwargs):
+        # 目录内容和进度都在节点外部变化，每次都重新执行
+        return float("NaN")
+
+    def process(self, llama_model, batch, preset_prompt, custom_prompt, system_prompt, max_size, seed,
+                write_txt, restart, prefetch, parameters=None):
+        target_dir = os.path.join(batch_root(), batch)
+        if batch == "None" or not os.path.isdir(target_dir):
+            raise ValueError("No batches found!")
+        files = list_images(target_dir)
+        if not files:
+            raise ValueError("Empty batch folder")
+
+        if parameters is None:
+            parameters = {
+                "max_tokens": 1024,
+                "top_k": 30,
+                "top_p": 0.9,
+                "min_p": 0.05,
+                "typical_p": 1.0,
+                "temperature": 0.8,
+                "repeat_penalty": 1.0,
+                "frequency_penalty": 0.0,
+                "presence_penalty": 1.0,
+                "mirostat_mode": 0,
+                "mirostat_eta": 0.1,
+                "mirostat_tau": 5.0
+            }
+        _parameters = parameters.copy()
+        _parameters.pop("state_uid", None)
+        if _MTMD:
+            _parameters.pop("presence_penalty", None)
+
+        system_prompts = system_prompt if system_prompt.strip() else "你是一个图像分析助手，可以帮助用户分析图像内容、识别物体、描述场景和细节。"
+        if preset_prompt == "None":
+            user_text = custom_prompt.strip()
+        else:
+            user_text = preset_prompts[preset_prompt].replace("{}", custom_prompt.strip()).replace("@", "image").replace("#", custom_prompt.strip())
+
+        # 同一任务（模型 + 提示词 + 参数）的结果才算已完成，修改提示词后会重新反推
+        job = RESPONSE_CACHE.make_key("llama_caption_batch", llama_model, system_prompts, user_text, max_size, seed, _parameters)[:16]
+        results_path = os.path.join(target_dir, RESULTS_FILE)
+        done = set() if restart else read_done(results_path, job)
+        todo = [f for f in files if f not in done]
+        print(f"[llama-cpp_batch] {batch}: {len(files)} images, {len(done)} already done, {len(todo)} to caption")
+        if not todo:
+            return (f"{batch}: all {len(files)} images already captioned", 0)
+
+        if not LLAMA_CPP_STORAGE.is_loaded(llama_model):
+            LLAMA_CPP_STORAGE.load_model(llama_model)
+        if not hasattr(LLAMA_CPP_STORAGE.chat_handler, "clip_model_path") or LLAMA_CPP_STORAGE.chat_handler.clip_model_path is None:
+            raise ValueError("Batch captioning needs a model configured with a mmproj module.")
+
+        user_content = [
+            {"type": "text", "text": user_text},
+            {"type": "image_url", "image_url": {"url": ""}},
+        ]
+        messages = [{"role": "system", "content": system_prompts}, {"role": "user", "content": user_content}]
+
+        captioned = 0
+        failed = 0
+        start = time.perf_counter()
+        pbar = cqdm(total=len(todo), desc=f"Captioning {batch}")
+        with open(results_path, "a", encoding="utf-8") as results:
+            for filename, data in prefetch_jpegs([os.path.join(target_dir, f) for f in todo], max_size, prefetch):
+                if mm.processing_interrupted():
+                    # 已完成的结果都已写入，下次运行从这里继续
+                    raise mm.InterruptProcessingException()
+
+                name = os.path.basename(filename)
+                t0 = time.perf_counter()
+                try:
+                    if isinstance(data, Exception):
+                        raise data
+                    user_content[1]["image_url"]["url"] = f"data:image/jpeg;base64,{data}"
+                    output = LLAMA_CPP_STORAGE.llm.create_chat_completion(messages=messages, seed=seed, **_parameters)
+                    caption = output['choices'][0]['message']['content'].removeprefix(": ").lstrip()
+                except mm.InterruptProcessingException:
+                    raise
+                except Exception as e:
+                    failed += 1
+                    print(f"[llama-cpp_batch] Failed on {name}: {e}")
+                    results.write(json.dumps({"file": name, "job": job, "error": str(e)}, ensure_ascii=False) + "\n")
+                    results.flush()
+                    pbar.update(1)
+                    continue
+
+                if write_txt:
+                    with open(os.path.splitext(filename)[0] + ".txt", "w", encoding="utf-8") as f:
+                        f.write(caption)
+                results.write(json.dumps({"file": name, "job": job, "caption": caption,
+                                          "seconds": round(time.perf_counter() - t0, 3)}, ensure_ascii=False) + "\n")
+                results.flush()
+
+                captioned += 1
+                pbar.update(1)
+                pbar.set_postfix(ips=f"{captioned / (time.perf_counter() - start):.2f}")
+
+        user_content[1]["image_url"]["url"] = ""
+        elapsed = time.perf_counter() - start
+        rate = captioned / elapsed if elapsed > 0 else 0.0
+        summary = (f"{batch}: captioned {captioned}/{len(todo)} images in {elapsed:.1f}s ({rate:.2f} images/s)"
+                   f", {failed} failed, {len(done)} skipped (already done)")
+        print(f"[llama-cpp_batch] {summary}")
+        return (summary, captioned)
+
+
+NODE_CLASS_MAPPINGS = {"llama_caption_batch": llama_caption_batch}
+NODE_DISPLAY_NAME_MAPPINGS = {"llama_caption_batch": "Llama-cpp Batch Caption"}
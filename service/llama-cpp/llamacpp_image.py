@@ -12,12 +12,10 @@ if CURRENT_DIR not in sys.path:
 import gc
 import numpy as np
 
-# 缓存存储：key=unique_id, value=(output_tuple)
-_CACHE = {}
-
 from base import (
     LLAMA_CPP_STORAGE, any_type, chat_handlers, preset_prompts, preset_tags,
-    load_text_presets, tensor_to_numpy, image_to_base64_jpeg, scale_image_tensor, cqdm, draft_model_types, _MTMD,
+    load_text_presets, tensor_to_numpy, image_to_base64_jpeg, scale_image_tensor, JpegFrames, encode_frames, cqdm, draft_model_types, DRAFT_TOOLTIP, _MTMD,
+    RESPONSE_CACHE,
     BASE_NODE_CLASS_MAPPINGS, BASE_NODE_DISPLAY_NAME_MAPPINGS
 )
 
@@ -75,7 +73,7 @@ class llama_run_simple:
                 }),
                 "draft_model_type": (draft_model_types, {
                     "default": "None",
-                    "tooltip": "Speculative decoding draft model.\nngram-map: Fast hash-based ngram matching (recommended)\nprompt-lookup: Legacy sliding window search\nNone: No speculative decoding"
+                    "tooltip": DRAFT_TOOLTIP
                 }),
                 "draft_ngram_size": ("INT", {
                     "default": 3, "min": 1, "max": 10, "step": 1,
@@ -95,7 +93,7 @@ class llama_run_simple:
                 }),
                 "use_cache": ("BOOLEAN", {
                     "default": False,
-                    "tooltip": "Use cached result from last run. Skips model inference and returns previous output."
+                    "tooltip": "Reuse the cached result when model, prompts, images, seed and settings are unchanged (persists across restarts). Skips model inference."
                 }),
                 "use_inference": ("BOOLEAN", {
                     "default": False,
@@ -136,10 +134,6 @@ class llama_run_simple:
         if not use_inference:
             return (custom_prompt.strip(), [custom_prompt.strip()], uid, "", user_text)
 
-        if use_cache and uid in _CACHE:
-            print(f"[llama-cpp_vlm] Cache hit for node {uid}, skipping inference.")
-            return _CACHE[uid]
-
         custom_config = {
             "model": model,
             "mmproj": mmproj,
@@ -154,7 +148,20 @@ class llama_run_simple:
             "enable_mtp": enable_mtp
         }
 
-        if not LLAMA_CPP_STORAGE.llm or LLAMA_CPP_STORAGE.current_config != custom_config:
+        # 缓存键要对全部图片做哈希，只在启用缓存时计算
+        cache_key = None
+        if use_cache:
+            cache_key = RESPONSE_CACHE.make_key(
+                "llama_run_simple", custom_config, user_text, system_role_prompt, ChineseReply,
+                inference_mode, max_frames, max_size, seed, images
+            )
+            cached = RESPONSE_CACHE.get(cache_key)
+            if cached is not None:
+                print(f"[llama-cpp_vlm] Cache hit for node {uid}, skipping inference.")
+                out1, out2, system_prompt_text, user_text = cached
+                return (out1, out2, uid, system_prompt_text, user_text)
+
+        if not LLAMA_CPP_STORAGE.is_loaded(custom_config):
             #print("[llama-cpp_vlm] Loading model...")
             LLAMA_CPP_STORAGE.load_model(custom_config)
 
@@ -245,10 +252,9 @@ class llama_run_simple:
                 user_content.append(image_content)
                 messages.append({"role": "user", "content": user_content})
 
-                for i, image in enumerate(cqdm(frames)):
+                for i, data in enumerate(cqdm(JpegFrames(frames))):
                     if mm.processing_interrupted():
                         raise mm.InterruptProcessingException()
-                    data = image_to_base64_jpeg(image)
                     for item in user_content:
                         if item.get("type") == "image_url":
                             item["image_url"]["url"] = f"data:image/jpeg;base64,{data}"
@@ -262,12 +268,7 @@ class llama_run_simple:
                         out1 = text
                     data = None
             else:
-                for image in frames:
-                    if len(frames) > 1:
-                        img_np = scale_image_tensor(image, max_size)
-                    else:
-                        img_np = tensor_to_numpy(image)
-                    data = image_to_base64_jpeg(img_np)
+                for data in encode_frames(frames, max_size if len(frames) > 1 else None):
                     image_content = {
                         "type": "image_url",
                         "image_url": {"url": f"data:image/jpeg;base64,{data}"}
@@ -302,9 +303,10 @@ class llama_run_simple:
         if unload_model:
             #print("[llama-cpp_vlm] Unloading model and releasing VRAM...")
             LLAMA_CPP_STORAGE.clean_state(uid)
-            LLAMA_CPP_STORAGE.clean()
+            LLAMA_CPP_STORAGE.unload_current()
 
-        _CACHE[uid] = (out1, out2, uid, system_prompt_text, user_text)
+        if cache_key is not None:
+            RESPONSE_CACHE.put(cache_key, [out1, out2, system_prompt_text, user_text])
         return (out1, out2, uid, system_prompt_text, user_text)
 
 
@@ -9,11 +9,9 @@ if CURRENT_DIR not in sys.path:
 
 from base import (
     LLAMA_CPP_STORAGE, preset_prompts, preset_tags,
-    load_text_presets, image_to_base64_jpeg, cqdm, _MTMD
+    load_text_presets, image_to_base64_jpeg, JpegFrames, encode_frames, cqdm, _MTMD, RESPONSE_CACHE, lite_model_config
 )
 
-_CACHE = {}
-
 import folder_paths
 import comfy.model_management as mm
 
@@ -45,7 +43,7 @@ class llama_run_lite:
                 "seed": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff, "step": 1}),
                 "use_cache": ("BOOLEAN", {
                     "default": False,
-                    "tooltip": "Use cached result from last run. Skips model inference and returns previous output."
+                    "tooltip": "Reuse the cached result when model, prompt, images and seed are unchanged (persists across restarts). Skips model inference."
                 }),
                 "use_inference": ("BOOLEAN", {
                     "default": False,
@@ -82,21 +80,19 @@ class llama_run_lite:
         if cfg is None:
             raise ValueError(f"Model '{model}' not found in lite_models config")
 
-        custom_config = {
-            "model": cfg["model"],
-            "mmproj": cfg.get("mmproj", ""),
-            "chat_handler": cfg.get("chat_handler", "None"),
-            "n_ctx": cfg.get("n_ctx", 8192),
-            "vram_limit": -1,
-            "image_min_tokens": 0,
-            "image_max_tokens": 0,
-            "draft_model_type": "None",
-            "draft_ngram_size": 3,
-            "draft_num_pred_tokens": 10,
-            "enable_mtp": False,
-        }
+        custom_config = lite_model_config(cfg)
 
-        if not LLAMA_CPP_STORAGE.llm or LLAMA_CPP_STORAGE.current_config != custom_config:
+        uid = unique_id.rpartition('.')[-1]
+        # 缓存键要对全部图片做哈希，只在启用缓存时计算
+        cache_key = None
+        if use_cache:
+            cache_key = RESPONSE_CACHE.make_key("llama_run_lite", custom_config, user_text, seed, images)
+            cached = RESPONSE_CACHE.get(cache_key)
+            if cached is not None:
+                print(f"[llama-cpp_lite] Cache hit for node {uid}, skipping inference.")
+                return (cached[0], cached[1])
+
+        if not LLAMA_CPP_STORAGE.is_loaded(custom_config):
             LLAMA_CPP_STORAGE.load_model(custom_config)
 
         llama_model = LLAMA_CPP_STORAGE
@@ -147,12 +143,6 @@ class llama_run_lite:
             user_text = p
         user_content.append({"type": "text", "text": user_text})
 
-        uid = unique_id.rpartition('.')[-1]
-
-        if use_cache and uid in _CACHE:
-            print(f"[llama-cpp_lite] Cache hit for node {uid}, skipping inference.")
-            return _CACHE[uid]
-
         out1 = ""
 
         if images is not None and image_count > 0:
@@ -163,10 +153,9 @@ class llama_run_lite:
                 user_content.append({"type": "image_url", "image_url": {"url": ""}})
                 messages.append({"role": "user", "content": user_content})
 
-                for image in cqdm(images):
+                for data in cqdm(JpegFrames(images)):
                     if mm.processing_interrupted():
                         raise mm.InterruptProcessingException()
-                    data = image_to_base64_jpeg(image)
                     for item in user_content:
                         if item.get("type") == "image_url":
                             item["image_url"]["url"] = f"data:image/jpeg;base64,{data}"
@@ -175,8 +164,7 @@ class llama_run_lite:
                     out1 = output['choices'][0]['message']['content'].removeprefix(": ").lstrip()
                     data = None
             else:
-                for image in images:
-                    data = image_to_base64_jpeg(image)
+                for data in encode_frames(images):
                     user_content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{data}"}})
                 messages.append({"role": "user", "content": user_content})
                 output = llama_model.llm.create_chat_completion(messages=messages, seed=seed, **parameters)
@@ -190,9 +178,9 @@ class llama_run_lite:
         gc.collect()
 
         LLAMA_CPP_STORAGE.clean_state(uid)
-        LLAMA_CPP_STORAGE.clean()
 
-        _CACHE[uid] = (out1, user_text)
+        if cache_key is not None:
+            RESPONSE_CACHE.put(cache_key, [out1, user_text])
         return (out1, user_text)
 
 
@@ -0,0 +1,121 @@
+# llamacpp_ocr.py - 分块高分辨率 OCR
+# 大尺寸扫描件按原始分辨率切成相互重叠的切片逐块识别，再去掉重叠部分重复的文字合并成整页结果
+
+import os
+import sys
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+if CURRENT_DIR not in sys.path:
+    sys.path.insert(0, CURRENT_DIR)
+
+from base import LLAMA_CPP_STORAGE, encode_frames, cqdm, _MTMD, RESPONSE_CACHE
+from ocr_tiles import tile_layout, merge_tile_texts
+
+import comfy.model_management as mm
+
+
+class llama_cpp_tiled_ocr:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "llama_model": ("LLAMACPPMODEL",),
+                "image": ("IMAGE",),
+                "prompt": ("STRING", {
+                    "default": "OCR:",
+                    "multiline": True,
+                    "tooltip": 'Task prompt sent with every tile, e.g. "OCR:" for PaddleOCR-VL or "Convert this page to docling." for Granite-Docling.'
+                }),
+                "tile_size": ("INT", {
+                    "default": 1024, "min": 256, "max": 4096, "step": 64,
+                    "tooltip": "Pixel budget of one tile (tile_size x tile_size), close to the model's native input size.\nThe page is cut into full-width bands of that many pixels at its original resolution; pages too wide for that are also split into columns at blank gutters."
+                }),
+                "overlap": ("INT", {
+                    "default": 128, "min": 0, "max": 1024, "step": 8,
+                    "tooltip": "Rows shared by vertically neighbouring tiles (at most half a tile). Should cover at least one or two text lines; text read twice is removed when merging."
+                }),
+                "seed": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff, "step": 1}),
+                "use_cache": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "Reuse the cached result when model, image and settings are unchanged."
+                }),
+            },
+            "optional": {
+                "parameters": ("LLAMACPPARAMS",),
+            },
+        }
+
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("text", "text_list")
+    OUTPUT_IS_LIST = (False, True)
+    FUNCTION = "process"
+    CATEGORY = "llama-cpp-vlm"
+
+    def process(self, llama_model, image, prompt, tile_size, overlap, seed, use_cache, parameters=None):
+        if parameters is None:
+            # OCR 要求逐字还原，默认贪心解码
+            parameters = {
+                "max_tokens": 2048,
+                "top_k": 1,
+                "top_p": 1.0,
+                "min_p": 0.0,
+                "temperature": 0.0,
+                "repeat_penalty": 1.0,
+            }
+        _parameters = parameters.copy()
+        _parameters.pop("state_uid", None)
+        if _MTMD:
+            _parameters.pop("presence_penalty", None)
+
+        cache_key = None
+        if use_cache:
+            cache_key = RESPONSE_CACHE.make_key("llama_cpp_tiled_ocr", llama_model, prompt, tile_size, overlap, seed, _parameters, image)
+            cached = RESPONSE_CACHE.get(cache_key)
+            if cached is not None:
+                return (cached[0], cached[1])
+
+        if not LLAMA_CPP_STORAGE.is_loaded(llama_model):
+            LLAMA_CPP_STORAGE.load_model(llama_model)
+        if not hasattr(LLAMA_CPP_STORAGE.chat_handler, "clip_model_path") or LLAMA_CPP_STORAGE.chat_handler.clip_model_path is None:
+            raise ValueError("Tiled OCR needs a model configured with a mmproj module.")
+
+        _, height, width, _ = image.shape
+        count = sum(len(bands) for _x0, _x1, bands in tile_layout(height, width, tile_size, overlap))
+        print(f"[llama-cpp_ocr] {len(image)} page(s) of {width}x{height}, about {count} tile(s) per page")
+
+        content = [
+            {"type": "image_url", "image_url": {"url": ""}},
+            {"type": "text", "text": prompt},
+        ]
+        messages = [{"role": "user", "content": content}]
+
+        pages = []
+        pbar = cqdm(total=len(image) * count, desc="Tiled OCR")
+        for page in image:
+            # 分栏位置选在空白处：按每列像素与页面背景（中位数）的差异估计墨迹量
+            gray = page.float().mean(-1)
+            ink = (gray - gray.median()).abs().sum(0).cpu().numpy()
+            columns = []
+            for x0, x1, bands in tile_layout(height, width, tile_size, overlap, ink):
+                # 原始分辨率切片，不缩放
+                tiles = [page[y0:y1, x0:x1].unsqueeze(0) for y0, y1 in bands]
+                texts = []
+                for data in encode_frames(tiles, None, quality=95):
+                    if mm.processing_interrupted():
+                        raise mm.InterruptProcessingException()
+                    content[0]["image_url"]["url"] = f"data:image/jpeg;base64,{data}"
+                    output = LLAMA_CPP_STORAGE.llm.create_chat_completion(messages=messages, seed=seed, **_parameters)
+                    texts.append(output['choices'][0]['message']['content'].strip())
+                    pbar.update(1)
+                columns.append(merge_tile_texts(texts))
+            pages.append("\n".join(column for column in columns if column))
+        content[0]["image_url"]["url"] = ""
+
+        text = "\n\n".join(pages)
+        if cache_key is not None:
+            RESPONSE_CACHE.put(cache_key, [text, pages])
+        return (text, pages)
+
+
+NODE_CLASS_MAPPINGS = {"llama_cpp_tiled_ocr": llama_cpp_tiled_ocr}
+NODE_DISPLAY_NAME_MAPPINGS = {"llama_cpp_tiled_ocr": "Llama-cpp Tiled OCR"}
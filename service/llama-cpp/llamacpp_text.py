@@ -13,7 +13,7 @@ import gc
 
 from base import (
     LLAMA_CPP_STORAGE, any_type, preset_prompts, preset_tags,
-    load_text_presets, draft_model_types, _MTMD,
+    load_text_presets, draft_model_types, _MTMD, RESPONSE_CACHE,
     BASE_NODE_CLASS_MAPPINGS, BASE_NODE_DISPLAY_NAME_MAPPINGS
 )
 
@@ -58,6 +58,10 @@ class llama_text_simple:
                     "default": False,
                     "tooltip": "Multi-Token Prediction (MTP) acceleration.\nRequires a model with MTP support (e.g., Qwen3 variants)."
                 }),
+                "use_cache": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Reuse the cached result when model, prompt and settings are unchanged (persists across restarts). Skips model inference."
+                }),
             },
             "hidden": {
                 "unique_id": "UNIQUE_ID",
@@ -75,7 +79,7 @@ class llama_text_simple:
 
     def run(self, model, n_ctx, vram_limit, preset_prompt, ChineseReply, custom_prompt,
             draft_model_type, draft_ngram_size, draft_num_pred_tokens, enable_mtp,
-            unique_id, queue_handler=None):
+            unique_id, use_cache=False, queue_handler=None):
         custom_config = {
             "model": model,
             "mmproj": "None",
@@ -90,14 +94,7 @@ class llama_text_simple:
             "enable_mtp": enable_mtp
         }
 
-        if not LLAMA_CPP_STORAGE.llm or LLAMA_CPP_STORAGE.current_config != custom_config:
-            #print("[llama-cpp_vlm] Loading model...")
-            LLAMA_CPP_STORAGE.load_model(custom_config)
-
-        llama_model = LLAMA_CPP_STORAGE
-
-        if not llama_model.llm:
-            raise RuntimeError("The model has been unloaded or failed to load!")
+        uid = unique_id.rpartition('.')[-1]
 
         parameters = {
             "max_tokens": 2048,
@@ -117,7 +114,6 @@ class llama_text_simple:
         if _MTMD:
             parameters.pop("presence_penalty", None)
 
-        uid = unique_id.rpartition('.')[-1]
         messages = []
         user_content = []
 
@@ -133,9 +129,28 @@ class llama_text_simple:
             user_content.append({"type": "text", "text": p})
 
         messages.append({"role": "user", "content": user_content})
+
+        cache_key = None
+        if use_cache:
+            cache_key = RESPONSE_CACHE.make_key("llama_text_simple", custom_config, messages, parameters)
+            cached = RESPONSE_CACHE.get(cache_key)
+            if cached is not None:
+                return (cached, [cached], uid)
+
+        if not LLAMA_CPP_STORAGE.is_loaded(custom_config):
+            #print("[llama-cpp_vlm] Loading model...")
+            LLAMA_CPP_STORAGE.load_model(custom_config)
+
+        llama_model = LLAMA_CPP_STORAGE
+
+        if not llama_model.llm:
+            raise RuntimeError("The model has been unloaded or failed to load!")
+
         output = llama_model.llm.create_chat_completion(messages=messages, seed=0, **parameters)
         out1 = output['choices'][0]['message']['content'].removeprefix(": ").lstrip()
         out2 = [out1]
+        if cache_key is not None:
+            RESPONSE_CACHE.put(cache_key, out1)
 
         del messages
         gc.collect()
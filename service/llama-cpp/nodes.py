@@ -15,7 +15,11 @@ import numpy as np
 
 from base import (
     LLAMA_CPP_STORAGE, any_type, chat_handlers, preset_prompts, preset_tags,
-    load_text_presets, tensor_to_numpy, image_to_base64_jpeg, scale_image_tensor, cqdm, _MTMD, draft_model_types,
+    load_text_presets, tensor_to_numpy, image_to_base64_jpeg, scale_image_tensor, JpegFrames, encode_frames, cqdm, _MTMD, draft_model_types, DRAFT_TOOLTIP,
+    PrefixStateCache, RESPONSE_CACHE, StreamProgress, chat_completion_deltas, consume_stream,
+    STRUCTURED_MODES, STRUCTURED_TOOLTIP, response_format_for, PreviousOutputDrafting,
+    DEDUP_TOOLTIP, dedup_frames, unique_frames, SAMPLING_MODES, SAMPLING_TOOLTIP, sample_frames,
+    WINDOW_TOOLTIP, WINDOW_PROMPT, split_windows, reduce_prompt, merge_prompt, reduce_in_stages, caption_budget,
     BASE_NODE_CLASS_MAPPINGS, BASE_NODE_DISPLAY_NAME_MAPPINGS
 )
 
@@ -48,7 +52,7 @@ class llama_cpp_model_loader:
             "image_max_tokens": ("INT", {"default": 0, "min": 0, "max": 4096, "step": 32}),
             "draft_model_type": (draft_model_types, {
                 "default": "None",
-                "tooltip": "Speculative decoding draft model.\nngram-map: Fast hash-based ngram matching (recommended)\nprompt-lookup: Legacy sliding window search\nNone: No speculative decoding"
+                "tooltip": DRAFT_TOOLTIP
             }),
             "draft_ngram_size": ("INT", {
                 "default": 3, "min": 1, "max": 10, "step": 1,
@@ -62,6 +66,12 @@ class llama_cpp_model_loader:
                 "default": False,
                 "tooltip": "Multi-Token Prediction (MTP) acceleration.\nRequires a model with MTP support (e.g., Qwen3 variants)."
             }),
+            },
+            "optional": {
+                "async_load": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Load the model on a background thread and return immediately, so upstream image nodes keep running.\nThe instruct node waits for the load to finish before generating."
+                }),
             }
         }
 
@@ -73,7 +83,7 @@ class llama_cpp_model_loader:
     def loadmodel(self, model: str, mmproj: str, chat_handler: str, n_ctx: int, vram_limit: int,
                   image_min_tokens: int, image_max_tokens: int,
                   draft_model_type: str, draft_ngram_size: int, draft_num_pred_tokens: int,
-                  enable_mtp: bool = False):
+                  enable_mtp: bool = False, async_load: bool = False):
         custom_config = {
             "model": model,
             "mmproj": mmproj,
@@ -87,9 +97,13 @@ class llama_cpp_model_loader:
             "draft_num_pred_tokens": draft_num_pred_tokens,
             "enable_mtp": enable_mtp
         }
-        if not LLAMA_CPP_STORAGE.llm or LLAMA_CPP_STORAGE.current_config != custom_config:
+        if not LLAMA_CPP_STORAGE.is_loaded(custom_config):
             #print("[llama-cpp_vlm] Loading model...")
-            LLAMA_CPP_STORAGE.load_model(custom_config)
+            if async_load:
+                # 下游节点调用 load_model 时会等待后台加载完成
+                LLAMA_CPP_STORAGE.preload(custom_config)
+            else:
+                LLAMA_CPP_STORAGE.load_model(custom_config)
         return (custom_config,)
 
 
@@ -105,16 +119,16 @@ class llama_cpp_instruct_adv:
                 "preset_prompt": (preset_tags, {"default": preset_tags[1]}),
                 "custom_prompt": ("STRING", {"default": "", "multiline": True, "placeholder": 'user_prompt\n\nFor preset hints marked with an "*", this will be used to fill the placeholder (e.g., Object names in BBox detection)\nOtherwise, this will override the preset prompts.'}),
                 "system_prompt": ("STRING", {"multiline": True, "default": ""}),
-                "inference_mode": (["one by one", "images", "video"], {
+                "inference_mode": (["one by one", "images", "video", "video windows"], {
                     "default": "one by one",
-                    "tooltip": "one by one: Read one image at a time\nimages:  \tRead all images at once\nvideo:  \tTreat the input images as video"
+                    "tooltip": "one by one: Read one image at a time\nimages:  \tRead all images at once\nvideo:  \tTreat the input images as video\nvideo windows: Caption the video in windows of window_frames frames, then combine the captions in a text-only pass (for long videos)"
                 }),
                 "max_frames": ("INT", {
                     "default": 24,
                     "min": 2,
                     "max": 1024,
                     "step": 1,
-                    "tooltip": 'Number of frames to sample evenly from input video.\n(for "video" mode only)'
+                    "tooltip": 'Number of frames to sample evenly from input video.\n(for "video" and "video windows" modes only)'
                 }),
                 "max_size": ("INT", {
                     "default": 256,
@@ -140,6 +154,18 @@ class llama_cpp_instruct_adv:
                 "parameters": ("LLAMACPPARAMS",),
                 "images": ("IMAGE",),
                 "queue_handler": (any_type, {"tooltip": "Used to control the execution order of instruct nodes."}),
+                "stream": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Stream partial output and tokens/sec to the node while generating.\nInterrupting stops decoding immediately."
+                }),
+                "structured_output": (STRUCTURED_MODES, {"default": "off", "tooltip": STRUCTURED_TOOLTIP}),
+                "dedup_threshold": ("INT", {"default": 0, "min": 0, "max": 32, "step": 1, "tooltip": DEDUP_TOOLTIP}),
+                "frame_sampling": (SAMPLING_MODES, {"default": "uniform", "tooltip": SAMPLING_TOOLTIP}),
+                "window_frames": ("INT", {"default": 8, "min": 1, "max": 64, "step": 1, "tooltip": WINDOW_TOOLTIP}),
+                "reuse_previous_output": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": 'One by one mode: draft each image\'s output from the previous image\'s output (speculative decoding, same result).\nFast on near-duplicate video frames. Requires draft_model_type other than None.'
+                }),
             },
         }
 
@@ -159,10 +185,7 @@ class llama_cpp_instruct_adv:
                         item["image_url"]["url"] = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAACXBIWXMAAAsTAAALEwEAmpwYAAAADElEQVQImWP4//8/AAX+Av5Y8msOAAAAAElFTkSuQmCC"
         return clean_messages
 
-    def process(self, llama_model, preset_prompt, custom_prompt, system_prompt, inference_mode, max_frames, max_size, seed, force_offload, save_states, unique_id, parameters=None, images=None, queue_handler=None):
-        if not LLAMA_CPP_STORAGE.llm:
-            LLAMA_CPP_STORAGE.load_model(llama_model)
-
+    def process(self, llama_model, preset_prompt, custom_prompt, system_prompt, inference_mode, max_frames, max_size, seed, force_offload, save_states, unique_id, parameters=None, images=None, queue_handler=None, stream=False, structured_output="off", reuse_previous_output=False, dedup_threshold=0, frame_sampling="uniform", window_frames=8):
         if parameters is None:
             parameters = {
                 "max_tokens": 1024,
@@ -188,7 +211,7 @@ class llama_cpp_instruct_adv:
         uid = unique_id.rpartition('.')[-1] if _uid in (None, -1) else _uid
 
         last_sys_prompt = LLAMA_CPP_STORAGE.sys_prompts.get(f"{uid}", None)
-        video_input = inference_mode == "video"
+        video_input = inference_mode in ("video", "video windows")
         # 根据是否有图片和视频模式调整系统提示词
         if images is None:
             # 不传图片时，作为个人AI助手
@@ -243,76 +266,208 @@ class llama_cpp_instruct_adv:
             p = p.replace("#", custom_prompt.strip())
             user_content.append({"type": "text", "text": p})
 
-        if images is not None:
-            if not hasattr(LLAMA_CPP_STORAGE.chat_handler, "clip_model_path") or LLAMA_CPP_STORAGE.chat_handler.clip_model_path is None:
-                raise ValueError("Image input detected, but the loaded model is not configured with a mmproj module.")
+        # 结构化输出：按 JSON schema 约束解码，结果一定可被 parse_json 解析
+        response_format = response_format_for(structured_output, user_content[0]["text"])
+        if response_format is not None:
+            _parameters["response_format"] = response_format
+
+        # 输入完全相同时直接返回缓存结果（多轮对话依赖历史，不使用缓存；缓存关闭时不对图片做哈希）
+        cache_key = None
+        if not save_states and RESPONSE_CACHE.enabled:
+            cache_key = RESPONSE_CACHE.make_key(
+                "llama_cpp_instruct_adv", llama_model, system_prompts, user_content,
+                inference_mode, max_frames, max_size, seed, _parameters, images,
+                *([dedup_threshold] if dedup_threshold else []),
+                *([frame_sampling] if frame_sampling != "uniform" else []),
+                *([window_frames] if inference_mode == "video windows" else [])
+            )
+            cached = RESPONSE_CACHE.get(cache_key)
+            if cached is not None:
+                if not LLAMA_CPP_STORAGE.messages.get(f"{uid}"):
+                    LLAMA_CPP_STORAGE.sys_prompts.pop(f"{uid}", None)
+                return (cached[0], cached[1], uid)
+
+        if not LLAMA_CPP_STORAGE.is_loaded(llama_model):
+            LLAMA_CPP_STORAGE.load_model(llama_model)
 
-            frames = images
-            if video_input:
-                indices = np.linspace(0, len(images) - 1, max_frames, dtype=int)
-                frames = [images[i] for i in indices]
-
-            if inference_mode == "one by one":
-                tmp_list = []
-                image_content = {
-                    "type": "image_url",
-                    "image_url": {"url": ""}
-                }
-                user_content.append(image_content)
-                messages.append({"role": "user", "content": user_content})
-                #print(f"[llama-cpp_vlm] Start processing {len(frames)} images")
-
-                for i, image in enumerate(cqdm(frames)):
-                    if mm.processing_interrupted():
-                        raise mm.InterruptProcessingException()
-                    data = image_to_base64_jpeg(image)
-                    for item in user_content:
-                        if item.get("type") == "image_url":
-                            item["image_url"]["url"] = f"data:image/jpeg;base64,{data}"
-                            break
-                    output = LLAMA_CPP_STORAGE.llm.create_chat_completion(messages=messages, seed=seed, **_parameters)
-                    text = output['choices'][0]['message']['content'].removeprefix(": ").lstrip()
-                    out2.append(text)
-                    if len(frames) > 1:
-                        tmp_list.append(f"====== Image {i+1} ======")
-                    tmp_list.append(text)
-                    data = None
-
-                out1 = "\n\n".join(tmp_list)
+        if save_states and messages:
+            # 恢复上一轮的 KV state，本轮只需计算新消息
+            LLAMA_CPP_STORAGE.messages.restore_state(f"{uid}", LLAMA_CPP_STORAGE.llm)
+
+        progress = StreamProgress(unique_id) if stream else None
+
+        def run_completion(messages, params=None):
+            params = _parameters if params is None else params
+            if progress is None:
+                output = LLAMA_CPP_STORAGE.llm.create_chat_completion(messages=messages, seed=seed, **params)
+                text = output['choices'][0]['message']['content']
             else:
-                for image in frames:
-                    if len(frames) > 1:
-                        img_np = scale_image_tensor(image, max_size)
-                    else:
-                        img_np = tensor_to_numpy(image)
-                    data = image_to_base64_jpeg(img_np)
+                deltas = chat_completion_deltas(LLAMA_CPP_STORAGE.llm, messages=messages, seed=seed, **params)
+                text = consume_stream(deltas, progress)
+            return text.removeprefix(": ").lstrip()
+
+        try:
+            if images is not None:
+                if not hasattr(LLAMA_CPP_STORAGE.chat_handler, "clip_model_path") or LLAMA_CPP_STORAGE.chat_handler.clip_model_path is None:
+                    raise ValueError("Image input detected, but the loaded model is not configured with a mmproj module.")
+
+                frames = images
+                if dedup_threshold > 0 and inference_mode != "one by one":
+                    # 先去掉近似重复帧，再在剩余帧中均匀采样
+                    frames = unique_frames(images, dedup_threshold)
+                    print(f"[llama-cpp_vlm] Frame dedup: {len(images)} -> {len(frames)} frames")
+                if video_input:
+                    count = min(max_frames, len(frames)) if dedup_threshold > 0 else max_frames
+                    indices = sample_frames(frames, count, frame_sampling)
+                    if frame_sampling != "uniform":
+                        print(f"[llama-cpp_vlm] Frame sampling ({frame_sampling}): {indices.tolist()}")
+                    frames = [frames[i] for i in indices]
+
+                if inference_mode == "one by one":
+                    tmp_list = []
                     image_content = {
                         "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{data}"}
+                        "image_url": {"url": ""}
                     }
                     user_content.append(image_content)
-
+                    messages.append({"role": "user", "content": user_content})
+                    #print(f"[llama-cpp_vlm] Start processing {len(frames)} images")
+
+                    # 近似重复的帧只推理一次，结果按输入帧顺序展开
+                    keep, owner = dedup_frames(frames, dedup_threshold)
+                    if len(keep) < len(frames):
+                        print(f"[llama-cpp_vlm] Frame dedup: {len(frames)} frames, {len(keep)} distinct")
+                        unique = [frames[j] for j in keep]
+                    else:
+                        unique = frames
+                    captions = []
+
+                    # 系统提示词 + 预设文本在每帧都相同，只评估一次并通过 llama state 快照复用
+                    # reuse_previous_output: 上一帧的输出作为下一帧推测解码的草稿来源
+                    with PrefixStateCache(LLAMA_CPP_STORAGE.llm), \
+                            PreviousOutputDrafting(LLAMA_CPP_STORAGE.llm, reuse_previous_output) as drafting:
+                        for k, data in enumerate(cqdm(JpegFrames(unique))):
+                            if mm.processing_interrupted():
+                                raise mm.InterruptProcessingException()
+                            for item in user_content:
+                                if item.get("type") == "image_url":
+                                    item["image_url"]["url"] = f"data:image/jpeg;base64,{data}"
+                                    break
+                            if progress is not None and len(frames) > 1:
+                                progress.write(f"====== Image {keep[k]+1} ======\n\n")
+                            text = run_completion(messages)
+                            drafting.feed(text)
+                            if progress is not None:
+                                progress.write("\n\n")
+                            captions.append(text)
+                            data = None
+
+                    for i in range(len(frames)):
+                        text = captions[owner[i]]
+                        out2.append(text)
+                        if len(frames) > 1:
+                            tmp_list.append(f"====== Image {i+1} ======")
+                        tmp_list.append(text)
+
+                    out1 = "\n\n".join(tmp_list)
+                elif inference_mode == "video windows":
+                    # map：每个窗口单独描述，上下文中只有一个窗口的帧；系统提示词 + 窗口提示词的前缀状态跨窗口复用
+                    windows = split_windows(len(frames), window_frames)
+                    llm = LLAMA_CPP_STORAGE.llm
+                    task = user_content[0]["text"]
+
+                    def count_tokens(text):
+                        return len(llm.tokenize(text.encode("utf-8"), add_bos=False, special=False))
+
+                    # 汇总提示词（含历史对话）+ 生成长度必须放进 n_ctx，剩余部分才能放窗口描述
+                    history = "\n".join(
+                        m["content"] if isinstance(m["content"], str)
+                        else "\n".join(p.get("text", "") for p in m["content"] if isinstance(p, dict))
+                        for m in messages
+                    )
+                    max_tokens = _parameters.get("max_tokens") or 0
+                    max_tokens = max_tokens if max_tokens > 0 else 1024
+                    overhead = count_tokens(history) + max(count_tokens(reduce_prompt(task, [])), count_tokens(merge_prompt([]))) + 64
+                    budget = llm.n_ctx() - max_tokens - overhead
+                    cap = caption_budget(budget)
+                    if cap < 64:
+                        raise ValueError(f"n_ctx {llm.n_ctx()} is too small for video windows with max_tokens {max_tokens}")
+                    # 每个窗口描述限长，保证任意两段都能放进一次合并
+                    map_parameters = {k: v for k, v in _parameters.items() if k != "response_format"}
+                    map_parameters["max_tokens"] = min(max_tokens, cap)
+                    summaries = []
+                    with PrefixStateCache(LLAMA_CPP_STORAGE.llm):
+                        for w, (start, end) in enumerate(cqdm(windows)):
+                            if mm.processing_interrupted():
+                                raise mm.InterruptProcessingException()
+                            window_content = [{"type": "text", "text": WINDOW_PROMPT}]
+                            for data in encode_frames(frames[start:end], max_size):
+                                window_content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{data}"}})
+                            if progress is not None:
+                                progress.write(f"====== Window {w+1}/{len(windows)} ======\n\n")
+                            window_messages = [{"role": "system", "content": system_prompts}, {"role": "user", "content": window_content}]
+                            summaries.append(run_completion(window_messages, map_parameters))
+                            if progress is not None:
+                                progress.write("\n\n")
+                            window_content = window_messages = None
+
+                    # 描述总长超出上下文时先分批合并（可多轮），每次调用的上下文都不超过 n_ctx
+                    def merge(batch, stage):
+                        if mm.processing_interrupted():
+                            raise mm.InterruptProcessingException()
+                        if progress is not None:
+                            progress.write(f"====== Merge (stage {stage}) ======\n\n")
+                        text = run_completion([{"role": "system", "content": system_prompts},
+                                               {"role": "user", "content": [{"type": "text", "text": merge_prompt(batch)}]}],
+                                              map_parameters)
+                        if progress is not None:
+                            progress.write("\n\n")
+                        return text
+
+                    merged = reduce_in_stages(summaries, budget, count_tokens, merge)
+                    if len(merged) < len(summaries):
+                        print(f"[llama-cpp_vlm] Video windows: merged {len(summaries)} window captions into {len(merged)}")
+
+                    # reduce：纯文本汇总各窗口描述，按用户提示词给出最终结果
+                    if progress is not None:
+                        progress.write("====== Summary ======\n\n")
+                    messages.append({"role": "user", "content": [{"type": "text", "text": reduce_prompt(task, merged)}]})
+                    out1 = run_completion(messages)
+                    out2 = summaries
+                else:
+                    for data in encode_frames(frames, max_size if len(frames) > 1 else None):
+                        image_content = {
+                            "type": "image_url",
+                            "image_url": {"url": f"data:image/jpeg;base64,{data}"}
+                        }
+                        user_content.append(image_content)
+
+                    messages.append({"role": "user", "content": user_content})
+                    out1 = run_completion(messages)
+                    out2 = [out1]
+            else:
                 messages.append({"role": "user", "content": user_content})
-                output = LLAMA_CPP_STORAGE.llm.create_chat_completion(messages=messages, seed=seed, **_parameters)
-                out1 = output['choices'][0]['message']['content'].removeprefix(": ").lstrip()
+                out1 = run_completion(messages)
                 out2 = [out1]
-        else:
-            messages.append({"role": "user", "content": user_content})
-            output = LLAMA_CPP_STORAGE.llm.create_chat_completion(messages=messages, seed=seed, **_parameters)
-            out1 = output['choices'][0]['message']['content'].removeprefix(": ").lstrip()
-            out2 = [out1]
+        finally:
+            # 出错或被中断时也要通知前端结束流式输出
+            if progress is not None:
+                progress.finish()
+
+        if cache_key is not None:
+            RESPONSE_CACHE.put(cache_key, [out1, out2])
 
         if save_states:
             #print(f"[llama-cpp_vlm] Saving state id={uid}...")
             messages.append({"role": "assistant", "content": out1})
             clear_message = self.sanitize_messages(messages)
-            LLAMA_CPP_STORAGE.messages[f"{uid}"] = clear_message
+            LLAMA_CPP_STORAGE.messages.save(f"{uid}", clear_message, LLAMA_CPP_STORAGE.llm)
         else:
             if not LLAMA_CPP_STORAGE.messages.get(f"{uid}"):
                 LLAMA_CPP_STORAGE.sys_prompts.pop(f"{uid}", None)
 
         if force_offload:
-            LLAMA_CPP_STORAGE.clean()
+            LLAMA_CPP_STORAGE.unload_current()
         else:
             if LLAMA_CPP_STORAGE.current_config["chat_handler"] in ["Qwen3.5", "Qwen3.5-Thinking"]:
                 LLAMA_CPP_STORAGE.llm.n_tokens = 0
@@ -356,12 +511,42 @@ class llama_cpp_parameters:
         return (kwargs,)
 
 
+class llama_cpp_generation_stats:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "reset": ("BOOLEAN", {"default": False, "tooltip": "Clear the recorded history after reporting."}),
+            },
+            "optional": {
+                "trigger": (any_type, {"tooltip": "Connect an instruct node output to report after it has run."}),
+            },
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("stats",)
+    FUNCTION = "process"
+    CATEGORY = "llama-cpp-vlm"
+
+    @classmethod
+    def IS_CHANGED(s, **kwargs):
+        return float("NaN")
+
+    def process(self, reset, trigger=None):
+        text = LLAMA_CPP_STORAGE.stats.summary()
+        print(f"[llama-cpp_vlm] {text}")
+        if reset:
+            LLAMA_CPP_STORAGE.stats.reset()
+        return (text,)
+
+
 # 合并基础节点映射和当前文件的独有节点
 NODE_CLASS_MAPPINGS = {
     **BASE_NODE_CLASS_MAPPINGS,
     "llama_cpp_model_loader": llama_cpp_model_loader,
     "llama_cpp_instruct_adv": llama_cpp_instruct_adv,
     "llama_cpp_parameters": llama_cpp_parameters,
+    "llama_cpp_generation_stats": llama_cpp_generation_stats,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
@@ -369,4 +554,5 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "llama_cpp_model_loader": "Llama-cpp Model Loader",
     "llama_cpp_instruct_adv": "Llama-cpp Instruct",
     "llama_cpp_parameters": "Llama-cpp Parameters",
+    "llama_cpp_generation_stats": "Llama-cpp Generation Stats",
 }
\ No newline at end of file
@@ -0,0 +1,134 @@
+import base64
+import io
+import re
+import wave
+from difflib import SequenceMatcher
+
+import numpy as np
+import torch
+
+# 能量帧长（秒）
+FRAME_SECONDS = 0.02
+# 计算能量时每次处理的采样数上限（长音频分块计算，避免整段再复制一份）
+ENERGY_BLOCK_SECONDS = 60
+# 低于 (最响帧 - SILENCE_DB) 或全局 20% 分位数 + 3dB 的帧视为静音
+SILENCE_DB = 35.0
+# 在窗口后半段寻找切分点
+SEARCH_FRACTION = 0.5
+# 拼接时比较的首尾 token 数与最少匹配 token 数
+STITCH_TOKENS = 48
+STITCH_MIN_MATCH = 3
+
+# 中日文按字切分，其它语言按词切分
+_TOKEN_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿]|[^\W_぀-ヿ㐀-䶿一-鿿]+")
+# 这些字符两侧拼接时不加空格
+_NO_SPACE_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿　-〿＀-￯]")
+
+
+def frame_energy(waveform, sample_rate, frame_seconds=FRAME_SECONDS):
+    """(C, T) waveform -> per-frame RMS energy in dB of the channel mix, computed block by block"""
+    hop = max(1, int(sample_rate * frame_seconds))
+    block = hop * max(1, int(ENERGY_BLOCK_SECONDS / frame_seconds))
+    total = waveform.shape[-1]
+    energies = []
+    for start in range(0, total, block):
+        seg = waveform[:, start:start + block].float().mean(0)
+        frames = seg.shape[-1] // hop
+        if frames == 0:
+            break
+        power = seg[:frames * hop].reshape(frames, hop).pow(2).mean(1)
+        energies.append(10.0 * torch.log10(power + 1e-10))
+    if not energies:
+        return np.zeros(0, dtype=np.float32), hop
+    return torch.cat(energies).cpu().numpy(), hop
+
+
+def plan_chunks(waveform, sample_rate, window_seconds, overlap_seconds, vad=True):
+    """
+    Split a (C, T) waveform into [(start, end, overlapped)] sample ranges of at most window_seconds.
+    With vad, each chunk ends at the quietest frame in the second half of its window when that
+    frame is silent, so no word is cut and no overlap is needed; otherwise the chunk ends at the
+    window and the next one starts overlap_seconds earlier (overlapped=True) for stitching.
+    """
+    total = waveform.shape[-1]
+    window = max(1, int(window_seconds * sample_rate))
+    overlap = min(int(overlap_seconds * sample_rate), window // 2)
+    if total <= window:
+        return [(0, total, False)]
+
+    energy, hop = frame_energy(waveform, sample_rate) if vad else (None, 1)
+    threshold = None
+    if vad and len(energy):
+        threshold = min(energy.max() - SILENCE_DB, np.percentile(energy, 20) + 3.0)
+
+    chunks = []
+    start, overlapped = 0, False
+    while start < total:
+        end = start + window
+        if end >= total:
+            chunks.append((start, total, overlapped))
+            break
+        if threshold is not None:
+            lo = (start + int(window * SEARCH_FRACTION)) // hop
+            hi = min(end // hop, len(energy))
+            if hi > lo:
+                quietest = lo + int(np.argmin(energy[lo:hi]))
+                if energy[quietest] <= threshold:
+                    cut = quietest * hop + hop // 2
+                    chunks.append((start, cut, overlapped))
+                    start, overlapped = cut, False
+                    continue
+        chunks.append((start, end, overlapped))
+        start, overlapped = end - overlap, overlap > 0
+    return chunks
+
+
+def wav_base64(waveform, sample_rate, start, end):
+    """Mono 16-bit PCM WAV of waveform[:, start:end] as base64 (only this chunk is converted)"""
+    pcm = waveform[:, start:end].float().mean(0).clamp(-1.0, 1.0).mul(32767.0).to(torch.int16).cpu().numpy()
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(int(sample_rate))
+        wav.writeframes(pcm.tobytes())
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+def _tokens(text):
+    return [(m.group().lower(), m.start(), m.end()) for m in _TOKEN_RE.finditer(text)]
+
+
+def stitch(prev, text):
+    """
+    Append the transcript of an overlapping chunk: the longest run of tokens (CJK characters
+    or words) shared by the end of prev and the start of text is kept once.
+    """
+    if not prev:
+        return text
+    if not text:
+        return prev
+    tail = _tokens(prev)[-STITCH_TOKENS:]
+    head = _tokens(text)[:STITCH_TOKENS]
+    match = SequenceMatcher(None, [t[0] for t in tail], [t[0] for t in head], autojunk=False).find_longest_match(
+        0, len(tail), 0, len(head))
+    # 重复内容应位于上一段末尾、本段开头
+    if match.size >= STITCH_MIN_MATCH and match.a + match.size >= len(tail) // 2 and match.b <= len(head) // 2:
+        prev = prev[:tail[match.a + match.size - 1][2]]
+        text = text[head[match.b + match.size - 1][2]:]
+        return prev + text
+    return join(prev, text)
+
+
+def join(prev, text):
+    """Concatenate transcripts, with a space unless a CJK character or punctuation is at the boundary"""
+    if not prev or not text or prev[-1].isspace() or text[0].isspace():
+        return prev + text
+    if _NO_SPACE_RE.match(prev[-1]) or _NO_SPACE_RE.match(text[0]):
+        return prev + text
+    return prev + " " + text
+
+
+def timestamp(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
@@ -0,0 +1,171 @@
+import json
+import threading
+import weakref
+from collections import OrderedDict
+
+from model_settings import load_model_config
+
+# 历史消息里的图片已替换成 1x1 占位图，按固定 token 数估算
+IMAGE_TOKENS = 64
+# 每条消息的对话模板开销（role 标记、换行等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class Conversation:
+    __slots__ = ("messages", "tokens", "nbytes", "state", "owner")
+
+    def __init__(self, messages, tokens, nbytes, state=None, owner=None):
+        self.messages = messages
+        self.tokens = tokens
+        self.nbytes = nbytes
+        self.state = state
+        # 保存 state 的模型实例：换模型后旧 state 不能再加载
+        self.owner = owner
+
+
+class ConversationStore:
+    """
+    save_states conversation history per state_uid, with bounded memory.
+
+    Each saved turn records its token count; history is trimmed from the oldest turns
+    (system prompt kept) so it stays within ctx_fraction of n_ctx, leaving room for the
+    next prompt and the reply. Idle conversations are evicted LRU once the total size,
+    including any saved KV state, exceeds max_bytes. With keep_kv_state the llama state
+    after each turn is kept, so the next turn restores it and only evaluates the new message.
+
+    Supports the dict operations the nodes used on the old plain dict (get/[]/pop/clear).
+    """
+
+    def __init__(self, ctx_fraction=0.75, max_bytes=256 * 1024 ** 2, keep_kv_state=False):
+        self.ctx_fraction = ctx_fraction
+        self.max_bytes = max_bytes
+        self.keep_kv_state = keep_kv_state
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, uid, default=None):
+        with self.lock:
+            conv = self.items.get(uid)
+            if conv is None:
+                return default
+            self.items.move_to_end(uid)
+            # 返回副本：未保存的本轮消息不会混入历史
+            return list(conv.messages)
+
+    def __getitem__(self, uid):
+        messages = self.get(uid)
+        if messages is None:
+            raise KeyError(uid)
+        return messages
+
+    def __setitem__(self, uid, messages):
+        self.save(uid, messages)
+
+    def __contains__(self, uid):
+        return uid in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def pop(self, uid, default=None):
+        with self.lock:
+            conv = self.items.pop(uid, None)
+        return default if conv is None else conv.messages
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def used_bytes(self):
+        return sum(conv.nbytes for conv in self.items.values())
+
+    @staticmethod
+    def count_tokens(message, llm=None):
+        content = message.get("content")
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+        tokens = MESSAGE_OVERHEAD_TOKENS
+        for part in parts:
+            if not isinstance(part, dict):
+                continue
+            if part.get("type") == "text":
+                text = part.get("text") or ""
+                if llm is not None:
+                    tokens += len(llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+                else:
+                    tokens += len(text.encode("utf-8")) // 3
+            elif part.get("type") == "image_url":
+                tokens += IMAGE_TOKENS
+        return tokens
+
+    def save(self, uid, messages, llm=None):
+        """Store the conversation after a turn; returns the number of messages trimmed"""
+        with self.lock:
+            old = self.items.get(uid)
+
+        # 与上一轮相同的消息对象直接复用已统计的 token 数
+        tokens = []
+        for i, message in enumerate(messages):
+            if old is not None and i < len(old.messages) and old.messages[i] is message:
+                tokens.append(old.tokens[i])
+            else:
+                tokens.append(self.count_tokens(message, llm))
+
+        messages = list(messages)
+        trimmed = 0
+        if llm is not None:
+            budget = int(llm.n_ctx() * self.ctx_fraction)
+            first = 1 if messages and messages[0].get("role") == "system" else 0
+            # 从最早的对话轮开始丢弃，至少保留最后一轮
+            while sum(tokens) > budget and len(messages) - first > 2:
+                del messages[first]
+                del tokens[first]
+                trimmed += 1
+                if len(messages) > first and messages[first].get("role") == "assistant":
+                    del messages[first]
+                    del tokens[first]
+                    trimmed += 1
+
+        state = None
+        if self.keep_kv_state and llm is not None and trimmed == 0 and not getattr(llm, "is_hybrid", False):
+            try:
+                state = llm.save_state()
+            except Exception as e:
+                print(f"[llama-cpp_vlm] Failed to save conversation state: {e}")
+
+        owner = weakref.ref(llm) if state is not None else None
+        nbytes = len(json.dumps(messages, ensure_ascii=False, default=str).encode("utf-8"))
+        if state is not None:
+            nbytes += state.llama_state_size
+
+        with self.lock:
+            self.items[uid] = Conversation(messages, tokens, nbytes, state, owner)
+            self.items.move_to_end(uid)
+            while len(self.items) > 1 and self.used_bytes() > self.max_bytes:
+                self.items.popitem(last=False)
+        if trimmed:
+            print(f"[llama-cpp_vlm] Conversation {uid}: dropped {trimmed} old messages to stay within {self.ctx_fraction:.0%} of n_ctx")
+        return trimmed
+
+    def restore_state(self, uid, llm):
+        """
+        Load the KV state saved after the last turn of uid into llm.
+        The next completion keeps the longest matching token prefix, so only the new message is evaluated.
+        """
+        with self.lock:
+            conv = self.items.get(uid)
+        if conv is None or conv.state is None or conv.owner() is not llm:
+            return False
+        try:
+            llm.load_state(conv.state)
+            return True
+        except Exception as e:
+            print(f"[llama-cpp_vlm] Failed to restore conversation state: {e}")
+            return False
+
+
+_settings = load_model_config().get("conversation_store", {})
+CONVERSATIONS = ConversationStore(
+    ctx_fraction=_settings.get("ctx_fraction", 0.75),
+    max_bytes=int(_settings.get("max_mb", 256) * 1024 ** 2),
+    keep_kv_state=_settings.get("keep_kv_state", False),
+)
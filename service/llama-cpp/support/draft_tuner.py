@@ -0,0 +1,357 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaNGramMapDecoding, LlamaPromptLookupDecoding
+
+DRAFT_TOOLTIP = (
+    "Speculative decoding draft model.\n"
+    "auto: Tune n-gram size / prediction length from measured acceptance and decode tokens/s, proposing no drafts "
+    "when they do not pay (the model stays loaded for drafting; ignores the two settings below)\n"
+    "ngram-map: Fast hash-based ngram matching (recommended)\n"
+    "prompt-lookup: Legacy sliding window search\n"
+    "None: No speculative decoding"
+)
+
+# auto 模式候选配置 (ngram_size, num_pred_tokens)；None 表示不再提出草稿 token。
+# 模型仍按带草稿模型加载（保留每个位置的 logits），这部分开销在 None 下依然存在
+AUTO_ARMS = (None, (3, 4), (3, 10), (4, 16), (2, 24))
+# 接受率低于此值的配置视为得不偿失，只在探索时再试
+MIN_ACCEPTANCE = 0.15
+# 每隔多少次生成随机探索一次其它配置
+EXPLORE_EVERY = 10
+# 指数滑动平均系数
+EMA_ALPHA = 0.3
+HISTORY_SIZE = 200
+# 参考文本（如上一帧的输出）查找：最长匹配 n-gram 与每次最多预测的 token 数
+REFERENCE_NGRAM = 3
+REFERENCE_PRED_TOKENS = 16
+
+
+def make_draft(draft_type, ngram_size, num_pred_tokens):
+    if draft_type == "ngram-map":
+        return LlamaNGramMapDecoding(ngram_size=ngram_size, num_pred_tokens=num_pred_tokens)
+    if draft_type == "prompt-lookup":
+        return LlamaPromptLookupDecoding(max_ngram_size=ngram_size, num_pred_tokens=num_pred_tokens)
+    return None
+
+
+def lookup_reference(input_ids, reference, cursor=0, max_ngram=REFERENCE_NGRAM, num_pred=REFERENCE_PRED_TOKENS):
+    """
+    Find the longest suffix n-gram of input_ids in reference and return (continuation, new cursor).
+    Matches at or after the cursor (where the last accepted run ended) are preferred, so
+    consecutive captions are followed in order instead of jumping to an earlier repeat.
+    """
+    input_ids = np.asarray(input_ids)
+    for n in range(min(max_ngram, len(input_ids)), 0, -1):
+        if len(reference) <= n:
+            continue
+        pattern = input_ids[-n:]
+        windows = np.lib.stride_tricks.sliding_window_view(reference[:-1], n)
+        hits = np.flatnonzero((windows == pattern).all(axis=1))
+        if hits.size == 0:
+            continue
+        after = hits[hits >= cursor]
+        start = int(after[0] if after.size else hits[0]) + n
+        continuation = reference[start:start + num_pred]
+        return continuation, start
+    return reference[:0], cursor
+
+
+def classify_workload(messages):
+    """Coarse workload label used to keep separate tuning stats: image captioning vs. text tasks"""
+    for message in messages or []:
+        content = message.get("content")
+        if isinstance(content, list) and any(isinstance(p, dict) and p.get("type") == "image_url" for p in content):
+            return "vision"
+    return "text"
+
+
+class TrackedDraft(LlamaDraftModel):
+    """
+    Draft model wrapper that measures how many proposed tokens the target model accepted.
+
+    Llama.generate calls the draft with the tokens so far (ending in the last sampled token);
+    on the next call the tokens after the previous call's prefix show how far the previous
+    proposal matched, so acceptance is derived without changes to llama-cpp-python.
+    """
+
+    def __init__(self, inner, label):
+        self.inner = inner
+        self.label = label
+        self.proposed = 0
+        self.accepted = 0
+        self.reference = None
+        self._cursor = 0
+        self._pending = None
+
+    def __getattr__(self, name):
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    def begin(self, workload):
+        self.proposed = 0
+        self.accepted = 0
+        self._pending = None
+
+    def end(self, record):
+        self._pending = None
+        record.update(draft=self.label, proposed=self.proposed, accepted=self.accepted)
+
+    def _account(self, input_ids):
+        if self._pending is None:
+            return
+        prev_len, proposal = self._pending
+        self._pending = None
+        if len(input_ids) <= prev_len:
+            return
+        actual = input_ids[prev_len:prev_len + len(proposal)]
+        matched = 0
+        for a, p in zip(actual, proposal):
+            if a != p:
+                break
+            matched += 1
+        self.proposed += len(proposal)
+        self.accepted += matched
+
+    def set_reference(self, tokens):
+        """Extra token sequence to draft from (e.g. the previous frame's caption); None to disable"""
+        self.reference = None if tokens is None else np.asarray(tokens, dtype=np.intc)
+        self._cursor = 0
+
+    def _propose(self, input_ids, **kwargs):
+        if self.reference is not None and len(self.reference):
+            proposal, self._cursor = lookup_reference(input_ids, self.reference, self._cursor)
+            if len(proposal):
+                return proposal
+        if self.inner is None:
+            return np.array([], dtype=np.intc)
+        return self.inner(input_ids, **kwargs)
+
+    def __call__(self, input_ids, /, **kwargs):
+        self._account(input_ids)
+        proposal = self._propose(input_ids, **kwargs)
+        if len(proposal):
+            self._pending = (len(input_ids), np.asarray(proposal).tolist())
+        return proposal
+
+
+class AdaptiveDraft(TrackedDraft):
+    """
+    "auto" draft mode: picks the n-gram size / prediction length with the best measured
+    decode tokens/sec per workload from AUTO_ARMS. The "off" arm (None) only stops proposing
+    draft tokens: the model was still loaded for drafting, so it keeps the per-position logits
+    and is not as fast as a model loaded with draft_model_type None.
+    Untried arms are tried first, then the best arm is used with periodic exploration;
+    arms whose acceptance stays below MIN_ACCEPTANCE are only revisited when exploring.
+    """
+
+    def __init__(self, draft_type="ngram-map"):
+        super().__init__(None, "auto")
+        self.draft_type = draft_type
+        self.arm_stats = {}  # (workload, arm) -> {"n", "tps", "acceptance"}
+        self.generations = 0
+        self.arm = None
+        self._drafts = {}
+
+    def _score(self, workload, arm):
+        stats = self.arm_stats.get((workload, arm))
+        if stats is None:
+            return None
+        if arm is not None and stats["n"] >= 2 and stats["acceptance"] < MIN_ACCEPTANCE:
+            return -1.0
+        return stats["tps"]
+
+    def choose(self, workload):
+        self.generations += 1
+        untried = [arm for arm in AUTO_ARMS if (workload, arm) not in self.arm_stats]
+        if untried:
+            return untried[0]
+        if self.generations % EXPLORE_EVERY == 0:
+            return random.choice(AUTO_ARMS)
+        return max(AUTO_ARMS, key=lambda arm: self._score(workload, arm))
+
+    def begin(self, workload):
+        super().begin(workload)
+        self.workload = workload
+        self.arm = self.choose(workload)
+        if self.arm is None:
+            self.inner = None
+        else:
+            # 每个配置保留一个草稿实例，切换时不丢失其内部状态
+            if self.arm not in self._drafts:
+                self._drafts[self.arm] = make_draft(self.draft_type, *self.arm)
+            self.inner = self._drafts[self.arm]
+
+    def end(self, record):
+        super().end(record)
+        record["draft"] = "auto:off" if self.arm is None else f"auto:{self.arm[0]}/{self.arm[1]}"
+        if not record.get("tokens"):
+            return
+        acceptance = self.accepted / self.proposed if self.proposed else 0.0
+        stats = self.arm_stats.get((self.workload, self.arm))
+        if stats is None:
+            self.arm_stats[(self.workload, self.arm)] = {"n": 1, "tps": record["tps"], "acceptance": acceptance}
+        else:
+            stats["n"] += 1
+            stats["tps"] += EMA_ALPHA * (record["tps"] - stats["tps"])
+            stats["acceptance"] += EMA_ALPHA * (acceptance - stats["acceptance"])
+
+    def summary(self):
+        lines = []
+        for workload in sorted({w for w, _ in self.arm_stats}):
+            best = max(AUTO_ARMS, key=lambda arm: self._score(workload, arm) or 0.0)
+            parts = []
+            for arm in AUTO_ARMS:
+                stats = self.arm_stats.get((workload, arm))
+                if stats:
+                    name = "off" if arm is None else f"{arm[0]}/{arm[1]}"
+                    parts.append(f"{name}: {stats['tps']:.1f} t/s, accept {stats['acceptance']:.0%} (n={stats['n']})")
+            best_name = "off" if best is None else f"{best[0]}/{best[1]}"
+            lines.append(f"  auto [{workload}] best={best_name} | " + "; ".join(parts))
+        return "\n".join(lines)
+
+
+class PreviousOutputDrafting:
+    """
+    Feed each output back as the draft reference for the next generation (one-by-one frame
+    captioning). Needs a model loaded with a draft model: llama-cpp-python only keeps the
+    per-position logits required to verify drafts when the draft is given at load time.
+    """
+
+    def __init__(self, llm, enabled=True):
+        self.llm = llm
+        self.draft = None
+        if enabled:
+            draft = getattr(llm, "draft_model", None)
+            if isinstance(draft, TrackedDraft):
+                self.draft = draft
+            else:
+                print("[llama-cpp_vlm] reuse_previous_output needs draft_model_type other than None on the model loader")
+
+    def __enter__(self):
+        return self
+
+    def feed(self, text):
+        if self.draft is not None and text:
+            self.draft.set_reference(self.llm.tokenize(text.encode("utf-8"), add_bos=False, special=False))
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.draft is not None:
+            self.draft.set_reference(None)
+
+
+class GenerationStats:
+    """
+    Per-generation telemetry (decode tokens/sec, draft acceptance) for the llama-cpp nodes.
+    Speed is measured from the first sampled token, so prompt and image evaluation are excluded.
+    """
+
+    def __init__(self, maxlen=HISTORY_SIZE):
+        self.history = deque(maxlen=maxlen)
+        self.tuners = {}  # model name -> AdaptiveDraft
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.history.append(record)
+
+    def reset(self):
+        with self.lock:
+            self.history.clear()
+
+    def summary(self):
+        with self.lock:
+            records = list(self.history)
+        if not records:
+            return "No generations recorded yet."
+        groups = {}
+        for r in records:
+            groups.setdefault((r["model"], r["workload"], r["draft"]), []).append(r)
+        lines = [f"Last {len(records)} generations:"]
+        for (model, workload, draft), rs in groups.items():
+            tokens = sum(r["tokens"] for r in rs)
+            decoded = sum(max(r["tokens"] - 1, 0) for r in rs)
+            seconds = sum(r["seconds"] for r in rs)
+            proposed = sum(r["proposed"] for r in rs)
+            accepted = sum(r["accepted"] for r in rs)
+            tps = decoded / seconds if seconds > 0 else 0.0
+            line = f"  {model} [{workload}] draft={draft}: {len(rs)} runs, {tokens} tokens, {tps:.1f} tokens/s decode"
+            if proposed:
+                line += f", acceptance {accepted / proposed:.0%} ({accepted}/{proposed})"
+            lines.append(line)
+        for tuner in self.tuners.values():
+            text = tuner.summary()
+            if text:
+                lines.append(text)
+        return "\n".join(lines)
+
+    def instrument(self, llm, model_path, draft=None):
+        """
+        Wrap llm.create_chat_completion so every generation is timed and recorded;
+        the tracked draft (if any) is told when a generation starts and ends.
+        llm.sample is wrapped to note when the first token is sampled (prompt and images are
+        evaluated by then), and seconds/tps cover only the decoding after it.
+        Calling it again (e.g. after the draft model was swapped) replaces the previous wrappers.
+        """
+        model = os.path.basename(model_path)
+        if isinstance(draft, AdaptiveDraft):
+            self.tuners[model] = draft
+        original = llm.__dict__.get("_uninstrumented_chat_completion") or llm.create_chat_completion
+        llm._uninstrumented_chat_completion = original
+        sample = llm.__dict__.get("_uninstrumented_sample") or llm.sample
+        llm._uninstrumented_sample = sample
+        llm._first_sample_at = None
+
+        def timed_sample(*args, **kwargs):
+            if llm._first_sample_at is None:
+                llm._first_sample_at = time.perf_counter()
+            return sample(*args, **kwargs)
+
+        def finish(record, start, tokens):
+            end = time.perf_counter()
+            # 第一个 token 采样之后才是纯解码阶段（提示词、图像编码不计入）
+            first = llm._first_sample_at or end
+            record["total_seconds"] = end - start
+            record["seconds"] = end - first
+            record["tokens"] = tokens
+            record["tps"] = (tokens - 1) / record["seconds"] if tokens > 1 and record["seconds"] > 0 else 0.0
+            if draft is not None:
+                draft.end(record)
+            else:
+                record.update(draft="None", proposed=0, accepted=0)
+            self.add(record)
+
+        def stream_and_record(chunks, record, start):
+            tokens = 0
+            try:
+                for chunk in chunks:
+                    choices = chunk.get("choices") or []
+                    if choices and (choices[0].get("delta") or {}).get("content"):
+                        tokens += 1
+                    yield chunk
+            finally:
+                finish(record, start, tokens)
+
+        def create_chat_completion(*args, **kwargs):
+            record = {"model": model, "workload": classify_workload(kwargs.get("messages"))}
+            if draft is not None:
+                draft.begin(record["workload"])
+            llm._first_sample_at = None
+            start = time.perf_counter()
+            result = original(*args, **kwargs)
+            if kwargs.get("stream"):
+                return stream_and_record(result, record, start)
+            finish(record, start, (result.get("usage") or {}).get("completion_tokens", 0))
+            return result
+
+        llm.sample = timed_sample
+        llm.create_chat_completion = create_chat_completion
+        return llm
+
+
+GENERATION_STATS = GenerationStats()
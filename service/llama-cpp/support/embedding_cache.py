@@ -0,0 +1,190 @@
+import ctypes
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from model_settings import load_model_config
+
+# mtmd_input_chunk_type: TEXT = 0, IMAGE = 1, AUDIO = 2
+_CHUNK_TYPE_IMAGE = 1
+# 由本模块写入的 bitmap id 前缀，其它 id（如 handler 自己设置的）不参与缓存
+_ID_PREFIX = "cj:"
+
+# 缓存路径需要的 libmtmd 接口，缺少任一项时不启用
+_REQUIRED = (
+    "mtmd_helper_bitmap_init_from_buf", "mtmd_bitmap_set_id", "mtmd_helper_eval_chunk_single",
+    "mtmd_input_chunk_get_type", "mtmd_input_chunk_get_tokens_image", "mtmd_image_tokens_get_id",
+    "mtmd_image_tokens_get_n_tokens", "mtmd_encode_chunk", "mtmd_get_output_embd",
+    "mtmd_helper_decode_image_chunk",
+)
+
+
+def _buffer_bytes(buf, n_bytes):
+    if isinstance(buf, (bytes, bytearray)):
+        return bytes(buf[:n_bytes])
+    if isinstance(buf, ctypes.Array):
+        return ctypes.string_at(ctypes.addressof(buf), n_bytes)
+    return ctypes.string_at(buf, n_bytes)
+
+
+def _n_embd(lctx):
+    """Width of one projected image token (llama_model_n_embd_inp covers Qwen3-VL deepstack)"""
+    import llama_cpp.llama_cpp as llama_cpp
+    model = llama_cpp.llama_get_model(lctx)
+    if hasattr(llama_cpp, "llama_model_n_embd_inp"):
+        return llama_cpp.llama_model_n_embd_inp(model)
+    return llama_cpp.llama_model_n_embd(model)
+
+
+class EmbeddingCache:
+    """
+    LRU cache of projected image embeddings, bounded by total bytes.
+
+    Keyed by (mmproj path, image content hash, image_min_tokens, image_max_tokens); the
+    embeddings are exactly what the vision tower + projector output for that image, so a
+    hit decodes them straight into the llama context without running the mmproj encoder.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            embd = self.entries.get(key)
+            if embd is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return embd
+
+    def put(self, key, embd):
+        if embd.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.used_bytes -= old.nbytes
+            self.entries[key] = embd
+            self.used_bytes += embd.nbytes
+            while self.used_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.used_bytes -= evicted.nbytes
+
+    def drop(self, mmproj_path):
+        """Forget all embeddings of one mmproj"""
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == mmproj_path]:
+                self.used_bytes -= self.entries.pop(key).nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used_bytes = 0
+
+    def install(self, chat_handler, mmproj_path, image_min_tokens=0, image_max_tokens=0):
+        """
+        Route the image encodes of an mtmd-based chat handler through this cache.
+        Returns False (and leaves the handler untouched) when the handler or the
+        installed llama-cpp-python does not expose the required libmtmd calls.
+        """
+        if self.max_bytes <= 0 or chat_handler is None:
+            return False
+        lib = getattr(chat_handler, "_mtmd_cpp", None)
+        if lib is None or isinstance(lib, _CachedMtmd):
+            return False
+        if not all(hasattr(lib, name) for name in _REQUIRED):
+            print("[llama-cpp_vlm] Image embedding cache unavailable for this llama-cpp-python build")
+            return False
+        chat_handler._mtmd_cpp = _CachedMtmd(lib, self, (mmproj_path, image_min_tokens, image_max_tokens))
+        return True
+
+
+class _CachedMtmd:
+    """
+    Stand-in for the handler's libmtmd binding module.
+
+    Bitmaps get a content-hash id when created; evaluating an image chunk whose id is
+    cached decodes the stored embeddings, otherwise the chunk is encoded once and its
+    output copied into the cache. Every other call goes to the real binding.
+    """
+
+    def __init__(self, lib, cache, scope):
+        self._lib = lib
+        self._cache = cache
+        self._scope = scope
+
+    def __getattr__(self, name):
+        return getattr(self._lib, name)
+
+    def mtmd_helper_bitmap_init_from_buf(self, ctx, buf, n_bytes, *args):
+        bitmap = self._lib.mtmd_helper_bitmap_init_from_buf(ctx, buf, n_bytes, *args)
+        if bitmap:
+            try:
+                digest = hashlib.blake2b(_buffer_bytes(buf, n_bytes), digest_size=16).hexdigest()
+                self._lib.mtmd_bitmap_set_id(bitmap, (_ID_PREFIX + digest).encode("utf-8"))
+            except Exception as e:
+                print(f"[llama-cpp_vlm] Failed to tag image for embedding cache: {e}")
+        return bitmap
+
+    def _image_key(self, chunk):
+        lib = self._lib
+        if lib.mtmd_input_chunk_get_type(chunk) != _CHUNK_TYPE_IMAGE:
+            return None, None
+        image_tokens = lib.mtmd_input_chunk_get_tokens_image(chunk)
+        image_id = lib.mtmd_image_tokens_get_id(image_tokens)
+        if isinstance(image_id, bytes):
+            image_id = image_id.decode("utf-8", "ignore")
+        if not image_id or not image_id.startswith(_ID_PREFIX):
+            return None, None
+        mmproj_path, min_tokens, max_tokens = self._scope
+        return (mmproj_path, image_id, min_tokens, max_tokens), image_tokens
+
+    def mtmd_helper_eval_chunk_single(self, ctx, lctx, chunk, n_past, seq_id, n_batch, logits_last, new_n_past):
+        lib = self._lib
+        key, image_tokens = self._image_key(chunk)
+        if key is None:
+            return lib.mtmd_helper_eval_chunk_single(ctx, lctx, chunk, n_past, seq_id, n_batch, logits_last, new_n_past)
+
+        embd = self._cache.get(key)
+        if embd is None:
+            if lib.mtmd_encode_chunk(ctx, chunk) != 0:
+                return lib.mtmd_helper_eval_chunk_single(ctx, lctx, chunk, n_past, seq_id, n_batch, logits_last, new_n_past)
+            n_floats = lib.mtmd_image_tokens_get_n_tokens(image_tokens) * _n_embd(lctx)
+            embd = np.ctypeslib.as_array(lib.mtmd_get_output_embd(ctx), shape=(n_floats,)).copy()
+            self._cache.put(key, embd)
+
+        embd_ptr = embd.ctypes.data_as(ctypes.POINTER(ctypes.c_float))
+        return lib.mtmd_helper_decode_image_chunk(ctx, lctx, chunk, embd_ptr, n_past, seq_id, n_batch, new_n_past)
+
+    def mtmd_helper_eval_chunks(self, ctx, lctx, chunks, n_past, seq_id, n_batch, logits_last, new_n_past):
+        """Same as libmtmd's helper, but every chunk goes through the cached single-chunk path"""
+        lib = self._lib
+        if not (hasattr(lib, "mtmd_input_chunks_size") and hasattr(lib, "mtmd_input_chunks_get")):
+            return lib.mtmd_helper_eval_chunks(ctx, lctx, chunks, n_past, seq_id, n_batch, logits_last, new_n_past)
+        n_chunks = lib.mtmd_input_chunks_size(chunks)
+        pos = getattr(n_past, "value", n_past)
+        for i in range(n_chunks):
+            out = ctypes.c_int32(pos)
+            ret = self.mtmd_helper_eval_chunk_single(ctx, lctx, lib.mtmd_input_chunks_get(chunks, i), pos, seq_id,
+                                                     n_batch, bool(logits_last) and i == n_chunks - 1, ctypes.byref(out))
+            if ret != 0:
+                return ret
+            pos = out.value
+        # new_n_past 可能是 byref() 或 pointer()
+        target = getattr(new_n_past, "_obj", None)
+        if target is None:
+            target = new_n_past.contents
+        target.value = pos
+        return 0
+
+
+_settings = load_model_config().get("embedding_cache", {})
+EMBEDDING_CACHE = EmbeddingCache(max_bytes=int(_settings.get("max_mb", 512) * 1024 ** 2))
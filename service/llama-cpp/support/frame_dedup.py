@@ -0,0 +1,48 @@
+import torch
+import torch.nn.functional as F
+
+from image_pipeline import as_batch
+
+DEDUP_TOOLTIP = (
+    "Skip near-identical frames: max differing bits of the 64-bit difference hash (0 = off, 4-8 typical).\n"
+    "images/video: duplicates are dropped before sampling.\n"
+    "one by one / per_image: each duplicate reuses the output of its first occurrence."
+)
+
+
+def dhash(images):
+    """64-bit difference hash per frame of a BHWC batch, computed on its own device -> (B, 64) bool"""
+    x = images[..., :3].float()
+    gray = x[..., 0] * 0.299 + x[..., 1] * 0.587 + x[..., 2] * 0.114 if x.shape[-1] == 3 else x[..., 0]
+    small = F.interpolate(gray.unsqueeze(1), size=(8, 9), mode="area").squeeze(1)
+    return (small[:, :, 1:] > small[:, :, :-1]).reshape(len(small), 64)
+
+
+def dedup_frames(images, threshold):
+    """
+    Group consecutive near-identical frames.
+    Returns (keep, owner): indices of the representative frames, and for every input
+    frame the position in `keep` of the representative whose output it shares.
+    A frame starts a new group when its hash differs from the current representative
+    by more than `threshold` bits; threshold <= 0 keeps every frame.
+    """
+    n = len(images)
+    if threshold <= 0 or n < 2:
+        return list(range(n)), list(range(n))
+    hashes = dhash(as_batch(images)).cpu()
+    keep, owner = [0], [0]
+    for i in range(1, n):
+        if int((hashes[i] != hashes[keep[-1]]).sum()) > threshold:
+            keep.append(i)
+        owner.append(len(keep) - 1)
+    return keep, owner
+
+
+def unique_frames(images, threshold):
+    """Frames left after dropping near-identical ones (same container type as the input)"""
+    keep, _owner = dedup_frames(images, threshold)
+    if len(keep) == len(images):
+        return images
+    if isinstance(images, torch.Tensor):
+        return images[keep]
+    return [images[i] for i in keep]
@@ -0,0 +1,87 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from image_pipeline import as_batch
+
+SAMPLING_MODES = ["uniform", "scene"]
+
+SAMPLING_TOOLTIP = (
+    "How max_frames frames are picked from a video batch.\n"
+    "uniform: evenly spaced frames\n"
+    "scene: one frame at each shot boundary, the rest spread by motion, so static spans use fewer frames"
+)
+
+# 差异分数计算用的缩略图尺寸
+SCORE_SIZE = 32
+# 镜头切换判定：差异超过 中位数 + CUT_MADS * MAD，且不低于 CUT_MIN（像素值 0-1）
+CUT_MADS = 6.0
+CUT_MIN = 0.08
+# 静止片段保留的最低采样权重（相对平均差异），避免长静止段完全没有采样
+STATIC_WEIGHT = 0.25
+
+
+def frame_scores(images):
+    """
+    Mean absolute difference of each frame to the previous one on SCORE_SIZE thumbnails,
+    computed in one batched pass on the images' device -> (B,) float32 numpy array, [0] = 0
+    """
+    x = as_batch(images)[..., :3].movedim(-1, 1)
+    small = F.interpolate(x.float(), size=(SCORE_SIZE, SCORE_SIZE), mode="area")
+    if small.shape[1] == 3:
+        small = small[:, 0] * 0.299 + small[:, 1] * 0.587 + small[:, 2] * 0.114
+    else:
+        small = small[:, 0]
+    diffs = (small[1:] - small[:-1]).abs().mean(dim=(1, 2))
+    return torch.cat([diffs.new_zeros(1), diffs]).cpu().numpy()
+
+
+def shot_boundaries(scores):
+    """Indices of frames that start a new shot, strongest cut first"""
+    if len(scores) < 3:
+        return np.array([], dtype=int)
+    diffs = scores[1:]
+    median = np.median(diffs)
+    mad = np.median(np.abs(diffs - median))
+    threshold = max(median + CUT_MADS * mad, CUT_MIN)
+    cuts = np.flatnonzero(scores > threshold)
+    return cuts[np.argsort(-scores[cuts], kind="stable")]
+
+
+def sample_frames(images, count, mode="uniform"):
+    """
+    Indices of the frames to send for a frame budget of `count`.
+    uniform is np.linspace over the batch (the previous behaviour). scene gives every shot
+    boundary a frame first (strongest cuts when the budget is short), then spends the rest
+    by inverse-CDF sampling of the per-frame motion, so a short action span gets several
+    frames while a long static one gets a few.
+    """
+    n = len(images)
+    if mode != "scene" or n <= 1 or count >= n:
+        return np.linspace(0, n - 1, count, dtype=int)
+    if count <= 1:
+        return np.array([0], dtype=int)
+
+    scores = frame_scores(images)
+    chosen = [0]
+    cuts = shot_boundaries(scores)
+    chosen += [int(c) for c in cuts[:count - 1] if c != 0]
+
+    weights = scores.astype(np.float64)
+    weights[chosen] = 0.0
+    weights += STATIC_WEIGHT * max(float(scores[1:].mean()), 1e-6)
+    cdf = np.cumsum(weights)
+    remaining = count - len(chosen)
+    if remaining > 0:
+        targets = (np.arange(remaining) + 0.5) / remaining * cdf[-1]
+        taken = np.zeros(n, dtype=bool)
+        taken[chosen] = True
+        for idx in np.searchsorted(cdf, targets):
+            idx = min(int(idx), n - 1)
+            if taken[idx]:
+                # 与已选帧重合时取最近的未选帧
+                free = np.flatnonzero(~taken)
+                idx = int(free[np.argmin(np.abs(free - idx))])
+            taken[idx] = True
+            chosen.append(idx)
+    return np.array(sorted(chosen), dtype=int)
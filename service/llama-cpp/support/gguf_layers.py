@@ -1,102 +1,256 @@
+import mmap
+import os
 import struct
+import threading
+from collections import OrderedDict, namedtuple
+
+# GGUF value types -> (struct format, size)
+SCALAR_TYPES = {
+    0: ("<B", 1),   # uint8
+    1: ("<b", 1),   # int8
+    2: ("<H", 2),   # uint16
+    3: ("<h", 2),   # int16
+    4: ("<I", 4),   # uint32
+    5: ("<i", 4),   # int32
+    6: ("<f", 4),   # float32
+    7: ("<?", 1),   # bool
+    10: ("<Q", 8),  # uint64
+    11: ("<q", 8),  # int64
+    12: ("<d", 8),  # float64
+}
+TYPE_STRING = 8
+TYPE_ARRAY = 9
+
+# Arrays longer than this (tokenizer vocab, scores, merges...) are skipped, not materialized
+MAX_ARRAY_ITEMS = 64
+
+# ggml tensor types -> (name, block size, bytes per block)
+GGML_TYPES = {
+    0: ("F32", 1, 4),
+    1: ("F16", 1, 2),
+    2: ("Q4_0", 32, 18),
+    3: ("Q4_1", 32, 20),
+    6: ("Q5_0", 32, 22),
+    7: ("Q5_1", 32, 24),
+    8: ("Q8_0", 32, 34),
+    9: ("Q8_1", 32, 36),
+    10: ("Q2_K", 256, 84),
+    11: ("Q3_K", 256, 110),
+    12: ("Q4_K", 256, 144),
+    13: ("Q5_K", 256, 176),
+    14: ("Q6_K", 256, 210),
+    15: ("Q8_K", 256, 292),
+    16: ("IQ2_XXS", 256, 66),
+    17: ("IQ2_XS", 256, 74),
+    18: ("IQ3_XXS", 256, 98),
+    19: ("IQ1_S", 256, 50),
+    20: ("IQ4_NL", 32, 18),
+    21: ("IQ3_S", 256, 110),
+    22: ("IQ2_S", 256, 82),
+    23: ("IQ4_XS", 256, 136),
+    24: ("I8", 1, 1),
+    25: ("I16", 1, 2),
+    26: ("I32", 1, 4),
+    27: ("I64", 1, 8),
+    28: ("F64", 1, 8),
+    29: ("IQ1_M", 256, 56),
+    30: ("BF16", 1, 2),
+    34: ("TQ1_0", 256, 54),
+    35: ("TQ2_0", 256, 66),
+    39: ("MXFP4", 32, 17),
+}
+
+# Placeholder for arrays that were skipped over; offset is where the items start in the file
+GGUFArray = namedtuple("GGUFArray", ["item_type", "count", "offset"], defaults=(None,))
+GGUFTensor = namedtuple("GGUFTensor", ["name", "shape", "dtype", "offset", "n_bytes"])
+
+
+class GGUFInfo:
+    def __init__(self, path, version, metadata, tensors, data_offset):
+        self.path = path
+        self.version = version
+        self.metadata = metadata
+        self.tensors = tensors
+        self.data_offset = data_offset
+
+    def get(self, key, default=None):
+        return self.metadata.get(key, default)
+
+    @property
+    def architecture(self):
+        return self.metadata.get("general.architecture")
+
+    def get_arch_value(self, suffix, default=None):
+        """Look up '<arch>.<suffix>', falling back to any key ending with it"""
+        arch = self.architecture
+        if arch and f"{arch}.{suffix}" in self.metadata:
+            return self.metadata[f"{arch}.{suffix}"]
+        for k, v in self.metadata.items():
+            if k.lower().endswith(f".{suffix}"):
+                return v
+        return default
+
+    def read_array(self, array):
+        """Materialize a skipped scalar GGUFArray from the file (e.g. per-layer head counts)"""
+        if array.item_type not in SCALAR_TYPES or array.offset is None:
+            raise ValueError(f"Cannot read skipped array of type {array.item_type}")
+        fmt, size = SCALAR_TYPES[array.item_type]
+        with open(self.path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return list(struct.unpack_from(f"<{array.count}{fmt[1:]}", buf, array.offset))
+
+    @property
+    def block_count(self):
+        return self.get_arch_value("block_count")
+
+    @property
+    def tensor_bytes(self):
+        return sum(t.n_bytes for t in self.tensors)
+
+
+class _Reader:
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+        self.len_fmt = "<Q"
+        self.len_size = 8
+
+    def unpack(self, fmt, size):
+        value = struct.unpack_from(fmt, self.buf, self.pos)[0]
+        self.pos += size
+        return value
+
+    def u32(self):
+        return self.unpack("<I", 4)
+
+    def u64(self):
+        return self.unpack("<Q", 8)
+
+    def length(self):
+        return self.unpack(self.len_fmt, self.len_size)
+
+    def string(self):
+        n = self.length()
+        value = bytes(self.buf[self.pos:self.pos + n]).decode("utf-8", errors="replace")
+        self.pos += n
+        return value
+
+    def skip_string(self):
+        n = self.length()
+        self.pos += n
+
+    def value(self, vtype):
+        if vtype in SCALAR_TYPES:
+            return self.unpack(*SCALAR_TYPES[vtype])
+        if vtype == TYPE_STRING:
+            return self.string()
+        if vtype == TYPE_ARRAY:
+            atype = self.u32()
+            count = self.length()
+            if count > MAX_ARRAY_ITEMS:
+                offset = self.pos
+                self.skip_array(atype, count)
+                return GGUFArray(atype, count, offset)
+            return [self.value(atype) for _ in range(count)]
+        raise ValueError(f"Unknown value type {vtype}")
+
+    def skip_array(self, atype, count):
+        if atype in SCALAR_TYPES:
+            self.pos += SCALAR_TYPES[atype][1] * count
+        elif atype == TYPE_STRING:
+            # every string carries its own length, so only the lengths are read
+            for _ in range(count):
+                self.skip_string()
+        elif atype == TYPE_ARRAY:
+            for _ in range(count):
+                sub_type = self.u32()
+                self.skip_array(sub_type, self.length())
+        else:
+            raise ValueError(f"Unknown array item type {atype}")
+
+
+def _parse(path, buf):
+    r = _Reader(buf)
+    if bytes(buf[:4]) != b"GGUF":
+        raise ValueError("This is not a GGUF file!")
+    r.pos = 4
+    version = r.u32()
+    if version == 1:
+        r.len_fmt, r.len_size = "<I", 4
+
+    tensor_count = r.length()
+    kv_count = r.length()
+
+    metadata = {}
+    for _ in range(kv_count):
+        key = r.string()
+        metadata[key] = r.value(r.u32())
+
+    tensors = []
+    for _ in range(tensor_count):
+        name = r.string()
+        n_dims = r.u32()
+        shape = tuple(r.length() for _ in range(n_dims))
+        ggml_type = r.u32()
+        offset = r.u64()
+        tensors.append([name, shape, ggml_type, offset])
+
+    alignment = metadata.get("general.alignment", 32) or 32
+    data_offset = (r.pos + alignment - 1) // alignment * alignment
+    data_size = len(buf) - data_offset
+
+    # 按 offset 排序，用相邻 offset 之差兜底未知类型的大小
+    order = sorted(range(len(tensors)), key=lambda i: tensors[i][3])
+    next_offset = {}
+    for a, b in zip(order, order[1:] + [None]):
+        next_offset[a] = tensors[b][3] if b is not None else data_size
+
+    result = []
+    for i, (name, shape, ggml_type, offset) in enumerate(tensors):
+        n_elements = 1
+        for d in shape:
+            n_elements *= d
+        if ggml_type in GGML_TYPES:
+            type_name, block_size, type_size = GGML_TYPES[ggml_type]
+            n_bytes = n_elements // block_size * type_size
+        else:
+            type_name = f"type_{ggml_type}"
+            n_bytes = max(0, next_offset[i] - offset)
+        result.append(GGUFTensor(name, shape, type_name, offset, n_bytes))
+
+    return GGUFInfo(path, version, metadata, result, data_offset)
+
+
+_INFO_CACHE = OrderedDict()
+_INFO_CACHE_SIZE = 16
+_INFO_LOCK = threading.Lock()
+
+
+def read_gguf_info(path):
+    """Parse GGUF header and tensor infos via mmap; memoized per (path, size, mtime)"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _INFO_LOCK:
+        if key in _INFO_CACHE:
+            _INFO_CACHE.move_to_end(key)
+            return _INFO_CACHE[key]
+
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            info = _parse(path, buf)
+
+    with _INFO_LOCK:
+        _INFO_CACHE[key] = info
+        while len(_INFO_CACHE) > _INFO_CACHE_SIZE:
+            _INFO_CACHE.popitem(last=False)
+    return info
 
-def read_u32(f):
-    return struct.unpack("<I", f.read(4))[0]
-
-
-def read_u64(f):
-    return struct.unpack("<Q", f.read(8))[0]
-
-
-def read_string(f):
-    ln = read_u64(f)
-    return f.read(ln).decode("utf-8")
-
-
-def read_value(f):
-    vtype = read_u32(f)
-
-    # GGUF value types
-    if vtype == 0:   # uint8
-        return struct.unpack("<B", f.read(1))[0]
-    if vtype == 1:   # int8
-        return struct.unpack("<b", f.read(1))[0]
-    if vtype == 2:   # uint16
-        return struct.unpack("<H", f.read(2))[0]
-    if vtype == 3:   # int16
-        return struct.unpack("<h", f.read(2))[0]
-    if vtype == 4:   # uint32
-        return struct.unpack("<I", f.read(4))[0]
-    if vtype == 5:   # int32
-        return struct.unpack("<i", f.read(4))[0]
-    if vtype == 6:   # float32
-        return struct.unpack("<f", f.read(4))[0]
-    if vtype == 7:   # bool
-        return struct.unpack("<?", f.read(1))[0]
-    if vtype == 8:   # string
-        return read_string(f)
-    if vtype == 9:   # array
-        atype = read_u32(f)
-        count = read_u64(f)
-        return [read_value_of_type(f, atype) for _ in range(count)]
-    if vtype == 10:  # uint64
-        return struct.unpack("<Q", f.read(8))[0]
-    if vtype == 11:  # int64
-        return struct.unpack("<q", f.read(8))[0]
-    if vtype == 12:  # float64
-        return struct.unpack("<d", f.read(8))[0]
-
-    raise ValueError(f"Unknown value type {vtype}")
-
-
-def read_value_of_type(f, atype):
-    # same mapping as above but without extra type code
-    if atype == 0:
-        return struct.unpack("<B", f.read(1))[0]
-    if atype == 1:
-        return struct.unpack("<b", f.read(1))[0]
-    if atype == 2:
-        return struct.unpack("<H", f.read(2))[0]
-    if atype == 3:
-        return struct.unpack("<h", f.read(2))[0]
-    if atype == 4:
-        return struct.unpack("<I", f.read(4))[0]
-    if atype == 5:
-        return struct.unpack("<i", f.read(4))[0]
-    if atype == 6:
-        return struct.unpack("<f", f.read(4))[0]
-    if atype == 7:
-        return struct.unpack("<?", f.read(1))[0]
-    if atype == 8:
-        return read_string(f)
-    if atype == 10:
-        return struct.unpack("<Q", f.read(8))[0]
-    if atype == 11:
-        return struct.unpack("<q", f.read(8))[0]
-    if atype == 12:
-        return struct.unpack("<d", f.read(8))[0]
-
-    raise ValueError(f"Unknown array item type {atype}")
 
 def get_layer_count(path):
     try:
-        with open(path, "rb") as f:
-            if f.read(4) != b"GGUF":
-                raise ValueError("This is not a GGUF file!")
-
-            version = read_u32(f)
-            tensor_count = read_u64(f)
-            kv_count = read_u64(f)
-            meta = {}
-
-            for _ in range(kv_count):
-                key = read_string(f)
-                value = read_value(f)
-                meta[key] = value
-
-        for k, v in meta.items():
-            if k.lower().endswith(".block_count"):
-                return v
+        layer_count = read_gguf_info(path).block_count
+        if layer_count:
+            return int(layer_count)
     except Exception as e:
         print(f"Failed to read raw metadata: {e}")
 
@@ -118,4 +272,4 @@ def get_layer_count(path):
     except Exception as e:
         print(f"Failed to get block_count: {e}")
 
-    return None
\ No newline at end of file
+    return None
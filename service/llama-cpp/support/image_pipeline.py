@@ -0,0 +1,109 @@
+import base64
+import io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+# 每次在设备上转换的帧数（限制显存/内存峰值）
+CHUNK_SIZE = 16
+# JPEG 编码线程数（PIL 编码时释放 GIL）
+ENCODE_WORKERS = 4
+
+_EXECUTOR = None
+
+
+def _executor():
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="cj_jpeg")
+    return _EXECUTOR
+
+
+def as_batch(images):
+    """IMAGE batch (BHWC), a single frame (HWC) or a list of frames -> BHWC float tensor"""
+    if isinstance(images, (list, tuple)):
+        return torch.stack([img[0] if img.ndim == 4 else img for img in images])
+    if images.ndim == 3:
+        return images.unsqueeze(0)
+    return images
+
+
+def scaled_size(h, w, max_size):
+    """Target (h, w) with the long side capped at max_size, never upscaling"""
+    if not max_size:
+        return h, w
+    scale = min(max_size / max(w, h), 1.0)
+    if scale >= 1.0:
+        return h, w
+    return max(1, int(h * scale)), max(1, int(w * scale))
+
+
+def to_uint8_batch(images, max_size=None):
+    """Resize (anti-aliased bicubic) and convert a BHWC float batch to uint8 on its own device"""
+    h, w = images.shape[1:3]
+    new_h, new_w = scaled_size(h, w, max_size)
+    if (new_h, new_w) != (h, w):
+        x = images.movedim(-1, 1).float()
+        x = F.interpolate(x, size=(new_h, new_w), mode="bicubic", antialias=True, align_corners=False)
+        images = x.movedim(1, -1)
+    return (images * 255.0).clamp(0, 255).to(torch.uint8)
+
+
+def encode_jpeg(img_np, quality=85):
+    """uint8 HWC numpy array -> base64 JPEG string"""
+    if img_np.ndim == 3 and img_np.shape[2] == 1:
+        img_np = np.repeat(img_np, 3, axis=2)
+    elif img_np.ndim == 3 and img_np.shape[2] == 4:
+        img_np = img_np[..., :3]
+    buffered = io.BytesIO()
+    Image.fromarray(img_np).save(buffered, format="JPEG", quality=quality)
+    return base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+
+class JpegFrames:
+    """
+    Iterate an IMAGE batch as base64 JPEG strings, in order.
+
+    Frames are converted to uint8 and resized CHUNK_SIZE at a time on the tensor's device,
+    then JPEG-encoded on a thread pool up to `prefetch` frames ahead of the consumer,
+    so encoding the next frames overlaps with inference on the current one.
+    """
+
+    def __init__(self, images, max_size=None, quality=85, prefetch=4):
+        self.images = as_batch(images)
+        self.max_size = max_size
+        self.quality = quality
+        self.prefetch = max(1, prefetch)
+
+    def __len__(self):
+        return self.images.shape[0]
+
+    def _arrays(self):
+        for start in range(0, len(self), CHUNK_SIZE):
+            chunk = to_uint8_batch(self.images[start:start + CHUNK_SIZE], self.max_size).cpu().numpy()
+            for img_np in chunk:
+                yield img_np
+
+    def __iter__(self):
+        executor = _executor()
+        pending = deque()
+        arrays = self._arrays()
+        try:
+            for img_np in arrays:
+                pending.append(executor.submit(encode_jpeg, img_np, self.quality))
+                if len(pending) > self.prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def encode_frames(images, max_size=None, quality=85):
+    """Encode a whole IMAGE batch to base64 JPEG strings (parallel encode, ordered result)"""
+    return list(JpegFrames(images, max_size, quality, prefetch=ENCODE_WORKERS * 2))
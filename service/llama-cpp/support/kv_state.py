@@ -0,0 +1,55 @@
+class PrefixStateCache:
+    """Evaluate a shared prompt prefix once and restore it from a llama state snapshot.
+
+    While active, the first Llama.eval() after each Llama.reset() is checked against the
+    cached prefix tokens; on a match the saved state is loaded and only the remaining
+    tokens are evaluated. The first evaluated chunk of at least min_tokens becomes the
+    prefix. Chat handlers that evaluate text chunks through Llama.eval (system prompt and
+    preset text before the first image) therefore skip re-evaluating it on every frame.
+    """
+
+    def __init__(self, llm, min_tokens=16):
+        self.llm = llm
+        self.min_tokens = min_tokens
+        self.prefix = None
+        self.state = None
+        self.hits = 0
+        self.saved_tokens = 0
+        self._fresh = False
+
+    def __enter__(self):
+        self._reset = self.llm.reset
+        self._eval = self.llm.eval
+        self.llm.reset = self._patched_reset
+        self.llm.eval = self._patched_eval
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.llm.__dict__.pop("reset", None)
+        self.llm.__dict__.pop("eval", None)
+        self.prefix = None
+        self.state = None
+
+    def _patched_reset(self):
+        self._fresh = True
+        self._reset()
+
+    def _patched_eval(self, tokens):
+        if not self._fresh:
+            return self._eval(tokens)
+        self._fresh = False
+
+        tokens = list(tokens)
+        if self.state is not None and tokens[:len(self.prefix)] == self.prefix:
+            self.llm.load_state(self.state)
+            self.hits += 1
+            self.saved_tokens += len(self.prefix)
+            rest = tokens[len(self.prefix):]
+            if rest:
+                self._eval(rest)
+            return
+
+        self._eval(tokens)
+        if self.state is None and len(tokens) >= self.min_tokens:
+            self.prefix = tokens
+            self.state = self.llm.save_state()
@@ -0,0 +1,313 @@
+import gc
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import comfy.model_management as mm
+
+from gguf_layers import get_layer_count
+from vram_planner import plan_gpu_layers
+
+try:
+    from llama_cpp.llama_chat_format import MTMDChatHandler
+    _MTMD = True
+except ImportError:
+    _MTMD = False
+
+# 这些处理器用 enable_thinking 切换思考模式
+THINKING_HANDLERS = ["MiniCPM-v4.5", "MiniCPM-v4.6", "GLM-4.6V", "Qwen3.5", "Qwen3.6", "Gemma4", "LFM2.5-VL"]
+
+
+def llama_spec(model_path, mmproj_path=None, chat_handler=None, handler_kwargs=None,
+               n_ctx=8192, n_gpu_layers=-1, draft=None, ctx_type=0):
+    """Everything that determines a loaded Llama instance; identical specs share one model"""
+    return {
+        "model_path": os.path.normcase(os.path.abspath(model_path)),
+        "mmproj_path": os.path.normcase(os.path.abspath(mmproj_path)) if mmproj_path else None,
+        "chat_handler": chat_handler if chat_handler not in (None, "None") else None,
+        "handler_kwargs": handler_kwargs or {},
+        "n_ctx": n_ctx,
+        "n_gpu_layers": n_gpu_layers,
+        "draft": draft,
+        "ctx_type": ctx_type,
+    }
+
+
+def pool_spec(model_path, mmproj_path=None, chat_handler=None, n_ctx=8192, vram_limit=-1,
+              image_max_tokens=0, image_min_tokens=0, draft=None, ctx_type=0):
+    """
+    Model files and loader settings -> (pool spec, estimated size in bytes).
+    The llama-cpp nodes and aitools both resolve models here, so the same model with the
+    same settings maps to the same pool key and is budgeted the same way.
+    """
+    n_gpu_layers = -1
+    # 按 GGUF 张量表规划显存：每层权重 + KV cache + 输出层 + mmproj
+    size_bytes = sum(os.path.getsize(p) for p in (model_path, mmproj_path) if p and os.path.exists(p))
+    try:
+        plan = plan_gpu_layers(model_path, n_ctx, vram_limit, mmproj_path)
+        size_bytes = plan.total_bytes
+        if vram_limit != -1:
+            n_gpu_layers = plan.n_gpu_layers
+            print(f"[llama-cpp_vlm] VRAM plan: {plan.summary()}")
+    except Exception as e:
+        print(f"[llama-cpp_vlm] VRAM planning failed, using file size estimate: {e}")
+        if vram_limit != -1:
+            gguf_layers = get_layer_count(model_path) or 32
+            gguf_layer_size = os.path.getsize(model_path) * 1.55 / (1024 ** 3) / gguf_layers
+            mmproj_size = os.path.getsize(mmproj_path) * 1.55 / (1024 ** 3) if mmproj_path else 0
+            n_gpu_layers = max(1, int((vram_limit - mmproj_size) / gguf_layer_size))
+
+    handler_kwargs = {}
+    if mmproj_path:
+        if chat_handler in (None, "None"):
+            raise ValueError('"chat_handler" cannot be None!')
+
+        think_mode = "Thinking" in chat_handler
+        if chat_handler in ["Qwen3-VL", "Qwen3-VL-Thinking"]:
+            handler_kwargs["force_reasoning"] = think_mode
+            handler_kwargs["image_max_tokens"] = image_max_tokens
+            handler_kwargs["image_min_tokens"] = image_min_tokens
+        elif chat_handler in THINKING_HANDLERS:
+            handler_kwargs["enable_thinking"] = think_mode
+
+        if _MTMD:
+            handler_kwargs["image_max_tokens"] = image_max_tokens
+            handler_kwargs["image_min_tokens"] = image_min_tokens
+
+    spec = llama_spec(model_path, mmproj_path, chat_handler, handler_kwargs,
+                      n_ctx=n_ctx, n_gpu_layers=n_gpu_layers, draft=draft, ctx_type=ctx_type)
+    return spec, size_bytes
+
+
+def close_chat_handler(chat_handler):
+    """Free a chat handler's projector (clip / mtmd context) without touching its Llama"""
+    if chat_handler is None:
+        return
+    try:
+        chat_handler._exit_stack.close()
+        return
+    except Exception:
+        pass
+    # 未使用 ExitStack 的 MTMD 处理器：提前释放 mtmd 上下文，Llama 关闭时的回调会跳过已释放的上下文
+    try:
+        if getattr(chat_handler, "mtmd_ctx", None) is not None:
+            chat_handler._mtmd_cpp.mtmd_free(chat_handler.mtmd_ctx)
+            chat_handler.mtmd_ctx = None
+    except Exception:
+        pass
+
+
+class PoolEntry:
+    def __init__(self, key, config, llm, chat_handler, size_bytes=0):
+        self.key = key
+        self.config = config
+        self.llm = llm
+        self.chat_handler = chat_handler
+        self.size_bytes = size_bytes
+        self.refs = 0
+
+    def close(self):
+        try:
+            self.llm.close()
+        except Exception:
+            pass
+
+        try:
+            self.chat_handler._exit_stack.close()
+        except Exception:
+            pass
+
+        self.llm = None
+        self.chat_handler = None
+
+
+class LlamaModelPool:
+    """Process-wide LRU pool of loaded llama.cpp models, bounded by model count and a memory budget.
+
+    Shared by the llama-cpp nodes and the aitools nodes: both acquire models by spec, so
+    the same GGUF with the same settings is loaded once. Entries with references are
+    pinned and never evicted to make room.
+
+    preload() loads a model on a background thread (one at a time). Only the bookkeeping
+    (pending future, reserved room) happens under the pool lock; the load itself does not
+    block other pool operations. Callers wait(key) before acquire(key) so a key that is
+    still loading is not loaded a second time.
+    """
+
+    def __init__(self, max_models=2, budget_gb=-1):
+        self.entries = OrderedDict()
+        self.max_models = max_models
+        self.budget_gb = budget_gb
+        self.lock = threading.RLock()
+        self.loading = {}  # key -> Future of a background load
+        self.reserved = {}  # key -> size_bytes reserved for a background load
+        self._executor = None
+
+    def configure(self, max_models=None, budget_gb=None):
+        if max_models is not None:
+            self.max_models = max(1, int(max_models))
+        if budget_gb is not None:
+            self.budget_gb = budget_gb
+
+    @staticmethod
+    def make_key(config):
+        return json.dumps(config, sort_keys=True, default=str)
+
+    def budget_bytes(self):
+        """Memory budget in bytes (-1 = 80% of the torch device's total memory)"""
+        if self.budget_gb is not None and self.budget_gb >= 0:
+            return int(self.budget_gb * (1024 ** 3))
+        try:
+            return int(mm.get_total_memory(mm.get_torch_device()) * 0.8)
+        except Exception:
+            return -1
+
+    def used_bytes(self):
+        return sum(entry.size_bytes for entry in self.entries.values()) + sum(self.reserved.values())
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def make_room(self, size_bytes):
+        """Evict least recently used unreferenced models until a model of size_bytes fits"""
+        with self.lock:
+            budget = self.budget_bytes()
+            while self.entries:
+                over_count = len(self.entries) + len(self.reserved) >= self.max_models
+                over_budget = budget >= 0 and self.used_bytes() + size_bytes > budget
+                if not (over_count or over_budget):
+                    break
+                key = next((k for k, e in self.entries.items() if e.refs == 0), None)
+                if key is None:
+                    print("[llama-cpp_vlm] All pooled models are in use, loading over the pool limit")
+                    break
+                self.evict(key)
+
+    def preload(self, key, loader, size_bytes=0):
+        """Start loading key in the background; returns a Future of the (unreferenced) entry"""
+        with self.lock:
+            future = self.loading.get(key)
+            if future is not None:
+                return future
+            entry = self.get(key)
+            if entry is not None and entry.llm is not None:
+                future = Future()
+                future.set_result(entry)
+                return future
+            if self._executor is None:
+                # 单线程：后台加载依次进行，不会同时占用显存
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cj_llama_load")
+            # 锁内只腾出空间并登记预留，加载本身在锁外进行
+            self.make_room(size_bytes)
+            self.reserved[key] = size_bytes
+            future = self._executor.submit(self._load_in_background, key, loader)
+            self.loading[key] = future
+            return future
+
+    def _load_in_background(self, key, loader):
+        try:
+            entry = loader()
+            with self.lock:
+                existing = self.entries.get(key)
+                if existing is not None and existing.llm is not None:
+                    # 等待期间已被同步加载（如 clean 后重新加载），丢弃这份
+                    discard, entry = entry, existing
+                else:
+                    discard = None
+                    self.add(entry)
+            if discard is not None:
+                discard.close()
+            return entry
+        finally:
+            with self.lock:
+                self.loading.pop(key, None)
+                self.reserved.pop(key, None)
+
+    def wait(self, key):
+        """Block until a background load of key finishes. Must not be called while holding self.lock"""
+        with self.lock:
+            future = self.loading.get(key)
+        if future is None:
+            return
+        try:
+            future.result()
+        except Exception as e:
+            # 交给 acquire 重新同步加载，错误会在那里正常抛出
+            print(f"[llama-cpp_vlm] Background model load failed: {e}")
+
+    def acquire(self, key, loader, size_bytes=0):
+        """
+        Return the entry for key with one more reference, calling loader() to create it if needed.
+        Call wait(key) first (without holding the lock) when a background load may be pending.
+        """
+        with self.lock:
+            entry = self.get(key)
+            if entry is None or entry.llm is None:
+                self.make_room(size_bytes)
+                entry = loader()
+                self.add(entry)
+            entry.refs += 1
+            return entry
+
+    def release(self, entry):
+        with self.lock:
+            if entry is not None and entry.refs > 0:
+                entry.refs -= 1
+
+    def add(self, entry):
+        with self.lock:
+            self.entries[entry.key] = entry
+            self.entries.move_to_end(entry.key)
+
+    def find(self, predicate):
+        """Least recently used unreferenced entry for which predicate(entry) is true, or None"""
+        with self.lock:
+            for entry in self.entries.values():
+                if entry.refs == 0 and entry.llm is not None and predicate(entry):
+                    return entry
+            return None
+
+    def rekey(self, entry, key, config, size_bytes=None):
+        """Store an entry that was rebuilt in place under its new spec"""
+        with self.lock:
+            self.entries.pop(entry.key, None)
+            entry.key = key
+            entry.config = config
+            if size_bytes is not None:
+                entry.size_bytes = size_bytes
+            self.add(entry)
+
+    def evict(self, key, force=False):
+        """Unload key unless another user still holds it (force=True unloads anyway)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.refs > 0 and not force:
+                return False
+            self.entries.pop(key, None)
+        if entry is not None:
+            entry.close()
+            gc.collect()
+            mm.soft_empty_cache()
+        return entry is not None
+
+    def clear(self):
+        """
+        Unload every entry, including ones still referenced. Closing sets entry.llm to None,
+        so holders detect it (entry.llm is None) and acquire the model again.
+        """
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries.clear()
+        for entry in entries:
+            entry.close()
+        gc.collect()
+        mm.soft_empty_cache()
+
+
+LLAMA_POOL = LlamaModelPool()
@@ -0,0 +1,106 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+# 与 scipy.ndimage.gaussian_filter 默认的 truncate=4.0 一致
+TRUNCATE = 4.0
+
+
+def gaussian_kernel1d(sigma, device=None, dtype=torch.float32):
+    radius = max(1, int(math.ceil(TRUNCATE * sigma)))
+    x = torch.arange(-radius, radius + 1, device=device, dtype=dtype)
+    kernel = torch.exp(-0.5 * (x / sigma) ** 2)
+    return kernel / kernel.sum()
+
+
+def reflect_indices(lengths, size, radius):
+    """
+    (N, size + 2 * radius) source indices that pad each row of length lengths[i] by radius on
+    both sides, mirrored about the edges like scipy's mode='reflect' (d c b a | a b c d | d c b a).
+    """
+    lengths = lengths.clamp(min=1)[:, None]
+    pos = torch.arange(-radius, size + radius, device=lengths.device)[None, :] % (2 * lengths)
+    return torch.where(pos < lengths, pos, 2 * lengths - 1 - pos)
+
+
+def blur1d(x, sigma, dim):
+    """Gaussian blur of a (..., L) float tensor along `dim` (edges reflected as in scipy)"""
+    if sigma <= 0:
+        return x
+    x = x.movedim(dim, -1)
+    shape = x.shape
+    flat = x.reshape(-1, 1, shape[-1])
+    kernel = gaussian_kernel1d(sigma, flat.device, flat.dtype)
+    radius = kernel.numel() // 2
+    index = reflect_indices(torch.tensor([shape[-1]], device=flat.device), shape[-1], radius)[0]
+    flat = flat.index_select(-1, index)
+    flat = F.conv1d(flat, kernel.view(1, 1, -1))
+    return flat.reshape(shape).movedim(-1, dim)
+
+
+def gaussian_blur(masks, sigma):
+    """Separable Gaussian blur of a (B, H, W) mask batch on its own device"""
+    if sigma <= 0:
+        return masks
+    return blur1d(blur1d(masks, sigma, -1), sigma, -2)
+
+
+def box_tensor(bboxes, dilation=0, device=None):
+    """
+    Valid [x1, y1, x2, y2] items -> ((N, 4) int64 tensor expanded by dilation, valid items).
+    Invalid items are skipped with a warning.
+    """
+    rows, items = [], []
+    for bbox in bboxes:
+        if not isinstance(bbox, (list, tuple)) or len(bbox) < 4:
+            print(f"Warning: Skipping invalid bbox item: {bbox}")
+            continue
+        x1, y1, x2, y2 = map(int, bbox[:4])
+        rows.append((x1 - dilation, y1 - dilation, x2 + dilation, y2 + dilation))
+        items.append(bbox)
+    if not rows:
+        return torch.zeros((0, 4), dtype=torch.int64, device=device), items
+    return torch.tensor(rows, dtype=torch.int64, device=device), items
+
+
+def is_per_frame(bboxes):
+    """True for one list of boxes per frame, False for a single list shared by all frames"""
+    return bool(bboxes) and all(
+        isinstance(b, list) and (not b or isinstance(b[0], (list, tuple))) for b in bboxes
+    )
+
+
+def rasterize_boxes(boxes, height, width, device=None):
+    """
+    Union of axis-aligned rectangles as one (H, W) float mask, all boxes at once.
+    Row and column coverage are built per box and combined with a single (H, N) @ (N, W)
+    product, so memory stays O(N * (H + W)) instead of one full frame per box.
+    """
+    if boxes.numel() == 0:
+        return torch.zeros((height, width), dtype=torch.float32, device=device)
+    boxes = boxes.to(device)
+    ys = torch.arange(height, device=device)
+    xs = torch.arange(width, device=device)
+    rows = ((ys[None, :] >= boxes[:, 1:2]) & (ys[None, :] < boxes[:, 3:4])).float()
+    cols = ((xs[None, :] >= boxes[:, 0:1]) & (xs[None, :] < boxes[:, 2:3])).float()
+    return (rows.t() @ cols).clamp_(max=1.0)
+
+
+def box_profiles(starts, ends, lengths, sigma, device=None):
+    """
+    Blurred 1D indicator profiles, one per box, padded to the longest crop.
+    Profile i is 1 on [starts[i], ends[i]) of a crop of lengths[i] pixels and is blurred within
+    that crop, edges reflected as scipy's gaussian_filter does for a local mask. A blurred
+    rectangle is the outer product of its blurred row and column profiles.
+    """
+    lengths = lengths.to(device)
+    length = max(int(lengths.max()), 1) if lengths.numel() else 1
+    pos = torch.arange(length, device=device)
+    profiles = ((pos[None, :] >= starts[:, None].to(device)) & (pos[None, :] < ends[:, None].to(device))).float()
+    if sigma > 0:
+        kernel = gaussian_kernel1d(sigma, device)
+        radius = kernel.numel() // 2
+        padded = profiles.gather(1, reflect_indices(lengths, length, radius))
+        profiles = F.conv1d(padded[:, None, :], kernel.view(1, 1, -1))[:, 0, :]
+    return profiles
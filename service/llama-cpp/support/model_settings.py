@@ -0,0 +1,14 @@
+import json
+import os
+
+# aitools/model_config.json 保存所有 LLM 节点共享的配置
+AITOOLS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "aitools")
+MODEL_CONFIG_PATH = os.path.join(AITOOLS_DIR, "model_config.json")
+
+
+def load_model_config():
+    try:
+        with open(MODEL_CONFIG_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
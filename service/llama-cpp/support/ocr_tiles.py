@@ -0,0 +1,96 @@
+import math
+import re
+from difflib import SequenceMatcher
+
+import numpy as np
+
+# 去重时比较的首尾行数
+MERGE_WINDOW = 8
+# 两行文字相似度达到此值视为同一行（同一行在不同切片中的识别结果可能有个别字符差异）
+LINE_SIMILARITY = 0.95
+# 匹配上的重叠文字至少这么多字符才去重，避免短行（页码、符号）误判
+MIN_MATCH_CHARS = 6
+
+
+def _spans(total, size, overlap):
+    """Evenly spaced [(start, end), ...] of length size covering range(total), neighbours sharing >= overlap"""
+    if total <= size:
+        return [(0, total)]
+    count = math.ceil((total - overlap) / (size - overlap))
+    step = (total - size) / (count - 1)
+    return [(round(i * step), round(i * step) + size) for i in range(count)]
+
+
+def column_spans(width, tile_size, ink=None):
+    """
+    Columns [(x0, x1), ...] of at most tile_size pixels, without overlap.
+    With ink (amount of non-background per pixel column), each cut moves to the emptiest
+    column in the last quarter of the span, so it falls in a gutter rather than through text.
+    """
+    spans = []
+    x0 = 0
+    while width - x0 > tile_size:
+        lo, hi = x0 + tile_size * 3 // 4, x0 + tile_size
+        cut = hi if ink is None else lo + int(np.argmin(ink[lo:hi]))
+        spans.append((x0, cut))
+        x0 = cut
+    spans.append((x0, width))
+    return spans
+
+
+def tile_layout(height, width, tile_size, overlap, ink=None):
+    """
+    Tiles [(x0, x1, [(y0, y1), ...]), ...] covering the page, each at most tile_size * tile_size
+    pixels at the page's own resolution, so the handler does not need to downscale them.
+    Pages narrow enough are cut into full-width bands, which keeps the reading order of lines;
+    wider pages are first split into columns (read left to right, each top to bottom) and each
+    column into tile_size bands. Bands overlap vertically by overlap rows.
+    """
+    # 重叠不能超过半个切片，否则相邻切片几乎完全重复
+    overlap = max(0, min(overlap, (tile_size - 32) // 2))
+    band = tile_size * tile_size // max(width, 1)
+    if band >= 2 * overlap + 32:
+        return [(0, width, _spans(height, band, overlap))]
+    return [(x0, x1, _spans(height, tile_size, overlap)) for x0, x1 in column_spans(width, tile_size, ink)]
+
+
+def _normalize(line):
+    return re.sub(r"\s+", " ", line).strip()
+
+
+def _similar(a, b):
+    if a == b:
+        return True
+    return SequenceMatcher(None, a, b, autojunk=False).ratio() >= LINE_SIMILARITY
+
+
+def merge_overlap(prev_lines, next_lines, window=MERGE_WINDOW):
+    """
+    Join the lines of two vertically overlapping bands, dropping the text read twice.
+    The longest run of matching lines between the tail of prev and the head of next is
+    kept once, from next: lines cut by prev's bottom edge are replaced by next's full read.
+    """
+    tail = [_normalize(line) for line in prev_lines[-window:]]
+    head = [_normalize(line) for line in next_lines[:window]]
+    best = None
+    for i in range(len(tail)):
+        for j in range(len(head)):
+            k = 0
+            while i + k < len(tail) and j + k < len(head) and tail[i + k] and _similar(tail[i + k], head[j + k]):
+                k += 1
+            chars = sum(len(line) for line in head[j:j + k])
+            if k and chars >= MIN_MATCH_CHARS and (best is None or k > best[0]):
+                best = (k, i, j)
+    if best is None:
+        return prev_lines + next_lines
+    _k, i, j = best
+    return prev_lines[:len(prev_lines) - len(tail) + i] + next_lines[j:]
+
+
+def merge_tile_texts(texts):
+    """OCR text of consecutive bands (top to bottom) -> page text without the overlap duplicates"""
+    lines = []
+    for text in texts:
+        band_lines = [line for line in text.splitlines() if line.strip()]
+        lines = merge_overlap(lines, band_lines) if lines else band_lines
+    return "\n".join(lines)
@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+
+from model_settings import AITOOLS_DIR
+
+# 两次目录检查之间的最小间隔（秒）：同一次 object_info 请求里的多个节点只扫描一次
+POLL_INTERVAL = 2.0
+
+
+class PresetIndex:
+    """
+    In-memory index of the prompt files under aitools/T and aitools/V.
+
+    refresh() polls the directories at most once per POLL_INTERVAL and only re-reads files
+    whose (mtime, size) changed; removed files are dropped. `version` is bumped on every
+    change so consumers can rebuild their derived views only when something moved.
+    """
+
+    def __init__(self, root=AITOOLS_DIR, subdirs=("T", "V"), poll_interval=POLL_INTERVAL):
+        self.root = root
+        self.subdirs = subdirs
+        self.poll_interval = poll_interval
+        self.entries = {sub: {} for sub in subdirs}  # sub -> {filename: (mtime_ns, size, content)}
+        self.version = 0
+        self.lock = threading.Lock()
+        self._last_poll = None
+
+    def _scan(self, sub):
+        path = os.path.join(self.root, sub)
+        old = self.entries[sub]
+        new = {}
+        changed = False
+        try:
+            items = sorted(os.scandir(path), key=lambda e: e.name)
+        except OSError:
+            items = []
+        for item in items:
+            try:
+                if not item.is_file():
+                    continue
+                st = item.stat()
+            except OSError:
+                continue
+            cached = old.get(item.name)
+            if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+                new[item.name] = cached
+                continue
+            try:
+                with open(item.path, "r", encoding="utf-8", errors="ignore") as f:
+                    new[item.name] = (st.st_mtime_ns, st.st_size, f.read())
+                changed = True
+            except OSError as e:
+                print(f"[llama-cpp_vlm] Failed to read preset {item.path}: {e}")
+        if changed or new.keys() != old.keys():
+            self.entries[sub] = new
+            return True
+        return False
+
+    def refresh(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if not force and self._last_poll is not None and now - self._last_poll < self.poll_interval:
+                return False
+            self._last_poll = now
+            changed = False
+            for sub in self.subdirs:
+                changed = self._scan(sub) or changed
+            if changed:
+                self.version += 1
+            return changed
+
+    def files(self, sub):
+        """{filename: content} of one directory, sorted by filename"""
+        self.refresh()
+        with self.lock:
+            return {name: entry[2] for name, entry in self.entries[sub].items()}
+
+
+PRESET_INDEX = PresetIndex()
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import folder_paths
+
+from model_settings import load_model_config
+
+
+def _feed(h, obj):
+    """Feed obj into hash h; tensors and arrays are hashed by their raw content"""
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        h.update(json.dumps(obj).encode("utf-8"))
+    elif isinstance(obj, bytes):
+        h.update(obj)
+    elif isinstance(obj, dict):
+        h.update(b"{")
+        for k in sorted(obj, key=str):
+            _feed(h, str(k))
+            _feed(h, obj[k])
+        h.update(b"}")
+    elif isinstance(obj, (list, tuple)):
+        h.update(b"[")
+        for item in obj:
+            _feed(h, item)
+        h.update(b"]")
+    elif hasattr(obj, "detach"):
+        # torch.Tensor
+        arr = obj.detach().cpu().contiguous().numpy()
+        h.update(f"T{arr.dtype}{arr.shape}".encode("utf-8"))
+        h.update(memoryview(arr).cast("B"))
+    elif hasattr(obj, "tobytes") and hasattr(obj, "shape"):
+        # numpy.ndarray
+        h.update(f"A{obj.dtype}{obj.shape}".encode("utf-8"))
+        h.update(obj.tobytes())
+    elif hasattr(obj, "tobytes") and hasattr(obj, "size"):
+        # PIL.Image
+        h.update(f"I{obj.mode}{obj.size}".encode("utf-8"))
+        h.update(obj.tobytes())
+    else:
+        h.update(repr(obj).encode("utf-8"))
+
+
+class ResponseCache:
+    """Content-addressed LLM response cache: in-memory LRU backed by JSON files on disk"""
+
+    def __init__(self, enabled=True, max_entries=256, disk_max_entries=4096, disk_dir=None):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self.disk_dir = disk_dir
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self._writes = 0
+
+    @staticmethod
+    def make_key(*parts):
+        h = hashlib.blake2b(digest_size=20)
+        _feed(h, parts)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json") if self.disk_dir else None
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        path = self._path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)["value"]
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        self._remember(key, value)
+
+        path = self._path(key)
+        if path is None:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"value": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[llama-cpp_vlm] Failed to write response cache: {e}")
+            return
+
+        self._writes += 1
+        if self._writes % 32 == 0:
+            self._prune_disk()
+
+    def _remember(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _prune_disk(self):
+        try:
+            files = [e for e in os.scandir(self.disk_dir) if e.name.endswith(".json")]
+        except OSError:
+            return
+        if len(files) <= self.disk_max_entries:
+            return
+        files.sort(key=lambda e: e.stat().st_mtime)
+        for entry in files[:len(files) - self.disk_max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.disk_dir and os.path.isdir(self.disk_dir):
+            for entry in os.scandir(self.disk_dir):
+                if entry.name.endswith(".json"):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+
+_settings = load_model_config().get("response_cache", {})
+RESPONSE_CACHE = ResponseCache(
+    enabled=_settings.get("enabled", True),
+    max_entries=_settings.get("max_entries", 256),
+    disk_max_entries=_settings.get("disk_max_entries", 4096),
+    disk_dir=os.path.join(folder_paths.get_user_directory(), "cj_nodes", "llm_cache"),
+)
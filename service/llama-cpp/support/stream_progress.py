@@ -0,0 +1,90 @@
+import time
+
+import comfy.model_management as mm
+
+try:
+    from server import PromptServer
+except Exception:
+    PromptServer = None
+
+# 前端监听的事件名（web/js/llm_stream.js）
+STREAM_EVENT = "cj-nodes.llm-stream"
+
+
+class StreamProgress:
+    """Push partial LLM output and tokens/sec of one node to the frontend while decoding"""
+
+    def __init__(self, node_id, min_interval=0.1):
+        self.node_id = node_id
+        self.min_interval = min_interval
+        self.text = ""
+        self.tokens = 0
+        self.start = time.perf_counter()
+        self._last_send = 0.0
+
+    @property
+    def tokens_per_sec(self):
+        elapsed = time.perf_counter() - self.start
+        return self.tokens / elapsed if elapsed > 0 else 0.0
+
+    def write(self, text):
+        """Append text that is not model output (frame headers, separators)"""
+        self.text += text
+        self._send()
+
+    def feed(self, delta, tokens=1):
+        self.text += delta
+        self.tokens += tokens
+        if time.perf_counter() - self._last_send >= self.min_interval:
+            self._send()
+
+    def finish(self):
+        self._send(done=True)
+
+    def _send(self, done=False):
+        self._last_send = time.perf_counter()
+        if self.node_id is None or PromptServer is None or PromptServer.instance is None:
+            return
+        try:
+            PromptServer.instance.send_sync(STREAM_EVENT, {
+                "node": str(self.node_id),
+                "text": self.text,
+                "tokens": self.tokens,
+                "tps": round(self.tokens_per_sec, 2),
+                "done": done,
+            })
+        except Exception:
+            pass
+
+
+def chat_completion_deltas(llm, **kwargs):
+    """Yield content deltas of llm.create_chat_completion(stream=True)"""
+    chunks = llm.create_chat_completion(stream=True, **kwargs)
+    try:
+        for chunk in chunks:
+            delta = chunk["choices"][0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def consume_stream(deltas, progress):
+    """
+    Collect a delta stream into the full text while reporting progress.
+    Closing the stream on interrupt stops decoding right away instead of running to max_tokens.
+    """
+    parts = []
+    try:
+        for delta in deltas:
+            if mm.processing_interrupted():
+                raise mm.InterruptProcessingException()
+            parts.append(delta)
+            progress.feed(delta)
+    finally:
+        close = getattr(deltas, "close", None)
+        if close is not None:
+            close()
+    return "".join(parts)
@@ -0,0 +1,41 @@
+STRUCTURED_MODES = ["off", "auto", "bbox", "json"]
+
+STRUCTURED_TOOLTIP = (
+    "Constrain decoding so the output is always valid JSON (no markdown fences).\n"
+    "off: free-form output\n"
+    "auto: bbox schema when the prompt asks for bbox_2d, otherwise free-form\n"
+    "bbox: [{\"bbox_2d\": [x1, y1, x2, y2], \"label\": \"...\"}] list\n"
+    "json: any JSON object"
+)
+
+# Qwen-VL 风格的检测结果，json_to_bbox / draw_bbox 直接可用
+BBOX_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "bbox_2d": {
+                "type": "array",
+                "items": {"type": "integer"},
+                "minItems": 4,
+                "maxItems": 4,
+            },
+            "label": {"type": "string"},
+        },
+        "required": ["bbox_2d", "label"],
+    },
+}
+
+
+def response_format_for(mode, prompt=""):
+    """
+    OpenAI-style response_format for create_chat_completion / llama.cpp server,
+    or None for free-form output. llama-cpp-python compiles the schema to a GBNF grammar.
+    """
+    if mode == "auto":
+        mode = "bbox" if "bbox_2d" in prompt else "off"
+    if mode == "bbox":
+        return {"type": "json_object", "schema": BBOX_SCHEMA}
+    if mode == "json":
+        return {"type": "json_object"}
+    return None
@@ -0,0 +1,77 @@
+WINDOW_TOOLTIP = (
+    'Frames per window in "video windows" mode.\n'
+    "Each window is captioned on its own, then the window captions are combined in text-only passes\n"
+    "(merged in stages when they do not fit in n_ctx), so the context never grows with the video length."
+)
+
+# map 阶段：每个窗口只做客观描述，最终任务在 reduce 阶段完成
+WINDOW_PROMPT = "这是一段视频中连续的几帧画面。请按时间顺序客观、详细地描述这段画面中的场景、人物、动作和镜头变化，不要推测画面以外的内容。"
+
+# 窗口描述太多、放不进一次上下文时，先把相邻几段合并成一段（可多轮）
+MERGE_TEMPLATE = (
+    "以下是同一段视频中连续几个片段的画面描述：\n\n{segments}\n\n"
+    "请按时间顺序把它们合并为一段连贯的描述，保留关键的人物、动作、场景和镜头变化，不要添加原文没有的内容。"
+)
+# 每段描述在提示词中的编号、换行等额外开销（token）
+SEGMENT_OVERHEAD = 16
+
+REDUCE_TEMPLATE = (
+    "以下是同一段视频按时间顺序切分后，各片段的画面描述：\n\n{segments}\n\n"
+    "请把这些片段当作一个连续的完整视频，综合上述描述完成下面的任务：\n{task}"
+)
+
+
+def split_windows(count, size):
+    """[(start, end), ...] consecutive windows of at most size frames covering range(count)"""
+    size = max(1, int(size))
+    return [(start, min(start + size, count)) for start in range(0, count, size)]
+
+
+def _segments(summaries):
+    return "\n\n".join(f"[片段 {i + 1}/{len(summaries)}]\n{text}" for i, text in enumerate(summaries))
+
+
+def merge_prompt(summaries):
+    """Prompt that merges a few consecutive captions into one"""
+    return MERGE_TEMPLATE.format(segments=_segments(summaries))
+
+
+def caption_budget(budget):
+    """Largest caption length (tokens) that still lets two captions share one merge prompt"""
+    return budget // 2 - SEGMENT_OVERHEAD
+
+
+def batch_summaries(summaries, budget, count_tokens):
+    """Group consecutive captions into batches whose prompt text stays within budget tokens"""
+    batches, current, used = [], [], 0
+    for text in summaries:
+        n = count_tokens(text) + SEGMENT_OVERHEAD
+        if current and used + n > budget:
+            batches.append(current)
+            current, used = [], 0
+        current.append(text)
+        used += n
+    if current:
+        batches.append(current)
+    return batches
+
+
+def reduce_in_stages(summaries, budget, count_tokens, merge):
+    """
+    Merge captions batch by batch, stage after stage, until they fit in one prompt of budget
+    tokens. When every caption and merge(batch, stage) result stays under caption_budget(budget),
+    each batch holds at least two captions, so every stage at least halves their number.
+    """
+    stage = 0
+    while len(summaries) > 1 and sum(count_tokens(t) + SEGMENT_OVERHEAD for t in summaries) > budget:
+        stage += 1
+        batches = batch_summaries(summaries, budget, count_tokens)
+        if len(batches) == len(summaries):
+            break
+        summaries = [batch[0] if len(batch) == 1 else merge(batch, stage) for batch in batches]
+    return summaries
+
+
+def reduce_prompt(task, summaries):
+    """Text-only prompt that combines the per-window captions and asks for the user's task"""
+    return REDUCE_TEMPLATE.format(segments=_segments(summaries), task=task.strip() or "描述这段视频的完整内容。")
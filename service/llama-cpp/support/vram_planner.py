@@ -0,0 +1,183 @@
+import os
+import re
+
+from gguf_layers import GGUFArray, read_gguf_info
+
+GB = 1024 ** 3
+# KV cache defaults to f16 in llama.cpp
+KV_BYTES_PER_ELEMENT = 2
+# Scratch/compute buffers are not part of the tensor table; keep a fixed headroom
+COMPUTE_RESERVE_BYTES = 512 * 1024 ** 2
+DEFAULT_UBATCH = 512
+
+_BLOCK_RE = re.compile(r"^blk\.(\d+)\.")
+_SPLIT_RE = re.compile(r"-(\d{5})-of-(\d{5})\.gguf$", re.IGNORECASE)
+
+
+class VRAMPlan:
+    def __init__(self, n_gpu_layers, block_count, layer_bytes, kv_layer_bytes, output_bytes,
+                 mmproj_bytes, reserve_bytes, limit_bytes):
+        self.n_gpu_layers = n_gpu_layers
+        self.block_count = block_count
+        self.layer_bytes = layer_bytes
+        self.kv_layer_bytes = kv_layer_bytes
+        self.output_bytes = output_bytes
+        self.mmproj_bytes = mmproj_bytes
+        self.reserve_bytes = reserve_bytes
+        self.limit_bytes = limit_bytes
+
+    @property
+    def offloaded_blocks(self):
+        return min(self.n_gpu_layers, self.block_count)
+
+    @property
+    def weights_bytes(self):
+        start = self.block_count - self.offloaded_blocks
+        return sum(self.layer_bytes[start:])
+
+    @property
+    def kv_bytes(self):
+        start = self.block_count - self.offloaded_blocks
+        return sum(self.kv_layer_bytes[start:])
+
+    @property
+    def total_bytes(self):
+        total = self.weights_bytes + self.kv_bytes + self.mmproj_bytes + self.reserve_bytes
+        if self.n_gpu_layers > self.block_count:
+            total += self.output_bytes
+        return total
+
+    def summary(self):
+        limit = "no limit" if self.limit_bytes < 0 else f"{self.limit_bytes / GB:.2f} GB"
+        output = "on GPU" if self.n_gpu_layers > self.block_count else "on CPU"
+        return (
+            f"n_gpu_layers = {self.n_gpu_layers} ({self.offloaded_blocks}/{self.block_count} blocks, output {output}), "
+            f"weights {self.weights_bytes / GB:.2f} GB + kv {self.kv_bytes / GB:.2f} GB"
+            f" + output {self.output_bytes / GB:.2f} GB + mmproj {self.mmproj_bytes / GB:.2f} GB"
+            f" + reserve {self.reserve_bytes / GB:.2f} GB = {self.total_bytes / GB:.2f} GB / {limit}"
+        )
+
+
+def _split_paths(path, info):
+    """All files of a split GGUF (model-00001-of-00003.gguf ...), or just path"""
+    count = info.get("split.count") or 1
+    match = _SPLIT_RE.search(path)
+    if count <= 1 or not match:
+        return [path]
+    prefix = path[:match.start()]
+    return [f"{prefix}-{i:05d}-of-{count:05d}.gguf" for i in range(1, count + 1)]
+
+
+def _per_layer(info, value, block_count, default=0):
+    """Metadata that may be a scalar or a per-layer array"""
+    if isinstance(value, GGUFArray):
+        # 超过 MAX_ARRAY_ITEMS 层的模型，逐层数组在解析头部时被跳过，这里再从文件读取
+        value = info.read_array(value)
+    if isinstance(value, list):
+        return [int(value[i]) if i < len(value) else default for i in range(block_count)]
+    if value is None:
+        return [default] * block_count
+    return [int(value)] * block_count
+
+
+def _kv_layer_bytes(info, block_count, n_ctx):
+    n_embd = info.get_arch_value("embedding_length") or 0
+    n_head = _per_layer(info, info.get_arch_value("attention.head_count"), block_count)
+    n_head_kv = _per_layer(info, info.get_arch_value("attention.head_count_kv"), block_count)
+    key_length = info.get_arch_value("attention.key_length")
+    value_length = info.get_arch_value("attention.value_length")
+    # 混合架构（Qwen3.5 / Qwen3-Next 等）只有每 N 层是全注意力层，其余为线性注意力，没有 KV cache
+    interval = info.get_arch_value("full_attention_interval") or 1
+
+    result = []
+    for i in range(block_count):
+        heads = n_head[i]
+        heads_kv = n_head_kv[i] or heads
+        if heads_kv <= 0 or (interval > 1 and (i + 1) % interval != 0):
+            result.append(0)
+            continue
+        head_dim = n_embd // heads if heads else 0
+        k = key_length or head_dim
+        v = value_length or head_dim
+        result.append(n_ctx * heads_kv * (k + v) * KV_BYTES_PER_ELEMENT)
+    return result
+
+
+def _vocab_size(info):
+    vocab = info.get_arch_value("vocab_size")
+    if vocab:
+        return int(vocab)
+    tokens = info.get("tokenizer.ggml.tokens")
+    if isinstance(tokens, GGUFArray):
+        return tokens.count
+    return len(tokens) if tokens else 0
+
+
+def _tensor_file_bytes(path):
+    try:
+        return read_gguf_info(path).tensor_bytes
+    except Exception:
+        return os.path.getsize(path)
+
+
+def plan_gpu_layers(model_path, n_ctx, vram_limit_gb=-1, mmproj_path=None):
+    """Pick the largest n_gpu_layers whose weights, KV cache, output and mmproj fit vram_limit_gb.
+
+    llama.cpp offloads the last n_gpu_layers repeating blocks; n_gpu_layers > block_count
+    also offloads the output layer. KV cache lives with the layer it belongs to.
+    """
+    info = read_gguf_info(model_path)
+    block_count = int(info.block_count or 0)
+    if block_count <= 0:
+        raise ValueError(f"No block_count in {os.path.basename(model_path)}")
+
+    if n_ctx <= 0:
+        n_ctx = int(info.get_arch_value("context_length") or 4096)
+
+    layer_bytes = [0] * block_count
+    output_bytes = 0
+    token_embd_bytes = 0
+    has_output = False
+    for path in _split_paths(model_path, info):
+        part = info if path == model_path else read_gguf_info(path)
+        for tensor in part.tensors:
+            match = _BLOCK_RE.match(tensor.name)
+            if match:
+                index = int(match.group(1))
+                if index < block_count:
+                    layer_bytes[index] += tensor.n_bytes
+            elif tensor.name.startswith("output"):
+                # output.weight / output_norm.weight
+                output_bytes += tensor.n_bytes
+                has_output = has_output or tensor.name == "output.weight"
+            elif tensor.name == "token_embd.weight":
+                token_embd_bytes = tensor.n_bytes
+
+    # 共享词嵌入的模型没有 output.weight，输出层会在 GPU 上复制一份 token_embd
+    if not has_output:
+        output_bytes += token_embd_bytes
+
+    kv_layer_bytes = _kv_layer_bytes(info, block_count, n_ctx)
+    mmproj_bytes = _tensor_file_bytes(mmproj_path) if mmproj_path else 0
+    reserve_bytes = COMPUTE_RESERVE_BYTES + _vocab_size(info) * DEFAULT_UBATCH * 4
+
+    limit_bytes = int(vram_limit_gb * GB) if vram_limit_gb is not None and vram_limit_gb >= 0 else -1
+    if limit_bytes < 0:
+        return VRAMPlan(block_count + 1, block_count, layer_bytes, kv_layer_bytes, output_bytes,
+                        mmproj_bytes, reserve_bytes, limit_bytes)
+
+    available = limit_bytes - mmproj_bytes - reserve_bytes
+    n_gpu_layers = 0
+    for i in range(block_count - 1, -1, -1):
+        cost = layer_bytes[i] + kv_layer_bytes[i]
+        if cost > available:
+            break
+        available -= cost
+        n_gpu_layers += 1
+    if n_gpu_layers == block_count and output_bytes <= available:
+        n_gpu_layers += 1
+    # 与旧的按文件大小估算一致，至少卸载一层到 GPU
+    n_gpu_layers = max(1, n_gpu_layers)
+
+    return VRAMPlan(n_gpu_layers, block_count, layer_bytes, kv_layer_bytes, output_bytes,
+                    mmproj_bytes, reserve_bytes, limit_bytes)
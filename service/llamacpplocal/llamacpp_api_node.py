@@ -3,53 +3,48 @@ LlamaCpp API 本地服务连接节点
 通过HTTP API连接本地llama.cpp服务器，支持图片输入
 """
 import os
-import io
+import sys
 import json
-import base64
 import requests
-import numpy as np
 import torch
-from PIL import Image
 import folder_paths
+import comfy.model_management as mm
 
+# 复用 llama-cpp/support 下的共享模块（响应缓存等）
+LLAMA_SUPPORT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "llama-cpp", "support")
+if LLAMA_SUPPORT_DIR not in sys.path:
+    sys.path.insert(0, LLAMA_SUPPORT_DIR)
+
+from response_cache import RESPONSE_CACHE
+from stream_progress import StreamProgress, consume_stream
+from image_pipeline import encode_frames
+from preset_index import PRESET_INDEX
+from structured_output import STRUCTURED_MODES, STRUCTURED_TOOLTIP, response_format_for
+from frame_dedup import DEDUP_TOOLTIP, dedup_frames, unique_frames
+from frame_sampling import SAMPLING_MODES, SAMPLING_TOOLTIP, sample_frames
+from llamacpp_client import DEFAULT_TIMEOUT, get_client
 
-# 提示词模板目录（T目录：文本模板，V目录：视觉模板）
-AITOOLS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "aitools")
-T_DIR = os.path.join(AITOOLS_DIR, "T")  # 文本提示词模板
-V_DIR = os.path.join(AITOOLS_DIR, "V")  # 视觉提示词模板（图片分析）
 
 # 预设提示词字典
 preset_prompts = {}
+_preset_version = None
 
 
 def load_prompts():
-    """加载T和V目录下的所有提示词模板"""
-    global preset_prompts
-    preset_prompts = {}
-
-    # 加载T目录（文本模板）
-    if os.path.exists(T_DIR) and os.path.isdir(T_DIR):
-        for filename in os.listdir(T_DIR):
-            if filename.endswith(".txt") and not filename.startswith(('.', '~')):
-                filepath = os.path.join(T_DIR, filename)
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        # 标记为T目录模板
-                        preset_prompts[f"[T] {filename}"] = f.read().strip()
-                except Exception as e:
-                    print(f"[LlamaCppAPI] 加载T目录提示词失败 {filename}: {str(e)[:50]}")
-
-    # 加载V目录（视觉/图片分析模板）
-    if os.path.exists(V_DIR) and os.path.isdir(V_DIR):
-        for filename in os.listdir(V_DIR):
-            if filename.endswith(".txt") and not filename.startswith(('.', '~')):
-                filepath = os.path.join(V_DIR, filename)
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        # 标记为V目录模板
-                        preset_prompts[f"[V] {filename}"] = f.read().strip()
-                except Exception as e:
-                    print(f"[LlamaCppAPI] 加载V目录提示词失败 {filename}: {str(e)[:50]}")
+    """从共享的预设索引读取T（文本模板）和V（视觉/图片分析模板）目录，索引未变化时直接复用"""
+    global preset_prompts, _preset_version
+    t_files = PRESET_INDEX.files("T")
+    v_files = PRESET_INDEX.files("V")
+
+    if _preset_version != PRESET_INDEX.version:
+        prompts = {}
+        for tag, files in (("T", t_files), ("V", v_files)):
+            for filename, content in files.items():
+                if filename.endswith(".txt") and not filename.startswith(('.', '~')):
+                    # 标记来源目录
+                    prompts[f"[{tag}] {filename}"] = content.strip()
+        preset_prompts = prompts
+        _preset_version = PRESET_INDEX.version
 
     return list(preset_prompts.keys()) if preset_prompts else ["请放入提示词文件"]
 
@@ -58,26 +53,21 @@ def load_prompts():
 preset_tags = load_prompts()
 
 
-def scale_image_tensor(image_tensor, max_size=512):
+def parse_chat_response(response):
     """
-    缩放图像tensor到指定最大尺寸
+    解析 chat/completions 响应，返回 (内容, 是否成功)
     """
-    if isinstance(image_tensor, torch.Tensor):
-        if image_tensor.ndim == 4:
-            image_tensor = image_tensor[0]
-        img_array = np.clip(255.0 * image_tensor.cpu().numpy(), 0, 255).astype(np.uint8)
-    else:
-        img_array = image_tensor
-
-    pil_image = Image.fromarray(img_array)
-    w, h = pil_image.size
-    scale = min(max_size / max(w, h), 1.0)
-    new_w, new_h = int(w * scale), int(h * scale)
+    if response.status_code != 200:
+        return (f"API错误 ({response.status_code}): {response.text[:300]}", False)
 
-    if scale < 1.0:
-        pil_image = pil_image.resize((new_w, new_h), Image.Resampling.LANCZOS)
+    result = response.json()
 
-    return pil_image
+    # OpenAI兼容格式
+    if "choices" in result and len(result["choices"]) > 0:
+        content = result["choices"][0]["message"]["content"]
+        # 清理输出
+        return (content.lstrip(": ").lstrip().rstrip(), True)
+    return (f"API响应格式错误: {json.dumps(result)[:200]}", False)
 
 
 class LlamaCppAPINode:
@@ -95,7 +85,7 @@ class LlamaCppAPINode:
                 "url": ("STRING", {
                     "default": "http://127.0.0.1:9900/v1",
                     "multiline": False,
-                    "tooltip": "llama.cpp服务器API地址"
+                    "tooltip": "llama.cpp服务器API地址\n多个服务器用逗号分隔，请求会分发到空闲的服务器，连接失败时自动切换"
                 }),
                 "preset_prompt": (tags, {
                     "default": tags[0] if tags else "",
@@ -152,6 +142,31 @@ class LlamaCppAPINode:
                     "step": 1,
                     "tooltip": "批量图片时最多处理的帧数"
                 }),
+                "request_mode": (["batch", "per_image"], {
+                    "default": "batch",
+                    "tooltip": "batch: 所有图片放在一个请求里\nper_image: 每张图片单独请求并发发送，结果按顺序拼接"
+                }),
+                "parallel": ("INT", {
+                    "default": 4,
+                    "min": 1,
+                    "max": 64,
+                    "step": 1,
+                    "tooltip": "per_image 模式的并发请求数，建议与服务器 --parallel 槽位数一致"
+                }),
+                "stream": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "流式输出：生成过程中在节点上实时显示文本和速度，中断时立即停止解码（per_image 模式不生效）"
+                }),
+                "structured_output": (STRUCTURED_MODES, {"default": "off", "tooltip": STRUCTURED_TOOLTIP}),
+                "dedup_threshold": ("INT", {"default": 0, "min": 0, "max": 32, "step": 1, "tooltip": DEDUP_TOOLTIP}),
+                "frame_sampling": (SAMPLING_MODES, {"default": "uniform", "tooltip": SAMPLING_TOOLTIP}),
+                "use_cache": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "固定种子且输入不变时直接返回缓存结果（重启后仍有效）\n缓存按服务器当前加载的模型（/v1/models）区分，无法获取模型信息时不缓存"
+                }),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
             }
         }
 
@@ -161,7 +176,8 @@ class LlamaCppAPINode:
     CATEGORY = "luy/AI"
 
     def process(self, url, preset_prompt, custom_prompt, max_tokens, temperature,
-                images=None, system_prompt="", seed=-1, image_max_size=1024, max_frames=8):
+                images=None, system_prompt="", seed=-1, image_max_size=1024, max_frames=8,
+                request_mode="batch", parallel=4, stream=False, structured_output="off", dedup_threshold=0, frame_sampling="uniform", use_cache=False, unique_id=None):
         """
         调用本地llama.cpp API服务，支持图片输入
         """
@@ -185,7 +201,7 @@ class LlamaCppAPINode:
         if not system_prompt.strip():
             if image_count == 0:
                 system_prompt = "你是一名AI助手，擅长扩写用户的描述内容。"
-            elif image_count == 1:
+            elif image_count == 1 or request_mode == "per_image":
                 system_prompt = "你是一名图片分析专家，擅长将图片的内容详细描述出来！"
             else:
                 system_prompt = "你是一名视频描述专家，擅长将不同图片帧的内容描述出来，同时能将不同画面之间的关系进行连贯描述，擅长分析前后图片之间的过度关系，符合画面的连贯关系！"
@@ -193,110 +209,165 @@ class LlamaCppAPINode:
         if not full_prompt.strip() and images is None:
             return ("错误：提示词和图片均为空，请至少提供一项", system_prompt, full_prompt)
 
+        # 结构化输出：服务器按 JSON schema 约束解码
+        response_format = response_format_for(structured_output, full_prompt)
+
+        # 固定种子且输入未变化时直接使用缓存结果（seed=-1 为随机，不缓存）
+        # 服务器可能随时切换模型，缓存键包含服务器当前加载的模型 id
+        cache_key = None
+        if use_cache and seed >= 0:
+            try:
+                served_models = get_client(url, pool_size=max(parallel, 4)).model_ids()
+            except ValueError:
+                served_models = None
+            if served_models is None:
+                print("[LlamaCppAPI] 无法获取服务器加载的模型，本次不使用缓存")
+            else:
+                cache_key = RESPONSE_CACHE.make_key(
+                    "LlamaCppAPINode", url.rstrip('/'), served_models, system_prompt, full_prompt, max_tokens,
+                    temperature, seed, image_max_size, max_frames, images, request_mode, response_format,
+                    *([dedup_threshold] if dedup_threshold else []),
+                    *([frame_sampling] if frame_sampling != "uniform" else [])
+                )
+                cached = RESPONSE_CACHE.get(cache_key)
+                if cached is not None:
+                    return (cached, system_prompt, full_prompt)
+
         # 构建消息内容
-        user_content = []
+        text_content = []
 
         # 添加文本提示词
         if full_prompt.strip():
-            user_content.append({
+            text_content.append({
                 "type": "text",
                 "text": full_prompt
             })
 
+        image_content = []
+
         # 处理图片输入
+        owner = None
         if images is not None:
+            if dedup_threshold > 0 and request_mode != "per_image" and images.ndim == 4:
+                # 先去掉近似重复帧，再在剩余帧中采样
+                images = unique_frames(images, dedup_threshold)
+                print(f"[LlamaCppAPI] 去重: {image_count} -> {len(images)} 帧")
+                image_count = len(images)
+
             # 限制处理的帧数
             if image_count > max_frames:
-                indices = np.linspace(0, image_count - 1, max_frames, dtype=int)
+                indices = sample_frames(images, max_frames, frame_sampling)
                 images_to_process = [images[i] if images.ndim == 4 else images for i in indices]
                 print(f"[LlamaCppAPI] 批量图片共{image_count}张，处理前{max_frames}张")
+                if frame_sampling != "uniform":
+                    print(f"[LlamaCppAPI] 采样帧({frame_sampling}): {indices.tolist()}")
             else:
                 images_to_process = [images[i] for i in range(image_count)] if images.ndim == 4 else [images]
 
-            for idx, image in enumerate(images_to_process):
-                try:
-                    # 缩放图片
-                    pil_image = scale_image_tensor(image, image_max_size)
-
-                    # 转换为base64
-                    buffered = io.BytesIO()
-                    pil_image.save(buffered, format="JPEG", quality=95)
-                    img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-
-                    # 添加图片到消息内容（OpenAI Vision格式）
-                    user_content.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{img_base64}",
-                        "detail": "auto"
-                        }
-                    })
-                    print(f"[LlamaCppAPI] 成功处理图片 {idx + 1}/{len(images_to_process)}")
-                except Exception as e:
-                    print(f"[LlamaCppAPI] 图片处理失败: {str(e)[:50]}")
-                    continue
+            if dedup_threshold > 0 and request_mode == "per_image":
+                # 近似重复的帧只请求一次，结果按帧顺序展开
+                keep, owner = dedup_frames(images_to_process, dedup_threshold)
+                if len(keep) < len(images_to_process):
+                    print(f"[LlamaCppAPI] 去重: {len(images_to_process)} 帧中 {len(keep)} 帧不同")
+                images_to_process = [images_to_process[j] for j in keep]
+
+            # 整批缩放并转换为base64（JPEG 编码并行）
+            try:
+                encoded = encode_frames(images_to_process, image_max_size, quality=95)
+            except Exception as e:
+                print(f"[LlamaCppAPI] 图片处理失败: {str(e)[:50]}")
+                encoded = []
+
+            for img_base64 in encoded:
+                # 添加图片到消息内容（OpenAI Vision格式）
+                image_content.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{img_base64}",
+                    "detail": "auto"
+                    }
+                })
+            print(f"[LlamaCppAPI] 成功处理图片 {len(encoded)}/{len(images_to_process)}")
 
         # 构建API请求
-        messages = []
+        system_messages = []
 
         if system_prompt.strip():
-            messages.append({
+            system_messages.append({
                 "role": "system",
                 "content": system_prompt.strip()
             })
 
-        messages.append({
-            "role": "user",
-            "content": user_content
-        })
-
-        # 构建请求体
-        payload = {
-            "messages": messages,
-            "max_tokens": max_tokens,
-            "temperature": temperature,
-            "stream": False
-        }
-
-        if seed >= 0:
-            payload["seed"] = seed
+        def build_payload(user_content):
+            payload = {
+                "messages": system_messages + [{"role": "user", "content": user_content}],
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                "stream": False
+            }
+            if seed >= 0:
+                payload["seed"] = seed
+            if response_format is not None:
+                payload["response_format"] = response_format
+            return payload
 
-        # 确保URL格式正确
-        api_url = url.rstrip('/')
-        if not api_url.endswith('/chat/completions'):
-            api_url = f"{api_url}/chat/completions"
+        per_image = request_mode == "per_image" and (len(image_content) > 1 or (owner is not None and len(owner) > 1))
+        api_url = url
 
         # 发送请求
         try:
+            client = get_client(url, pool_size=max(parallel, 4))
+            api_url = client.url
             print(f"[LlamaCppAPI] 正在连接: {api_url}")
-            print(f"[LlamaCppAPI] 消息内容: 文本{len([c for c in user_content if c['type']=='text'])}项, 图片{len([c for c in user_content if c['type']=='image_url'])}张")
-
-            response = requests.post(
-                api_url,
-                headers={
-                    "Content-Type": "application/json",
-                    "Accept": "application/json"
-                },
-                json=payload,
-                timeout=180  # 3分钟超时（图片处理可能较慢）
-            )
-
-            if response.status_code != 200:
-                error_text = response.text[:300]
-                return (f"API错误 ({response.status_code}): {error_text}", system_prompt, full_prompt)
-
-            # 解析响应
-            result = response.json()
-
-            # OpenAI兼容格式
-            if "choices" in result and len(result["choices"]) > 0:
-                content = result["choices"][0]["message"]["content"]
-                # 清理输出
-                content = content.lstrip(": ").lstrip().rstrip()
+
+            if per_image:
+                # 每张图片一个请求，并发数受 parallel 限制，结果按帧顺序拼接
+                print(f"[LlamaCppAPI] 逐图请求: 图片{len(image_content)}张, 并发{parallel}")
+                payloads = [build_payload(text_content + [item]) for item in image_content]
+                responses = client.chat_many(payloads, parallel=parallel, timeout=DEFAULT_TIMEOUT)
+
+                results = []
+                all_ok = True
+                for response in responses:
+                    if isinstance(response, requests.exceptions.RequestException):
+                        text, ok = (f"请求异常：{str(response)[:150]}", False)
+                    else:
+                        text, ok = parse_chat_response(response)
+                    all_ok = all_ok and ok
+                    results.append(text)
+                if owner is not None and len(results) == owner[-1] + 1:
+                    results = [results[k] for k in owner]
+
+                parts = []
+                for i, text in enumerate(results):
+                    parts.append(f"====== Image {i+1} ======")
+                    parts.append(text)
+                content = "\n\n".join(parts)
+                if all_ok and cache_key is not None:
+                    RESPONSE_CACHE.put(cache_key, content)
                 return (content, system_prompt, full_prompt)
-            else:
-                return (f"API响应格式错误: {json.dumps(result)[:200]}", system_prompt, full_prompt)
 
+            user_content = text_content + image_content
+            print(f"[LlamaCppAPI] 消息内容: 文本{len(text_content)}项, 图片{len(image_content)}张")
+
+            if stream:
+                progress = StreamProgress(unique_id)
+                try:
+                    content = consume_stream(client.chat_stream(build_payload(user_content), timeout=DEFAULT_TIMEOUT), progress)
+                finally:
+                    progress.finish()
+                content, ok = (content.lstrip(": ").lstrip().rstrip(), True)
+            else:
+                response = client.chat(build_payload(user_content), timeout=DEFAULT_TIMEOUT)
+                content, ok = parse_chat_response(response)
+            if ok and cache_key is not None:
+                RESPONSE_CACHE.put(cache_key, content)
+            return (content, system_prompt, full_prompt)
+
+        except mm.InterruptProcessingException:
+            raise
+        except requests.exceptions.HTTPError as e:
+            return (str(e), system_prompt, full_prompt)
         except requests.exceptions.ConnectionError:
             return (f"连接失败：无法连接到 {api_url}，请检查服务是否启动", system_prompt, full_prompt)
         except requests.exceptions.Timeout:
@@ -327,6 +398,7 @@ class LlamaCppAPIRefreshPrompts:
 
     def process(self, any):
         global preset_tags
+        PRESET_INDEX.refresh(force=True)
         preset_tags = load_prompts()
         count = len(preset_tags)
         return (f"已刷新提示词模板，当前共 {count} 个模板",)
@@ -0,0 +1,278 @@
+"""
+llama.cpp HTTP 客户端
+复用 keep-alive 连接池，按服务器 --parallel 槽位数并发发送请求
+支持多个服务器地址：健康检查、最少在途请求路由、连接失败自动切换
+"""
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 3分钟超时（图片处理可能较慢）
+DEFAULT_TIMEOUT = 180
+# 健康检查超时与不可用服务器的重试间隔（秒）
+HEALTH_TIMEOUT = 2
+HEALTH_RETRY_INTERVAL = 10
+
+
+def chat_completions_url(url):
+    """补全为 OpenAI 兼容的 /chat/completions 地址"""
+    api_url = url.rstrip('/')
+    if not api_url.endswith('/chat/completions'):
+        api_url = f"{api_url}/chat/completions"
+    return api_url
+
+
+def parse_endpoints(url):
+    """url 输入支持多个地址，用逗号、分号或换行分隔"""
+    endpoints = []
+    for item in re.split(r"[,;\s]+", url):
+        if item and chat_completions_url(item) not in endpoints:
+            endpoints.append(chat_completions_url(item))
+    return endpoints
+
+
+class LlamaCppClient:
+    """一个服务器地址对应一个持久 Session，连接在多次节点执行之间复用"""
+
+    def __init__(self, url, pool_size=8):
+        self.url = chat_completions_url(url)
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        })
+
+    @property
+    def base_url(self):
+        """去掉 /chat/completions 的 API 地址（通常以 /v1 结尾）"""
+        return self.url[:-len("/chat/completions")]
+
+    def chat(self, payload, timeout=DEFAULT_TIMEOUT):
+        return self.session.post(self.url, json=payload, timeout=timeout)
+
+    def chat_stream(self, payload, timeout=DEFAULT_TIMEOUT):
+        """
+        SSE 流式请求，逐段返回生成的文本
+        提前关闭生成器会断开连接，服务器随即停止解码
+        """
+        payload = dict(payload, stream=True)
+        with self.session.post(self.url, json=payload, timeout=timeout, stream=True) as response:
+            if response.status_code != 200:
+                raise requests.exceptions.HTTPError(
+                    f"API错误 ({response.status_code}): {response.text[:300]}", response=response)
+            # text/event-stream 没有声明编码时 requests 会按 ISO-8859-1 解码
+            response.encoding = "utf-8"
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or []
+                if choices:
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if delta:
+                        yield delta
+
+    def probe(self):
+        """
+        健康检查：先请求服务器根路径的 /health（加载模型中返回 503），
+        不支持时再请求 /v1/models
+        """
+        root = re.sub(r"/v1$", "", self.base_url)
+        for probe_url in (f"{root}/health", f"{self.base_url}/models"):
+            try:
+                response = self.session.get(probe_url, timeout=HEALTH_TIMEOUT)
+            except requests.exceptions.RequestException:
+                return False
+            if response.status_code == 200:
+                return True
+            if response.status_code != 404:
+                return False
+        return False
+
+    def model_ids(self):
+        """/v1/models 中服务器当前加载的模型 id 列表，请求失败时返回 None"""
+        try:
+            response = self.session.get(f"{self.base_url}/models", timeout=HEALTH_TIMEOUT)
+            if response.status_code != 200:
+                return None
+            return sorted(str(item.get("id")) for item in response.json().get("data") or [])
+        except (requests.exceptions.RequestException, ValueError, AttributeError):
+            return None
+
+    def close(self):
+        self.session.close()
+
+
+class Endpoint:
+    def __init__(self, client):
+        self.client = client
+        self.outstanding = 0
+        self.healthy = True
+        self.retry_at = 0.0
+        self.failures = 0
+
+
+class LlamaCppBalancer:
+    """
+    多个 llama.cpp 服务器之间的负载均衡
+    请求发往在途请求最少的健康服务器；连接失败时标记为不可用并切换到下一个，
+    不可用的服务器在重试间隔后通过健康检查恢复
+    """
+
+    def __init__(self, urls, pool_size=8):
+        self.endpoints = [Endpoint(LlamaCppClient(url, pool_size)) for url in urls]
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        if len(self.endpoints) > 1:
+            self.check_health()
+
+    @property
+    def url(self):
+        return ", ".join(ep.client.url for ep in self.endpoints)
+
+    def check_health(self):
+        """并发探测所有服务器"""
+        with ThreadPoolExecutor(max_workers=len(self.endpoints)) as executor:
+            results = list(executor.map(lambda ep: ep.client.probe(), self.endpoints))
+        for ep, ok in zip(self.endpoints, results):
+            self._mark(ep, ok)
+        return results
+
+    def _mark(self, ep, ok):
+        with self.lock:
+            ep.healthy = ok
+            if ok:
+                ep.failures = 0
+            else:
+                ep.failures += 1
+                ep.retry_at = time.monotonic() + HEALTH_RETRY_INTERVAL
+
+    def _candidates(self):
+        """按优先级排列的服务器：健康的在前（在途请求少的优先），到期的不可用服务器先探测"""
+        now = time.monotonic()
+        stale = []
+        with self.lock:
+            for ep in self.endpoints:
+                if not ep.healthy and ep.retry_at <= now:
+                    ep.retry_at = now + HEALTH_RETRY_INTERVAL
+                    stale.append(ep)
+        for ep in stale:
+            self._mark(ep, ep.client.probe())
+
+        with self.lock:
+            healthy = sorted((ep for ep in self.endpoints if ep.healthy), key=lambda ep: ep.outstanding)
+            # 全部不可用时仍然按失败次数依次尝试，而不是直接报错
+            unhealthy = sorted((ep for ep in self.endpoints if not ep.healthy), key=lambda ep: ep.failures)
+        return healthy + unhealthy
+
+    def _acquire(self, ep):
+        with self.lock:
+            ep.outstanding += 1
+
+    def _release(self, ep):
+        with self.lock:
+            ep.outstanding -= 1
+
+    def chat(self, payload, timeout=DEFAULT_TIMEOUT):
+        error = None
+        for ep in self._candidates():
+            self._acquire(ep)
+            try:
+                response = ep.client.chat(payload, timeout)
+            except requests.exceptions.ConnectionError as e:
+                self._mark(ep, False)
+                error = e
+                print(f"[LlamaCppAPI] 服务器不可用，切换: {ep.client.url}")
+                continue
+            finally:
+                self._release(ep)
+            if response.status_code == 503:
+                # 服务器正在加载模型或槽位已满
+                self._mark(ep, False)
+                error = requests.exceptions.HTTPError(f"API错误 (503): {response.text[:300]}", response=response)
+                continue
+            return response
+        raise error
+
+    def chat_stream(self, payload, timeout=DEFAULT_TIMEOUT):
+        """流式请求只在收到第一段文本之前切换服务器"""
+        error = None
+        for ep in self._candidates():
+            self._acquire(ep)
+            started = False
+            try:
+                for delta in ep.client.chat_stream(payload, timeout):
+                    started = True
+                    yield delta
+                return
+            except requests.exceptions.ConnectionError as e:
+                if started:
+                    raise
+                self._mark(ep, False)
+                error = e
+                print(f"[LlamaCppAPI] 服务器不可用，切换: {ep.client.url}")
+            finally:
+                self._release(ep)
+        raise error
+
+    def chat_many(self, payloads, parallel=4, timeout=DEFAULT_TIMEOUT):
+        """
+        并发发送多个请求（同时最多 parallel 个），结果按输入顺序返回
+        每一项为 Response，或该请求抛出的 requests 异常
+        """
+        def run(payload):
+            try:
+                return self.chat(payload, timeout)
+            except requests.exceptions.RequestException as e:
+                return e
+
+        if not payloads:
+            return []
+        workers = max(1, min(parallel, len(payloads)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llamacpp_api") as executor:
+            return list(executor.map(run, payloads))
+
+    def model_ids(self):
+        """所有服务器加载的模型 id；任一服务器无法确认时返回 None"""
+        ids = []
+        for ep in self.endpoints:
+            served = ep.client.model_ids()
+            if served is None:
+                return None
+            ids.append(served)
+        return ids
+
+    def close(self):
+        for ep in self.endpoints:
+            ep.client.close()
+
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_client(url, pool_size=8):
+    """按地址列表获取共享客户端；需要更大的连接池时重建"""
+    endpoints = parse_endpoints(url)
+    if not endpoints:
+        raise ValueError("url 不能为空")
+    key = tuple(endpoints)
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is None or client.pool_size < pool_size:
+            if client is not None:
+                client.close()
+            client = LlamaCppBalancer(endpoints, pool_size)
+            _CLIENTS[key] = client
+        return client
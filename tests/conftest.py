@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUPPORT_DIR = os.path.join(ROOT, "service", "llama-cpp", "support")
+if SUPPORT_DIR not in sys.path:
+    sys.path.insert(0, SUPPORT_DIR)
+
+
+def _install_comfy_stub():
+    """Minimal comfy.model_management so the pure helpers import outside a ComfyUI install"""
+    try:
+        import comfy.model_management  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    mm = types.ModuleType("comfy.model_management")
+    mm.get_torch_device = lambda: "cpu"
+    mm.get_total_memory = lambda device=None: 8 * (1024 ** 3)
+    mm.soft_empty_cache = lambda *args, **kwargs: None
+    comfy = types.ModuleType("comfy")
+    comfy.model_management = mm
+    sys.modules["comfy"] = comfy
+    sys.modules["comfy.model_management"] = mm
+
+
+def _install_folder_paths_stub():
+    """Minimal folder_paths: only the user directory, used by the response cache's disk path"""
+    try:
+        import folder_paths  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    folder_paths = types.ModuleType("folder_paths")
+    folder_paths.get_user_directory = lambda: os.path.join(tempfile.gettempdir(), "cj_nodes_tests")
+    sys.modules["folder_paths"] = folder_paths
+
+
+_install_comfy_stub()
+_install_folder_paths_stub()
@@ -0,0 +1,61 @@
+import math
+
+import torch
+
+from audio_chunks import join, plan_chunks, stitch, timestamp
+
+RATE = 16000
+
+
+def tone(seconds, amplitude=0.5):
+    t = torch.arange(int(seconds * RATE)) / RATE
+    return amplitude * torch.sin(2 * math.pi * 440 * t)
+
+
+def test_stitch_drops_repeated_words():
+    prev = "the quick brown fox jumps over"
+    text = "fox jumps over the lazy dog"
+    assert stitch(prev, text) == "the quick brown fox jumps over the lazy dog"
+
+
+def test_stitch_drops_repeated_cjk_characters():
+    assert stitch("今天天气很好我们去公园", "我们去公园散步吧") == "今天天气很好我们去公园散步吧"
+
+
+def test_stitch_without_overlap_joins():
+    assert stitch("hello there", "general kenobi") == "hello there general kenobi"
+    assert stitch("", "text") == "text"
+    assert stitch("text", "") == "text"
+
+
+def test_join_spacing():
+    assert join("hello", "world") == "hello world"
+    assert join("你好", "世界") == "你好世界"
+    assert join("hello ", "world") == "hello world"
+
+
+def test_plan_chunks_short_audio_is_one_chunk():
+    assert plan_chunks(tone(5)[None], RATE, 30, 2) == [(0, 5 * RATE, False)]
+
+
+def test_plan_chunks_overlaps_without_silence():
+    chunks = plan_chunks(tone(70)[None], RATE, 30, 2)
+    assert chunks[0] == (0, 30 * RATE, False)
+    assert chunks[1][0] == 28 * RATE and chunks[1][2]
+    assert chunks[-1][1] == 70 * RATE
+
+
+def test_plan_chunks_cuts_in_silence():
+    # 25 秒处有一段静音，第一段应在静音中结束，下一段不需要重叠
+    wave = torch.cat([tone(24), torch.zeros(RATE), tone(30)])[None]
+    chunks = plan_chunks(wave, RATE, 30, 2)
+    start, end, overlapped = chunks[0]
+    assert start == 0 and 24 * RATE <= end <= 25 * RATE and not overlapped
+    assert chunks[1][0] == end and not chunks[1][2]
+    for (_s0, e0, _o0), (s1, _e1, _o1) in zip(chunks, chunks[1:]):
+        assert s1 <= e0
+    assert chunks[-1][1] == wave.shape[-1]
+
+
+def test_timestamp():
+    assert timestamp(3725.9) == "01:02:05"
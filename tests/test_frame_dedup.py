@@ -0,0 +1,42 @@
+import torch
+
+from frame_dedup import dedup_frames, dhash, unique_frames
+
+
+def gradient(h=32, w=36, flip=False):
+    x = torch.linspace(0, 1, w).expand(h, w)
+    if flip:
+        x = x.flip(-1)
+    return x[..., None].expand(h, w, 3).clone()
+
+
+def noise(seed, h=32, w=36):
+    return torch.rand((h, w, 3), generator=torch.Generator().manual_seed(seed))
+
+
+def test_dhash_shape():
+    assert dhash(torch.stack([gradient(), noise(0)])).shape == (2, 64)
+
+
+def test_consecutive_duplicates_share_a_representative():
+    a, b = noise(1), noise(2)
+    frames = torch.stack([a, a, a + 0.001, b, b, a])
+    keep, owner = dedup_frames(frames, 4)
+    assert keep == [0, 3, 5]
+    assert owner == [0, 0, 0, 1, 1, 2]
+
+
+def test_threshold_zero_keeps_every_frame():
+    frames = torch.stack([gradient()] * 3)
+    assert dedup_frames(frames, 0) == ([0, 1, 2], [0, 1, 2])
+
+
+def test_unique_frames_keeps_container_type():
+    a, b = gradient(), gradient(flip=True)
+    batch = torch.stack([a, a, b])
+    assert torch.equal(unique_frames(batch, 4), torch.stack([a, b]))
+
+    frames = [a[None], a[None], b[None]]
+    result = unique_frames(frames, 4)
+    assert isinstance(result, list) and len(result) == 2
+    assert result[1] is frames[2]
@@ -0,0 +1,41 @@
+import numpy as np
+import torch
+
+from frame_sampling import frame_scores, sample_frames, shot_boundaries
+
+
+def shots(*lengths):
+    """Video of static shots of the given lengths, each a different flat colour"""
+    frames = []
+    for i, length in enumerate(lengths):
+        frames += [torch.full((16, 16, 3), (i % 2) * 0.8 + i * 0.02)] * length
+    return torch.stack(frames)
+
+
+def test_frame_scores_first_is_zero():
+    scores = frame_scores(shots(3, 3))
+    assert scores.shape == (6,)
+    assert scores[0] == 0
+    assert scores[3] > 0.5 and np.allclose(np.delete(scores, 3), 0)
+
+
+def test_shot_boundaries_finds_cuts():
+    assert sorted(shot_boundaries(frame_scores(shots(10, 10, 10))).tolist()) == [10, 20]
+
+
+def test_uniform_matches_linspace():
+    video = shots(30)
+    assert sample_frames(video, 5).tolist() == np.linspace(0, 29, 5, dtype=int).tolist()
+
+
+def test_scene_gives_every_shot_a_frame():
+    video = shots(40, 3, 40)
+    picked = sample_frames(video, 6, mode="scene")
+    assert len(picked) == 6 and len(set(picked.tolist())) == 6
+    assert picked.tolist() == sorted(picked.tolist())
+    assert {0, 40, 43} <= set(picked.tolist())
+
+
+def test_scene_budget_above_batch_size_uses_linspace():
+    video = shots(2, 2)
+    assert sample_frames(video, 10, mode="scene").tolist() == np.linspace(0, 3, 10, dtype=int).tolist()
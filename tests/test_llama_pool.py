@@ -0,0 +1,138 @@
+import pytest
+
+from llama_pool import LlamaModelPool, PoolEntry
+
+GB = 1024 ** 3
+
+
+class FakeLlama:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def loader(key, size_bytes=0):
+    return lambda: PoolEntry(key, {"name": key}, FakeLlama(), None, size_bytes)
+
+
+@pytest.fixture
+def pool():
+    return LlamaModelPool(max_models=2, budget_gb=100)
+
+
+def test_acquire_loads_once_and_counts_references(pool):
+    calls = []
+
+    def load():
+        calls.append(1)
+        return loader("a")()
+
+    first = pool.acquire("a", load)
+    second = pool.acquire("a", load)
+    assert first is second
+    assert len(calls) == 1
+    assert first.refs == 2
+
+    pool.release(first)
+    pool.release(first)
+    pool.release(first)
+    assert first.refs == 0
+
+
+def test_evict_refuses_referenced_entry_unless_forced(pool):
+    entry = pool.acquire("a", loader("a"))
+    llm = entry.llm
+
+    assert pool.evict("a") is False
+    assert pool.get("a") is entry
+    assert not llm.closed
+
+    assert pool.evict("a", force=True) is True
+    assert pool.get("a") is None
+    assert llm.closed
+    assert entry.llm is None
+    assert pool.evict("a") is False
+
+
+def test_make_room_evicts_least_recently_used_unreferenced(pool):
+    a = pool.acquire("a", loader("a"))
+    b = pool.acquire("b", loader("b"))
+    pool.release(a)
+    pool.release(b)
+    pool.get("a")  # a 变为最近使用
+
+    pool.acquire("c", loader("c"))
+    assert list(pool.entries) == ["a", "c"]
+    assert b.llm is None
+    assert a.llm is not None
+
+
+def test_make_room_keeps_referenced_entries(pool):
+    a = pool.acquire("a", loader("a"))
+    b = pool.acquire("b", loader("b"))
+
+    c = pool.acquire("c", loader("c"))
+    assert list(pool.entries) == ["a", "b", "c"]
+    assert a.llm is not None and b.llm is not None and c.refs == 1
+
+
+def test_make_room_respects_memory_budget():
+    pool = LlamaModelPool(max_models=10, budget_gb=3)
+    a = pool.acquire("a", loader("a", 2 * GB), 2 * GB)
+    pool.release(a)
+    b = pool.acquire("b", loader("b", GB // 2), GB // 2)
+    pool.release(b)
+
+    pool.acquire("c", loader("c", 2 * GB), 2 * GB)
+    assert list(pool.entries) == ["b", "c"]
+    assert pool.used_bytes() == 2 * GB + GB // 2
+
+
+def test_clear_closes_referenced_entries(pool):
+    a = pool.acquire("a", loader("a"))
+    b = pool.acquire("b", loader("b"))
+    pool.release(b)
+    llm = a.llm
+
+    pool.clear()
+    assert not pool.entries
+    assert a.llm is None and b.llm is None
+    assert llm.closed
+
+    # 持有者发现 entry.llm 为 None 后重新获取，得到新加载的模型
+    again = pool.acquire("a", loader("a"))
+    assert again is not a
+    assert again.llm is not None
+
+
+def test_preload_then_acquire_reuses_background_load(pool):
+    calls = []
+
+    def load():
+        calls.append(1)
+        return loader("a", GB)()
+
+    future = pool.preload("a", load, GB)
+    assert pool.preload("a", load, GB) is future or future.done()
+    pool.wait("a")
+    assert not pool.loading and not pool.reserved
+
+    entry = pool.acquire("a", load, GB)
+    assert entry is future.result()
+    assert entry.refs == 1
+    assert len(calls) == 1
+
+
+def test_preload_failure_falls_back_to_acquire(pool):
+    def broken():
+        raise RuntimeError("boom")
+
+    pool.preload("a", broken)
+    pool.wait("a")
+    assert pool.get("a") is None
+    assert not pool.reserved
+
+    entry = pool.acquire("a", loader("a"))
+    assert entry.refs == 1
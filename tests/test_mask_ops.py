@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import torch
+
+from mask_ops import box_profiles, box_tensor, gaussian_blur, is_per_frame, rasterize_boxes
+
+ndimage = pytest.importorskip("scipy.ndimage")
+
+
+def naive_union(boxes, height, width):
+    mask = np.zeros((height, width), dtype=np.float32)
+    for x1, y1, x2, y2 in boxes:
+        mask[max(0, y1):max(0, y2), max(0, x1):max(0, x2)] = 1.0
+    return mask
+
+
+def test_rasterize_boxes_matches_per_box_painting():
+    boxes = [(2, 3, 10, 8), (5, 5, 20, 12), (-4, -4, 3, 2), (18, 14, 40, 30), (7, 7, 7, 9)]
+    mask = rasterize_boxes(torch.tensor(boxes), 16, 24)
+    assert mask.shape == (16, 24)
+    np.testing.assert_array_equal(mask.numpy(), naive_union(boxes, 16, 24))
+
+
+def test_rasterize_no_boxes_is_empty():
+    mask = rasterize_boxes(torch.zeros((0, 4), dtype=torch.int64), 5, 7)
+    assert mask.shape == (5, 7) and not mask.any()
+
+
+@pytest.mark.parametrize("sigma", [1, 3, 8])
+def test_gaussian_blur_matches_scipy(sigma):
+    masks = torch.from_numpy(naive_union([(4, 4, 20, 12), (25, 2, 30, 30)], 32, 40))[None]
+    expected = ndimage.gaussian_filter(masks[0].numpy(), sigma)
+    np.testing.assert_allclose(gaussian_blur(masks, sigma)[0].numpy(), expected, atol=1e-5)
+
+
+def test_box_profiles_outer_product_matches_scipy():
+    dilation, feather = 6, 3
+    boxes, _items = box_tensor([[10, 10, 30, 20], [0, 0, 9, 40]], dilation)
+    crop_w = boxes[:, 2] - boxes[:, 0]
+    crop_h = boxes[:, 3] - boxes[:, 1]
+    px = box_profiles(torch.full_like(crop_w, dilation), crop_w - dilation, crop_w, feather).numpy()
+    py = box_profiles(torch.full_like(crop_h, dilation), crop_h - dilation, crop_h, feather).numpy()
+    for i in range(len(boxes)):
+        w, h = int(crop_w[i]), int(crop_h[i])
+        local = np.zeros((h, w), dtype=np.float32)
+        local[dilation:h - dilation, dilation:w - dilation] = 1.0
+        expected = ndimage.gaussian_filter(local, feather)
+        np.testing.assert_allclose(np.outer(py[i, :h], px[i, :w]), expected, atol=1e-5)
+
+
+def test_box_tensor_skips_invalid_items():
+    boxes, items = box_tensor([[1, 2, 3, 4], "bad", [1, 2]], dilation=1)
+    assert boxes.tolist() == [[0, 1, 4, 5]]
+    assert items == [[1, 2, 3, 4]]
+
+
+def test_is_per_frame():
+    assert is_per_frame([[[0, 0, 1, 1]], []])
+    assert not is_per_frame([[0, 0, 1, 1]])
+    assert not is_per_frame([])
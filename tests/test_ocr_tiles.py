@@ -0,0 +1,85 @@
+import random
+
+import numpy as np
+import pytest
+
+from ocr_tiles import column_spans, merge_overlap, merge_tile_texts, tile_layout
+
+
+def assert_covers(spans, total):
+    assert spans[0][0] == 0
+    assert spans[-1][1] == total
+    for (_s0, e0), (s1, _e1) in zip(spans, spans[1:]):
+        assert s1 <= e0
+
+
+@pytest.mark.parametrize("height,width,tile_size,overlap", [
+    (1000, 800, 896, 64),
+    (6000, 1200, 896, 64),
+    (3000, 5000, 896, 64),
+    (40000, 900, 512, 200),
+    (100, 100, 1024, 0),
+])
+def test_tile_layout_stays_within_pixel_budget(height, width, tile_size, overlap):
+    layout = tile_layout(height, width, tile_size, overlap)
+    assert layout[0][0] == 0 and layout[-1][1] == width
+    for (_a0, a1, _bands), (b0, _b1, _next) in zip(layout, layout[1:]):
+        assert a1 == b0
+    for x0, x1, bands in layout:
+        assert_covers(bands, height)
+        for y0, y1 in bands:
+            assert (x1 - x0) * (y1 - y0) <= tile_size * tile_size
+
+
+def test_tile_layout_random_pages():
+    rng = random.Random(0)
+    for _ in range(500):
+        tile_size = rng.randint(64, 2048)
+        height, width = rng.randint(1, 20000), rng.randint(1, 20000)
+        for x0, x1, bands in tile_layout(height, width, tile_size, rng.randint(0, 512)):
+            assert_covers(bands, height)
+            assert all((x1 - x0) * (y1 - y0) <= tile_size * tile_size for y0, y1 in bands)
+
+
+def test_narrow_page_is_cut_into_full_width_bands():
+    layout = tile_layout(5000, 600, 896, 64)
+    assert len(layout) == 1
+    x0, x1, bands = layout[0]
+    assert (x0, x1) == (0, 600)
+    assert len(bands) > 1
+    for (_s0, e0), (s1, _e1) in zip(bands, bands[1:]):
+        assert e0 - s1 >= 64
+
+
+def test_columns_are_cut_at_ink_minimum():
+    ink = np.ones(2000)
+    ink[850] = 0
+    assert column_spans(2000, 1000, ink)[0] == (0, 850)
+    assert column_spans(2000, 1000)[0] == (0, 1000)
+
+
+def test_merge_overlap_drops_lines_read_twice():
+    prev = ["first paragraph", "second paragraph", "third paragraph is cut"]
+    nxt = ["second paragraph", "third paragraph is cut off here", "fourth paragraph"]
+    merged = merge_overlap(prev, nxt)
+    assert merged.count("second paragraph") == 1
+    assert merged[0] == "first paragraph"
+    assert merged[-1] == "fourth paragraph"
+
+
+def test_merge_overlap_keeps_distinct_similar_lines():
+    prev = ["intro", "line one"]
+    nxt = ["line two", "outro"]
+    assert merge_overlap(prev, nxt) == prev + nxt
+
+
+def test_merge_overlap_ignores_short_matches():
+    # 页码这类短行即使相同也不视为重叠
+    prev = ["chapter text", "12"]
+    nxt = ["12", "more text"]
+    assert merge_overlap(prev, nxt) == prev + nxt
+
+
+def test_merge_tile_texts_joins_bands():
+    texts = ["alpha line\nbeta line here\n", "beta line here\ngamma line\n\n", "gamma line\ndelta line"]
+    assert merge_tile_texts(texts) == "alpha line\nbeta line here\ngamma line\ndelta line"
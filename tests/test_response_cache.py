@@ -0,0 +1,60 @@
+import numpy as np
+import torch
+
+from response_cache import ResponseCache
+
+make_key = ResponseCache.make_key
+
+
+def test_make_key_is_deterministic_and_order_independent_for_dicts():
+    a = make_key("node", {"temperature": 0.7, "seed": 1}, [{"role": "user", "content": "hi"}])
+    b = make_key("node", {"seed": 1, "temperature": 0.7}, [{"role": "user", "content": "hi"}])
+    assert a == b
+
+
+def test_make_key_changes_with_any_part():
+    base = make_key("node", {"seed": 1}, "prompt")
+    assert make_key("other", {"seed": 1}, "prompt") != base
+    assert make_key("node", {"seed": 2}, "prompt") != base
+    assert make_key("node", {"seed": 1}, "prompt!") != base
+    # 类型不同的相同文字不应冲突
+    assert make_key(1) != make_key("1")
+    assert make_key(["a", "b"]) != make_key(["ab"])
+
+
+def test_make_key_hashes_tensor_content():
+    image = torch.zeros((1, 8, 8, 3))
+    same = torch.zeros((1, 8, 8, 3))
+    changed = image.clone()
+    changed[0, 4, 4, 0] = 1.0
+    assert make_key(image) == make_key(same)
+    assert make_key(image) != make_key(changed)
+    assert make_key(image) != make_key(torch.zeros((1, 8, 3, 8)))
+    assert make_key(np.zeros(4, dtype=np.float32)) != make_key(np.zeros(4, dtype=np.float64))
+
+
+def test_memory_lru_evicts_oldest():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.get("b") is None
+
+
+def test_disk_round_trip_and_clear(tmp_path):
+    cache = ResponseCache(disk_dir=str(tmp_path))
+    cache.put("k", "value")
+    assert ResponseCache(disk_dir=str(tmp_path)).get("k") == "value"
+
+    cache.clear()
+    assert cache.get("k") is None
+    assert not list(tmp_path.glob("*.json"))
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = ResponseCache(enabled=False, disk_dir=str(tmp_path))
+    cache.put("k", "value")
+    assert cache.get("k") is None
+    assert not list(tmp_path.iterdir())
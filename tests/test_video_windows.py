@@ -0,0 +1,43 @@
+from video_windows import (SEGMENT_OVERHEAD, batch_summaries, caption_budget, merge_prompt,
+                           reduce_in_stages, split_windows)
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_split_windows_covers_all_frames():
+    assert split_windows(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert split_windows(3, 0) == [(0, 1), (1, 2), (2, 3)]
+    assert split_windows(0, 4) == []
+
+
+def test_batches_stay_within_budget():
+    summaries = [" ".join(["w"] * n) for n in (10, 30, 5, 40, 20, 8)]
+    budget = 80
+    batches = batch_summaries(summaries, budget, count_words)
+    assert [t for batch in batches for t in batch] == summaries
+    for batch in batches:
+        assert len(batch) == 1 or sum(count_words(t) + SEGMENT_OVERHEAD for t in batch) <= budget
+
+
+def test_reduce_in_stages_fits_budget():
+    budget = 200
+    caption = " ".join(["w"] * (caption_budget(budget) - 1))
+    stages = []
+
+    def merge(batch, stage):
+        stages.append(stage)
+        assert count_words(merge_prompt(batch)) > 0
+        return caption
+
+    result = reduce_in_stages([caption] * 50, budget, count_words, merge)
+    assert sum(count_words(t) + SEGMENT_OVERHEAD for t in result) <= budget
+    # 每一轮至少减半：50 -> 25 -> 13 -> 7 -> 4 -> 2
+    assert max(stages) <= 6
+
+
+def test_reduce_stops_when_captions_cannot_be_paired():
+    long = " ".join(["w"] * 100)
+    result = reduce_in_stages([long, long, long], 100, count_words, lambda batch, stage: "merged")
+    assert result == [long, long, long]
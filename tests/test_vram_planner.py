@@ -0,0 +1,101 @@
+import struct
+
+import pytest
+
+from gguf_layers import GGUFArray, read_gguf_info
+from vram_planner import COMPUTE_RESERVE_BYTES, DEFAULT_UBATCH, GB, plan_gpu_layers
+
+UINT32, STRING, ARRAY = 4, 8, 9
+F16 = 1
+
+
+def _string(text):
+    data = text.encode("utf-8")
+    return struct.pack("<Q", len(data)) + data
+
+
+def _value(value):
+    if isinstance(value, str):
+        return struct.pack("<I", STRING) + _string(value)
+    if isinstance(value, list):
+        return struct.pack("<IIQ", ARRAY, UINT32, len(value)) + struct.pack(f"<{len(value)}I", *value)
+    return struct.pack("<II", UINT32, value)
+
+
+def write_gguf(path, metadata, tensors):
+    """Minimal GGUF v3 file: metadata (uint32 / string / uint32 array) and F16 tensor infos"""
+    out = b"GGUF" + struct.pack("<IQQ", 3, len(tensors), len(metadata))
+    for key, value in metadata.items():
+        out += _string(key) + _value(value)
+    offset = 0
+    for name, shape in tensors:
+        out += _string(name) + struct.pack("<I", len(shape)) + struct.pack(f"<{len(shape)}Q", *shape)
+        out += struct.pack("<IQ", F16, offset)
+        offset += shape[0] * shape[1] * 2
+    out += b"\0" * (-len(out) % 32)
+    path.write_bytes(out)
+    return str(path)
+
+
+def llama_gguf(tmp_path, block_count=80, n_embd=1024, head_count_kv=8, **extra):
+    metadata = {
+        "general.architecture": "llama",
+        "llama.block_count": block_count,
+        "llama.embedding_length": n_embd,
+        "llama.attention.head_count": 8,
+        "llama.attention.head_count_kv": head_count_kv,
+        "llama.vocab_size": 1000,
+    }
+    metadata.update(extra)
+    tensors = [(f"blk.{i}.attn.weight", (n_embd, n_embd)) for i in range(block_count)]
+    tensors.append(("output.weight", (n_embd, 1000)))
+    return write_gguf(tmp_path / "model.gguf", metadata, tensors)
+
+
+LAYER_BYTES = 1024 * 1024 * 2
+RESERVE_BYTES = COMPUTE_RESERVE_BYTES + 1000 * DEFAULT_UBATCH * 4
+
+
+def kv_bytes(n_ctx, heads_kv, head_dim=128):
+    return n_ctx * heads_kv * head_dim * 2 * 2
+
+
+def test_long_per_layer_array_is_read_from_file(tmp_path):
+    counts = [8 if i % 2 else 4 for i in range(80)]
+    info = read_gguf_info(llama_gguf(tmp_path, head_count_kv=counts))
+    array = info.get_arch_value("attention.head_count_kv")
+    assert isinstance(array, GGUFArray) and array.count == 80
+    assert info.read_array(array) == counts
+
+    plan = plan_gpu_layers(info.path, 4096)
+    assert plan.kv_layer_bytes == [kv_bytes(4096, c) for c in counts]
+
+
+def test_no_limit_offloads_everything(tmp_path):
+    plan = plan_gpu_layers(llama_gguf(tmp_path), 4096)
+    assert plan.n_gpu_layers == 81
+    assert plan.layer_bytes == [LAYER_BYTES] * 80
+
+
+def test_limit_fits_whole_layers(tmp_path):
+    per_layer = LAYER_BYTES + kv_bytes(4096, 8)
+    limit = (RESERVE_BYTES + 10 * per_layer + per_layer // 2) / GB
+    plan = plan_gpu_layers(llama_gguf(tmp_path), 4096, limit)
+    assert plan.n_gpu_layers == 10
+
+
+def test_tiny_limit_keeps_one_gpu_layer(tmp_path):
+    plan = plan_gpu_layers(llama_gguf(tmp_path), 8192, 0.1)
+    assert plan.n_gpu_layers == 1
+
+
+def test_hybrid_model_only_counts_full_attention_layers(tmp_path):
+    path = llama_gguf(tmp_path, block_count=8, **{"llama.full_attention_interval": 4})
+    plan = plan_gpu_layers(path, 4096)
+    assert [bool(b) for b in plan.kv_layer_bytes] == [False, False, False, True] * 2
+
+
+def test_missing_block_count_raises(tmp_path):
+    path = write_gguf(tmp_path / "empty.gguf", {"general.architecture": "llama"}, [])
+    with pytest.raises(ValueError):
+        plan_gpu_layers(path, 4096)
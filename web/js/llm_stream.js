@@ -0,0 +1,47 @@
+import { app } from "../../../../scripts/app.js";
+import { api } from "../../../../scripts/api.js";
+
+// 大模型流式输出预览：后端通过 cj-nodes.llm-stream 事件推送已生成文本和速度
+function getPreviewWidget(node) {
+    let widget = node.widgets?.find(w => w.name === "stream_preview");
+    if (widget) return widget;
+
+    const wrap = document.createElement("div");
+    wrap.style.cssText = "display:flex;flex-direction:column;width:100%;height:100%;gap:2px;";
+
+    const status = document.createElement("div");
+    status.style.cssText = "font-size:11px;color:#8a8;";
+
+    const textarea = document.createElement("textarea");
+    textarea.readOnly = true;
+    textarea.style.cssText = "flex:1;width:100%;min-height:80px;resize:none;background:#1e1e1e;color:#ddd;border:1px solid #444;border-radius:4px;font-size:12px;padding:4px;box-sizing:border-box;";
+
+    wrap.appendChild(status);
+    wrap.appendChild(textarea);
+
+    widget = node.addDOMWidget("stream_preview", "流式输出", wrap, {
+        serialize: false,
+        getValue: () => textarea.value,
+        setValue: () => {}
+    });
+    widget.statusEl = status;
+    widget.textEl = textarea;
+    return widget;
+}
+
+app.registerExtension({
+    name: "CJ-Nodes.LLMStream",
+    setup() {
+        api.addEventListener("cj-nodes.llm-stream", ({ detail }) => {
+            const id = String(detail.node).split(":").pop();
+            const node = app.graph.getNodeById(Number(id)) || app.graph.getNodeById(id);
+            if (!node) return;
+
+            const widget = getPreviewWidget(node);
+            widget.textEl.value = detail.text;
+            widget.textEl.scrollTop = widget.textEl.scrollHeight;
+            widget.statusEl.textContent = `${detail.done ? "完成" : "生成中"} · ${detail.tokens} tokens · ${detail.tps} tokens/s`;
+            node.setDirtyCanvas(true, false);
+        });
+    }
+});